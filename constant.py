@@ -19,6 +19,25 @@ def read_config() -> Dict:
         return {}
 
 
+def write_config(updates: Dict) -> None:
+    """
+    update the entries of the config file, the others are kept
+
+    Raises:
+        ValueError: the config file can't be parsed, it is left untouched instead of losing the other entries
+    """
+    try:
+        with open(PATH_CONFIG, mode='r') as config_file:
+            current_config = json.load(config_file)
+    except FileNotFoundError:
+        current_config = {}
+    except json.decoder.JSONDecodeError as e:
+        raise ValueError(f"Invalid config file at: {PATH_CONFIG}, fix it before writing {list(updates)}") from e
+    new_config = {**current_config, **updates}
+    with open(PATH_CONFIG, mode='w') as config_file:
+        json.dump(new_config, config_file, indent=2)
+
+
 config: Dict = read_config()
 
 ZEROS: Tuple[int, int, int, int] = (0, 0, 0, 0)
@@ -38,6 +57,9 @@ CONFIG_DEFAULT_EDGE_BASELINE: str = 'DEFAULT_EDGE_BASELINE'
 CONFIG_DEFAULT_NORMAL_BASELINE: str = 'DEFAULT_NORMAL_BASELINE'
 CONFIG_DEFAULT_GRAYS_BASELINE: str = 'DEFAULT_GRAYS_BASELINE'
 CONFIG_DRIVER_SERIAL_PORT: str = 'DRIVER_SERIAL_PORT'
+CONFIG_SAMPLE_INTERVALS_MS: str = 'SAMPLE_INTERVALS_MS'
+CONFIG_DETECTION_FPS: str = 'DETECTION_FPS'
+CONFIG_DETECTOR_OPTIONS: str = 'DETECTOR_OPTIONS'
 
 PRE_COMPILE_CMD: bool = config.get(CONFIG_PRE_COMPILE_CMD, True)
 DRIVER_DEBUG_MODE: bool = config.get(CONFIG_DRIVER_DEBUG_MODE, False)
@@ -49,6 +71,16 @@ DEFAULT_EDGE_BASELINE: int = config.get(CONFIG_DEFAULT_EDGE_BASELINE, 1750)
 DEFAULT_NORMAL_BASELINE: int = config.get(CONFIG_DEFAULT_NORMAL_BASELINE, 1000)
 DEFAULT_GRAYS_BASELINE: int = config.get(CONFIG_DEFAULT_GRAYS_BASELINE, 1)
 DRIVER_SERIAL_PORT: str = config.get(CONFIG_DRIVER_SERIAL_PORT, None)
+# min sample interval of each on-board native read, trades the freshness for the bus load
+SAMPLE_INTERVALS_MS: Dict[str, float] = {'adc': 5, 'io': 0, 'accel': 0, 'gyro': 0, 'atti': 0,
+                                         **config.get(CONFIG_SAMPLE_INTERVALS_MS, {})}
+# apriltag detection fps of each motion state, 0 for detecting as fast as possible
+DETECTION_FPS: Dict[str, float] = {'rotating': 0, 'straight': 5, 'stopped': 10,
+                                   **config.get(CONFIG_DETECTION_FPS, {})}
+# the tunable apriltag DetectorOptions, written by the benchmark.tune_detector_options
+DETECTOR_OPTIONS: Dict = {'nthreads': 2, 'quad_decimate': 1.0, 'quad_blur': 0.0,
+                          'refine_edges': False, 'refine_decode': False, 'refine_pose': False,
+                          **config.get(CONFIG_DETECTOR_OPTIONS, {})}
 
 PATH_CACHE: str = os.path.join(PACKAGE_ROOT, DIRNAME_CACHE)
 PATH_LD: str = os.path.join(PACKAGE_ROOT, DIRNAME_LIB_SO)
@@ -37,6 +37,16 @@ class ActionFrame(object):
     def open_port(cls):
         cls._controller.start_msg_sending()
 
+    @classmethod
+    def bind_controller(cls, controller: CloseLoopController) -> None:
+        """
+        replace the controller shared by all the ActionFrames, the old one stops sending
+        :param controller: the new controller
+        :return: None
+        """
+        cls._controller.stop_msg_sending()
+        cls._controller = controller
+
     @classmethod
     def load_cache(cls) -> None:
         """
@@ -5,7 +5,7 @@ from typing import Union, Sequence, Tuple, List
 
 from numpy import zeros, average
 
-from repo.uptechStar.module.os_tools import load_lib
+from .os_tools import load_lib
 
 Location = Tuple[int | float, int | float]
 
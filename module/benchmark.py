@@ -0,0 +1,377 @@
+"""
+camera benchmarks: capture fps, apriltag detection latency, the tag-to-action latency and the gray histogram,
+the results are written as json so that the builds could be compared
+
+usage:
+    python -m <package>.module.benchmark <video> <output.json> [--tag-id 0] [--camera 0] [--tune]
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import warnings
+from time import perf_counter_ns, sleep, strftime
+from typing import Dict, List, Optional, Sequence, Tuple, Any, Union
+
+import cv2
+import numpy as np
+from apriltag import DetectorOptions, Detector
+
+from .utils import calcGrayHist, IncrementalGrayHist
+from ..constant import TAG_GROUP, DETECTOR_OPTIONS, CONFIG_DETECTOR_OPTIONS, write_config
+
+BenchmarkResult = Dict[str, Any]
+
+DEFAULT_RESOLUTIONS: Tuple[Tuple[int, int], ...] = ((320, 240), (640, 480), (1280, 720))
+
+# each entry overrides the options used by the TagDetector
+DEFAULT_DETECTOR_SWEEP: Tuple[Dict[str, Any], ...] = (
+    {},
+    {'quad_decimate': 2.0},
+    {'quad_decimate': 2.0, 'nthreads': 4},
+    {'nthreads': 1},
+    {'nthreads': 4},
+    {'refine_edges': True},
+    {'refine_edges': True, 'refine_decode': True},
+)
+BASE_DETECTOR_OPTIONS: Dict[str, Any] = dict(families=TAG_GROUP, border=1, debug=False, quad_contours=False,
+                                             **DETECTOR_OPTIONS)
+
+# the grid searched by the tune_detector_options
+TUNING_GRID: Dict[str, Tuple[Any, ...]] = {
+    'quad_decimate': (1.0, 1.5, 2.0, 3.0),
+    'quad_blur': (0.0, 0.8),
+    'nthreads': (1, 2, 4),
+    'refine_edges': (False, True),
+    'refine_decode': (False, True),
+}
+
+
+def summarize_ns(durations_ns: Sequence[int]) -> Dict[str, float]:
+    """
+    the statistics of the durations, in ms
+    """
+    if not durations_ns:
+        return {'count': 0}
+    durations_ms = np.asarray(durations_ns, dtype=np.float64) / 1e6
+    return {'count': len(durations_ms),
+            'mean_ms': float(durations_ms.mean()),
+            'p50_ms': float(np.percentile(durations_ms, 50)),
+            'p95_ms': float(np.percentile(durations_ms, 95)),
+            'max_ms': float(durations_ms.max())}
+
+
+def load_gray_frames(video_path: str, max_frames: Optional[int] = None) -> List[np.ndarray]:
+    capture = cv2.VideoCapture(video_path)
+    frames = []
+    while max_frames is None or len(frames) < max_frames:
+        success, frame = capture.read()
+        if not success:
+            break
+        frames.append(cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY))
+    capture.release()
+    return frames
+
+
+class PacedVideoCapture(object):
+    """
+    plays a video file at its own fps like a live camera, and records when every frame is delivered
+    """
+
+    def __init__(self, video_path: str, fps: Optional[float] = None):
+        self._capture: cv2.VideoCapture = cv2.VideoCapture(video_path)
+        self._frame_interval_ns: int = int(1e9 / (fps or self._capture.get(cv2.CAP_PROP_FPS) or 30))
+        self._start_ns: Optional[int] = None
+        self.frame_timestamps_ns: List[int] = []
+
+    def read(self, image: Optional[np.ndarray] = None) -> Tuple[bool, Optional[np.ndarray]]:
+        success, frame = self._capture.read(image=image)
+        if not success:
+            return False, None
+        if self._start_ns is None:
+            self._start_ns = perf_counter_ns()
+        due_ns = self._start_ns + len(self.frame_timestamps_ns) * self._frame_interval_ns
+        while perf_counter_ns() < due_ns:
+            sleep(0.0005)
+        self.frame_timestamps_ns.append(perf_counter_ns())
+        return True, frame
+
+    def get(self, prop_id: int) -> float:
+        return self._capture.get(prop_id)
+
+    def set(self, prop_id: int, value: float) -> bool:
+        return self._capture.set(prop_id, value)
+
+    def isOpened(self) -> bool:
+        return self._capture.isOpened()
+
+    def release(self) -> None:
+        self._capture.release()
+
+
+def benchmark_capture(source: Union[int, str], resolutions: Sequence[Tuple[int, int]] = DEFAULT_RESOLUTIONS,
+                      frame_count: int = 120) -> List[BenchmarkResult]:
+    """
+    measure the capture fps at each resolution, a video file keeps its own resolution
+    Args:
+        source: the camera device id or the path of a video file
+        resolutions: the (width, height) to request
+        frame_count: the count of the frames read at each resolution
+
+    Returns:
+        the result of each resolution
+    """
+    results = []
+    for width, height in resolutions:
+        capture = cv2.VideoCapture(source)
+        capture.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        capture.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        buffer = None
+        durations = []
+        for _ in range(frame_count):
+            start = perf_counter_ns()
+            success, buffer = capture.read(image=buffer)
+            if not success:
+                break
+            durations.append(perf_counter_ns() - start)
+        total_ns = sum(durations)
+        results.append({'requested_resolution': [width, height],
+                        'actual_resolution': [int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                                              int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))],
+                        'fps': len(durations) * 1e9 / total_ns if total_ns else 0.,
+                        'frame_time': summarize_ns(durations)})
+        capture.release()
+    return results
+
+
+def benchmark_detection(frames: Sequence[np.ndarray],
+                        options_sweep: Sequence[Dict[str, Any]] = DEFAULT_DETECTOR_SWEEP) -> List[BenchmarkResult]:
+    """
+    measure the detection latency and the detection rate of each DetectorOptions
+    Args:
+        frames: the gray frames
+        options_sweep: each entry overrides the BASE_DETECTOR_OPTIONS
+
+    Returns:
+        the result of each options
+    """
+    results = []
+    for overrides in options_sweep:
+        detect = Detector(DetectorOptions(**{**BASE_DETECTOR_OPTIONS, **overrides})).detect
+        durations = []
+        detected_frames = 0
+        tag_count = 0
+        for gray in frames:
+            start = perf_counter_ns()
+            tags = detect(gray)
+            durations.append(perf_counter_ns() - start)
+            detected_frames += bool(tags)
+            tag_count += len(tags)
+        results.append({'options': overrides,
+                        'latency': summarize_ns(durations),
+                        'fps': len(durations) * 1e9 / sum(durations) if durations else 0.,
+                        'detection_rate': detected_frames / len(frames) if frames else 0.,
+                        'tags_per_frame': tag_count / len(frames) if frames else 0.})
+    return results
+
+
+def benchmark_gray_hist(frames: Sequence[np.ndarray], stride: int = 4, tolerance: int = 4,
+                        noise: int = 0, seed: int = 0) -> BenchmarkResult:
+    """
+    compare the IncrementalGrayHist with the strided calcGrayHist and the cv2.calcHist on the same frames
+    Args:
+        frames: the gray frames
+        stride: the sampling stride of both
+        tolerance: the tolerance of the IncrementalGrayHist
+        noise: the amplitude of the uniform noise added to the frames, as the sensor noise of a real camera
+        seed: the seed of the noise
+
+    Returns:
+        the latencies of all three, and how many updates of the incremental one fell back to the recompute
+    """
+    if noise:
+        rng = np.random.default_rng(seed)
+        frames = [np.clip(gray.astype(np.int16) + rng.integers(-noise, noise + 1, gray.shape), 0, 255)
+                  .astype(np.uint8) for gray in frames]
+    full_durations = []
+    for gray in frames:
+        start = perf_counter_ns()
+        calcGrayHist(gray, stride)
+        full_durations.append(perf_counter_ns() - start)
+    calc_hist_durations = []
+    for gray in frames:
+        start = perf_counter_ns()
+        cv2.calcHist([gray[::stride, ::stride]], [0], None, [256], [0, 256])
+        calc_hist_durations.append(perf_counter_ns() - start)
+    hist = IncrementalGrayHist(stride, tolerance)
+    hist.update(frames[0])
+    incremental_durations = []
+    for gray in frames[1:]:
+        start = perf_counter_ns()
+        hist.update(gray)
+        incremental_durations.append(perf_counter_ns() - start)
+    return {'stride': stride, 'tolerance': tolerance, 'noise': noise,
+            'full': summarize_ns(full_durations),
+            'calc_hist': summarize_ns(calc_hist_durations),
+            'incremental': summarize_ns(incremental_durations),
+            'full_updates': hist.full_updates - 1,
+            'incremental_updates': hist.incremental_updates}
+
+
+def pareto_front(results: Sequence[BenchmarkResult]) -> List[BenchmarkResult]:
+    """
+    the results not dominated by any other on both the fps and the detection rate
+    """
+    return [result for result in results
+            if not any(other['fps'] >= result['fps'] and other['detection_rate'] >= result['detection_rate']
+                       and (other['fps'] > result['fps'] or other['detection_rate'] > result['detection_rate'])
+                       for other in results)]
+
+
+def tune_detector_options(video_path: str, max_frames: int = 150, min_rate_ratio: float = 0.95,
+                          grid: Optional[Dict[str, Sequence[Any]]] = None, save: bool = True) -> BenchmarkResult:
+    """
+    sweep the DetectorOptions over a recorded clip, and pick the fastest options on the pareto front
+    that still detects at least min_rate_ratio of the best detection rate
+    Args:
+        video_path: a clip recorded with the camera and the lighting to tune for
+        max_frames: the max count of the frames used
+        min_rate_ratio: the detection rate required, relative to the best one in the sweep
+        grid: the values to sweep of each option, defaults to the TUNING_GRID
+        save: write the chosen options into the config.json, loaded by the TagDetector at startup
+
+    Returns:
+        the result of the chosen options
+    """
+    from itertools import product
+
+    grid = grid if grid else TUNING_GRID
+    cpu_count = os.cpu_count() or 1
+    sweep = [dict(zip(grid, values)) for values in product(*grid.values())]
+    # more threads than the cores only adds the switching cost
+    sweep = [options for options in sweep if options.get('nthreads', 1) <= cpu_count]
+    results = benchmark_detection(load_gray_frames(video_path, max_frames), sweep)
+    best_rate = max(result['detection_rate'] for result in results)
+    candidates = [result for result in pareto_front(results) if result['detection_rate'] >= best_rate * min_rate_ratio]
+    chosen = max(candidates, key=lambda result: result['fps'])
+    if save:
+        write_config({CONFIG_DETECTOR_OPTIONS: {**DETECTOR_OPTIONS, **chosen['options']}})
+    return chosen
+
+
+def first_frame_with_tag(frames: Sequence[np.ndarray], tag_id: int) -> Optional[int]:
+    detect = Detector(DetectorOptions(**BASE_DETECTOR_OPTIONS)).detect
+    for index, gray in enumerate(frames):
+        if any(tag.tag_id == tag_id for tag in detect(gray)):
+            return index
+    return None
+
+
+def benchmark_tag_to_action(video_path: str, tag_id: int, appear_frame: int,
+                            action_speed: Tuple[int, int, int, int] = (500, 500, 500, 500),
+                            timeout: float = 10.) -> BenchmarkResult:
+    """
+    play the video like a live camera through the TagDetector, react to the tag with the ActionPlayer,
+    and measure from the frame the tag appears in to the cmd received by a simulated motor driver
+    Args:
+        video_path: the path of the video file
+        tag_id: the tag to react to
+        appear_frame: the index of the first frame containing the tag
+        action_speed: the speed of the reacting ActionFrame
+        timeout: give up if the reaction doesn't happen in this time, in seconds
+
+    Returns:
+        the latencies from the tag appearance to the tag id change and to the cmd received, in ms
+    """
+    from .simulation import SimulationBackend
+
+    cmd_log: List[Tuple[int, str]] = []
+    backend = SimulationBackend(cmd_handler=lambda cmd: cmd_log.append((perf_counter_ns(), cmd)))
+    backend.install()
+    # the actions module opens the motor driver on import, so it is imported after the backend is installed
+    from .actions import ActionFrame, ActionPlayer
+    from .tagdetector import TagDetector
+
+    capture = PacedVideoCapture(video_path)
+    detector = TagDetector(capture, 'blue', start_detect_tag=False, minimal_resolution=False)
+    player = ActionPlayer()
+    action = ActionFrame(action_speed=action_speed)
+    result: BenchmarkResult = {'tag_id': tag_id, 'appear_frame': appear_frame}
+    try:
+        detector.apriltag_detect_start()
+        deadline = perf_counter_ns() + int(timeout * 1e9)
+        while detector.tag_id != tag_id:
+            if perf_counter_ns() > deadline:
+                result['error'] = 'tag not detected'
+                return result
+            sleep(0.0005)
+        detected_ns = perf_counter_ns()
+        player.append(action)
+        while not any(timestamp_ns >= detected_ns for timestamp_ns, _ in cmd_log):
+            if perf_counter_ns() > deadline:
+                result['error'] = 'cmd not received'
+                return result
+            sleep(0.0005)
+        received_ns = next(timestamp_ns for timestamp_ns, _ in cmd_log if timestamp_ns >= detected_ns)
+        appeared_ns = capture.frame_timestamps_ns[appear_frame]
+        result.update({'tag_detected_ms': (detected_ns - appeared_ns) / 1e6,
+                       'cmd_received_ms': (received_ns - appeared_ns) / 1e6,
+                       'dispatch_ms': (received_ns - detected_ns) / 1e6})
+        return result
+    finally:
+        detector.detect_should_continue = False
+        sleep(0.1)
+        backend.driver.close()
+
+
+def run_benchmarks(video_path: str, output_path: str, tag_id: Optional[int] = None,
+                   camera: Optional[int] = None, max_frames: int = 300) -> BenchmarkResult:
+    """
+    run all the benchmarks and write the results into a json file
+    Args:
+        video_path: the recorded video, used by the detection and the tag-to-action benchmarks
+        output_path: the path of the json file
+        tag_id: the tag for the tag-to-action benchmark, skipped if not given
+        camera: the device id for the capture benchmark, the video is used if not given
+        max_frames: the max count of the frames used by the detection benchmark
+
+    Returns:
+        the results written
+    """
+    frames = load_gray_frames(video_path, max_frames)
+    results: BenchmarkResult = {
+        'time': strftime('%Y-%m-%d %H:%M:%S'),
+        'platform': platform.platform(),
+        'python': sys.version.split()[0],
+        'opencv': cv2.__version__,
+        'cpu_count': os.cpu_count(),
+        'video': video_path,
+        'frames': len(frames),
+        'capture': benchmark_capture(video_path if camera is None else camera),
+        'detection': benchmark_detection(frames),
+        'gray_hist': [benchmark_gray_hist(frames, noise=noise) for noise in (0, 2)],
+    }
+    if tag_id is not None:
+        appear_frame = first_frame_with_tag(frames, tag_id)
+        if appear_frame is None:
+            warnings.warn(f'##tag {tag_id} not found in {video_path}, skipping the tag-to-action benchmark##')
+        else:
+            results['tag_to_action'] = benchmark_tag_to_action(video_path, tag_id, appear_frame)
+    with open(output_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='camera and apriltag benchmarks')
+    parser.add_argument('video', help='the recorded video')
+    parser.add_argument('output', help='the json file to write the results into')
+    parser.add_argument('--tag-id', type=int, default=None, help='the tag for the tag-to-action benchmark')
+    parser.add_argument('--camera', type=int, default=None, help='the device id for the capture benchmark')
+    parser.add_argument('--max-frames', type=int, default=300)
+    parser.add_argument('--tune', action='store_true', help='tune the DetectorOptions and save them to the config')
+    args = parser.parse_args()
+    if args.tune:
+        print(tune_detector_options(args.video))
+    run_benchmarks(args.video, args.output, args.tag_id, args.camera, args.max_frames)
@@ -1,14 +1,71 @@
+import os
 import warnings
-from time import time
-from typing import Tuple, Optional, List
+from threading import Thread, Condition
+from time import time, perf_counter_ns, strftime
+from typing import Tuple, Optional, List, Callable, NamedTuple
 
 import cv2
+import numpy as np
+
+# (sequence number, capture timestamp in perf_counter_ns, frame)
+GrabbedFrame = Tuple[int, int, np.ndarray]
+# called in the grabbing thread with every frame and its capture timestamp, the frame is only valid during the call
+FrameSink = Callable[[np.ndarray, int], None]
+
+
+class CameraMode(NamedTuple):
+    """
+    the mode negotiated with the camera, immutable, so it is replaced as a whole on the reconfiguration,
+    the readers holding the old one always see a consistent size and center
+    """
+    width: int
+    height: int
+    fps: float
+
+    @property
+    def center(self) -> Tuple[float, float]:
+        return self.width / 2, self.height / 2
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.height, self.width
+
+
+def read_camera_mode(camera: cv2.VideoCapture) -> CameraMode:
+    """
+    the mode the camera is running in
+    """
+    return CameraMode(int(camera.get(cv2.CAP_PROP_FRAME_WIDTH)), int(camera.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                      camera.get(cv2.CAP_PROP_FPS))
+
+
+def negotiate_camera_mode(camera: cv2.VideoCapture, width: Optional[int] = None, height: Optional[int] = None,
+                          fps: Optional[float] = None) -> CameraMode:
+    """
+    request a mode of the camera, the driver picks the nearest one it supports.
+    NOTE: must not be called while another thread is reading the camera
+    Args:
+        width: None to keep the current one, 1 for the minimal one
+        height: None to keep the current one, 1 for the minimal one
+        fps: None to keep the current one
+
+    Returns:
+        the mode actually negotiated
+    """
+    if width is not None:
+        camera.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+    if height is not None:
+        camera.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+    if fps is not None:
+        camera.set(cv2.CAP_PROP_FPS, fps)
+    return read_camera_mode(camera)
 
 
 class Camera(object):
 
     def __init__(self, device_id: int = 0):
         # 使用 cv2.VideoCapture(0) 创建视频捕获对象，从默认摄像头捕获视频。
+        self._mode: Optional[CameraMode] = None
         self._frame_center: Optional[Tuple[int, int]] = None
         self._origin_fps: Optional[int] = None
         self._origin_height: Optional[float] = None
@@ -32,6 +89,7 @@ class Camera(object):
             self._origin_height: int = int(self._camera.get(cv2.CAP_PROP_FRAME_HEIGHT))
             self._origin_fps: int = int(self._camera.get(cv2.CAP_PROP_FPS))
             self._frame_center: Tuple = (int(self._origin_width / 2), int(self._origin_height / 2))
+            self._mode = read_camera_mode(self._camera)
             print(f"CAMERA RESOLUTION：{int(self._origin_width)}x{int(self._origin_height)}\n"
                   f"CAMERA FPS: [{self._origin_fps}]\n"
                   f"CAM CENTER: [{self._frame_center}]")
@@ -84,10 +142,29 @@ class Camera(object):
         """
         return self._frame_center
 
+    @property
+    def mode(self) -> Optional[CameraMode]:
+        """
+        the mode negotiated with the camera, None if the camera is not opened
+        Returns:
+
+        """
+        return self._mode
+
     def _update_cam_center(self) -> None:
-        width = self._camera.get(cv2.CAP_PROP_FRAME_WIDTH)
-        height = self._camera.get(cv2.CAP_PROP_FRAME_HEIGHT)
-        self._frame_center = (int(width / 2), int(height / 2))
+        self._mode = read_camera_mode(self._camera)
+        self._frame_center = (int(self._mode.width / 2), int(self._mode.height / 2))
+
+    def reconfigure(self, width: Optional[int] = None, height: Optional[int] = None,
+                    fps: Optional[float] = None) -> CameraMode:
+        """
+        renegotiate the resolution and the fps at runtime, the frame center follows the negotiated mode
+        Returns:
+            the negotiated mode
+        """
+        negotiate_camera_mode(self._camera, width, height, fps)
+        self._update_cam_center()
+        return self._mode
 
     def set_cam_resolution(self, new_width: Optional[int] = None, new_height: Optional[int] = None,
                            resolution_multiplier: Optional[float] = None) -> None:
@@ -98,12 +175,10 @@ class Camera(object):
         assert (new_width is not None and new_height is not None) or (
                 resolution_multiplier is not None), 'Please specify the resolution params'
         if resolution_multiplier:
-            self._camera.set(cv2.CAP_PROP_FRAME_WIDTH, int(resolution_multiplier * self._origin_width))
-            self._camera.set(cv2.CAP_PROP_FRAME_HEIGHT, int(resolution_multiplier * self._origin_height))
+            self.reconfigure(int(resolution_multiplier * self._origin_width),
+                             int(resolution_multiplier * self._origin_height))
         else:
-            self._camera.set(cv2.CAP_PROP_FRAME_WIDTH, new_width)
-            self._camera.set(cv2.CAP_PROP_FRAME_HEIGHT, new_height)
-        self._update_cam_center()
+            self.reconfigure(new_width, new_height)
 
     @property
     def camera_device(self) -> cv2.VideoCapture:
@@ -163,3 +238,256 @@ class Camera(object):
         if to_gray:
             frame = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
         cv2.imwrite(save_path, frame)
+
+
+class LatestFrameGrabber(object):
+    """
+    keeps reading the camera in a thread and holds only the newest frame, the older ones are dropped,
+    so the consumer always works on what the camera sees now instead of the frames queued in the V4L2 buffer.
+
+    three preallocated buffers rotate between the grabber, the newest frame and the consumer,
+    the frame returned to the consumer is never overwritten until it asks for the next one
+    """
+
+    def __init__(self, camera: cv2.VideoCapture, frame_sink: Optional[FrameSink] = None):
+        """
+
+        Args:
+            camera: the opened capture
+            frame_sink: sees every frame grabbed, including the dropped ones, such as the RingRecorder.push
+        """
+        self._camera: cv2.VideoCapture = camera
+        self.frame_sink: Optional[FrameSink] = frame_sink
+        self._condition: Condition = Condition()
+        self._grabbing_buffer: Optional[np.ndarray] = None
+        self._latest_buffer: Optional[np.ndarray] = None
+        self._consuming_buffer: Optional[np.ndarray] = None
+        self._latest_seq: int = 0
+        self._latest_timestamp_ns: int = 0
+        self._consumed_seq: int = 0
+        self._should_continue: bool = False
+        self._thread: Optional[Thread] = None
+
+        self.frames_grabbed: int = 0
+        self.frames_dropped: int = 0
+
+    @property
+    def is_running(self) -> bool:
+        return self._should_continue
+
+    def start(self) -> None:
+        """
+        start the grabbing thread, the frames grabbed before the restart are never delivered
+        """
+        if self._should_continue:
+            return
+        with self._condition:
+            self._consumed_seq = self._latest_seq
+            self._should_continue = True
+        self._thread = Thread(target=self._grabbing_loop, name='latest_frame_grabber_thread')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        stop the grabbing thread, the consumer waiting for a frame is woken up with None
+        """
+        with self._condition:
+            self._should_continue = False
+            self._condition.notify_all()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _grabbing_loop(self) -> None:
+        read = self._camera.read
+        condition = self._condition
+        while self._should_continue:
+            success, frame = read(image=self._grabbing_buffer)
+            timestamp_ns = perf_counter_ns()
+            if not success:
+                break
+            self.frame_sink(frame, timestamp_ns) if self.frame_sink else None
+            with condition:
+                if self._latest_seq > self._consumed_seq:
+                    self.frames_dropped += 1
+                # the buffer read into becomes the newest frame, the replaced one is reused by the next read
+                self._grabbing_buffer, self._latest_buffer = self._latest_buffer, frame
+                self._latest_seq += 1
+                self._latest_timestamp_ns = timestamp_ns
+                self.frames_grabbed += 1
+                condition.notify_all()
+        with condition:
+            self._should_continue = False
+            condition.notify_all()
+
+    def wait_latest(self, timeout: Optional[float] = None) -> Optional[GrabbedFrame]:
+        """
+        wait for a frame newer than the last one returned
+        Args:
+            timeout: in seconds, None for waiting forever
+
+        Returns:
+            the newest frame, None if timed out or the grabber stopped.
+            NOTE: the frame is valid until the next call
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._latest_seq > self._consumed_seq
+                                                    or not self._should_continue, timeout):
+                return None
+            if self._latest_seq <= self._consumed_seq:
+                return None
+            self._consuming_buffer, self._latest_buffer = self._latest_buffer, self._consuming_buffer
+            self._consumed_seq = self._latest_seq
+            return self._latest_seq, self._latest_timestamp_ns, self._consuming_buffer
+
+
+class RingRecorder(object):
+    """
+    keeps the last seconds of frames in a preallocated ring and dumps them to the disk on a trigger,
+    so there is no disk io during the match, only the footage around an incident is written.
+
+    there are two rings, a trigger swaps them in O(1), the frozen one is encoded by the worker thread
+    while the frames keep going into the other one. the triggers during the encoding are dropped.
+    the MJPG is used by default, it is cheap to encode on the board and needs no hardware encoder
+    """
+
+    def __init__(self, seconds: float = 5., fps: float = 30., save_dir: str = 'recordings', fourcc: str = 'MJPG'):
+        """
+
+        Args:
+            seconds: the length of the footage kept
+            fps: the expected frame rate, the ring holds seconds * fps frames
+            save_dir: where the clips are saved
+            fourcc: the codec of the clips
+        """
+        self._capacity: int = max(int(seconds * fps), 1)
+        self._save_dir: str = save_dir
+        self._fourcc: int = cv2.VideoWriter_fourcc(*fourcc)
+        self._condition: Condition = Condition()
+        # allocated on the first frame, reallocated only when the resolution changes
+        self._rings: List[np.ndarray] = []
+        self._timestamps: List[np.ndarray] = []
+        self._active: int = 0
+        self._write_index: int = 0
+        self._count: int = 0
+        # (ring index, start index, frame count, save path) of the clip waiting for the encoder
+        self._pending: Optional[Tuple[int, int, int, str]] = None
+
+        self.frames_pushed: int = 0
+        self.clips_written: int = 0
+        self.triggers_dropped: int = 0
+        self.last_clip_path: Optional[str] = None
+
+        self._should_continue: bool = True
+        self._encoder: Thread = Thread(target=self._encoding_loop, name='ring_recorder_encoder_thread')
+        self._encoder.daemon = True
+        self._encoder.start()
+
+    @property
+    def buffered_frames(self) -> int:
+        return self._count
+
+    @property
+    def is_encoding(self) -> bool:
+        return self._pending is not None
+
+    def push(self, frame: np.ndarray, timestamp_ns: Optional[int] = None) -> None:
+        """
+        copy the frame into the ring, overwriting the oldest one
+        """
+        timestamp_ns = perf_counter_ns() if timestamp_ns is None else timestamp_ns
+        with self._condition:
+            if not self._rings or self._rings[0].shape[1:] != frame.shape:
+                if self._pending is not None:
+                    # can't reallocate the ring being encoded
+                    return
+                self._rings = [np.empty((self._capacity,) + frame.shape, dtype=frame.dtype) for _ in range(2)]
+                self._timestamps = [np.zeros(self._capacity, dtype=np.int64) for _ in range(2)]
+                self._write_index = self._count = 0
+            index = self._write_index
+            self._rings[self._active][index] = frame
+            self._timestamps[self._active][index] = timestamp_ns
+            self._write_index = (index + 1) % self._capacity
+            self._count = min(self._count + 1, self._capacity)
+            self.frames_pushed += 1
+
+    def trigger(self, reason: str = 'trigger') -> Optional[str]:
+        """
+        freeze the buffered frames and have them encoded in the background, never blocks on the disk
+        Args:
+            reason: appended to the file name
+
+        Returns:
+            the path the clip will be saved to, None if nothing is buffered or the last clip is still encoding
+        """
+        with self._condition:
+            if self._pending is not None or not self._count:
+                self.triggers_dropped += 1
+                return None
+            path = os.path.join(self._save_dir, f'{strftime("%Y%m%d-%H%M%S")}_{self.clips_written}_{reason}.avi')
+            start = (self._write_index - self._count) % self._capacity
+            self._pending = (self._active, start, self._count, path)
+            self._active ^= 1
+            self._write_index = self._count = 0
+            self._condition.notify_all()
+        return path
+
+    def wrap_watcher(self, watcher: Callable[[], bool], reason: str = 'watcher') -> Callable[[], bool]:
+        """
+        a watcher that also dumps the footage when the watcher turns True, such as a breaker of the ActionFrame
+        """
+        last_status = False
+
+        def _recording_watcher() -> bool:
+            nonlocal last_status
+            status = watcher()
+            if status and not last_status:
+                self.trigger(reason)
+            last_status = status
+            return status
+
+        return _recording_watcher
+
+    def _encoding_loop(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending is not None or not self._should_continue)
+                if self._pending is None:
+                    break
+                ring_index, start, count, path = self._pending
+            frames, timestamps = self._rings[ring_index], self._timestamps[ring_index]
+            order = [(start + i) % self._capacity for i in range(count)]
+            span_ns = timestamps[order[-1]] - timestamps[order[0]]
+            # the clip plays at the rate the frames were actually captured
+            fps = (count - 1) * 1e9 / span_ns if count > 1 and span_ns > 0 else 30.
+            height, width = frames.shape[1:3]
+            try:
+                os.makedirs(self._save_dir, exist_ok=True)
+                writer = cv2.VideoWriter(path, self._fourcc, fps, (width, height), frames.ndim == 4)
+                for index in order:
+                    writer.write(frames[index])
+                writer.release()
+                self.clips_written += 1
+                self.last_clip_path = path
+            except (OSError, cv2.error) as error:
+                warnings.warn(f'##RingRecorder: failed to write {path}: {error}##')
+            with self._condition:
+                self._pending = None
+                self._condition.notify_all()
+
+    def wait_encoded(self, timeout: Optional[float] = None) -> bool:
+        """
+        wait until the pending clip is written
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self._pending is None, timeout)
+
+    def close(self) -> None:
+        """
+        finish the pending clip and stop the encoder
+        """
+        with self._condition:
+            self._should_continue = False
+            self._condition.notify_all()
+        self._encoder.join()
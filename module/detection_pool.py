@@ -0,0 +1,218 @@
+"""
+multiprocess apriltag detection, the frames are passed through the shared memory and
+the detections come back as compact records, so the detection doesn't compete with the control loop for the GIL
+"""
+import multiprocessing
+from multiprocessing.connection import Connection, wait
+from multiprocessing.shared_memory import SharedMemory
+from threading import Thread, Condition
+from typing import Callable, List, Tuple, Optional, Dict
+
+import numpy as np
+from apriltag import DetectorOptions, Detector, Detection
+
+DETECTION_RECORD_DTYPE = np.dtype([('tag_id', np.int32),
+                                   ('hamming', np.int32),
+                                   ('goodness', np.float32),
+                                   ('decision_margin', np.float32),
+                                   ('homography', np.float64, (3, 3)),
+                                   ('center', np.float64, (2,)),
+                                   ('corners', np.float64, (4, 2))])
+
+# called with the detections, the capture timestamp and the source of the frame they come from
+ResultHandler = Callable[[List[Detection], int, int], None]
+
+
+def encode_detections(tags: List[Detection]) -> bytes:
+    records = np.empty(len(tags), dtype=DETECTION_RECORD_DTYPE)
+    for record, tag in zip(records, tags):
+        record['tag_id'] = tag.tag_id
+        record['hamming'] = tag.hamming
+        record['goodness'] = tag.goodness
+        record['decision_margin'] = tag.decision_margin
+        record['homography'] = tag.homography
+        record['center'] = tag.center
+        record['corners'] = tag.corners
+    return records.tobytes()
+
+
+def decode_detections(data: bytes, tag_family: bytes) -> List[Detection]:
+    return [Detection(tag_family, int(record['tag_id']), int(record['hamming']), float(record['goodness']),
+                      float(record['decision_margin']), record['homography'], record['center'], record['corners'])
+            for record in np.frombuffer(data, dtype=DETECTION_RECORD_DTYPE)]
+
+
+def _detection_worker(options: DetectorOptions, shm_name: str, conn: Connection) -> None:
+    """
+    the detection process, receives the (height, width) of the frame in the shared memory,
+    and sends back the encoded detections
+    """
+    shm = SharedMemory(name=shm_name)
+    detect = Detector(options).detect
+    try:
+        while True:
+            task = conn.recv()
+            if task is None:
+                break
+            gray = np.ndarray(task, dtype=np.uint8, buffer=shm.buf)
+            conn.send_bytes(encode_detections(detect(gray)))
+            # the shared memory can't be closed while a view of it is alive
+            del gray
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        shm.close()
+
+
+class DetectionPool(object):
+    """
+    a pool of detection processes, each owns a shared memory slot of a frame.
+
+    the frames are dispatched round-robin to the idle workers, they may come from several sources(cameras).
+    the results are collected by a thread and handed to the result handler in the capture order of each source,
+    the results of the frames older than the last handled one of the same source are dropped
+    """
+
+    def __init__(self, options: DetectorOptions, frame_shape: Tuple[int, int], process_count: int,
+                 result_handler: ResultHandler):
+        """
+
+        Args:
+            options: the options of the detectors
+            frame_shape: the max (height, width) of the gray frames
+            process_count: the count of the detection processes
+            result_handler: called in the collector thread with every result
+        """
+        self._frame_size: int = frame_shape[0] * frame_shape[1]
+        self._tag_family: bytes = options.families.encode() if isinstance(options.families, str) \
+            else options.families
+        self._result_handler: ResultHandler = result_handler
+        self._condition: Condition = Condition()
+
+        self._shms: List[SharedMemory] = []
+        self._conns: List[Connection] = []
+        self._processes: List[multiprocessing.Process] = []
+        self._busy: List[bool] = [False] * process_count
+        self._timestamps: List[int] = [0] * process_count
+        self._sources: List[int] = [0] * process_count
+        self._next_worker: int = 0
+        self._last_handled_timestamps: Dict[int, int] = {}
+        for _ in range(process_count):
+            shm = SharedMemory(create=True, size=self._frame_size)
+            parent_conn, child_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_detection_worker, args=(options, shm.name, child_conn),
+                                              name='apriltag_detect_worker', daemon=True)
+            process.start()
+            child_conn.close()
+            self._shms.append(shm)
+            self._conns.append(parent_conn)
+            self._processes.append(process)
+
+        self.frames_submitted: int = 0
+        self.results_dropped: int = 0
+
+        self._should_continue: bool = True
+        self._collector: Thread = Thread(target=self._collecting_loop, name='apriltag_detect_collector_thread')
+        self._collector.daemon = True
+        self._collector.start()
+
+    @property
+    def process_count(self) -> int:
+        return len(self._processes)
+
+    @property
+    def frame_size(self) -> int:
+        """
+        the max size of the frames in bytes
+        """
+        return self._frame_size
+
+    def _idle_worker(self) -> Optional[int]:
+        """
+        the next idle worker in the round-robin order
+        """
+        count = len(self._busy)
+        for i in range(count):
+            index = (self._next_worker + i) % count
+            if not self._busy[index]:
+                return index
+        return None
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        """
+        wait until any of the workers is idle
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self._idle_worker() is not None or not self._should_continue,
+                                            timeout) and self._should_continue
+
+    def submit(self, gray: np.ndarray, timestamp_ns: int, source: int = 0) -> bool:
+        """
+        copy the frame to an idle worker and start the detection, never blocks
+        Args:
+            gray: the gray frame
+            timestamp_ns: the capture time of the frame
+            source: the index of the camera the frame comes from, handed back with the result
+
+        Returns:
+            False if all the workers are busy, the frame is not submitted
+        """
+        if gray.size > self._frame_size:
+            raise ValueError(f'frame of {gray.shape} is larger than the shared memory of {self._frame_size} bytes')
+        with self._condition:
+            index = self._idle_worker()
+            if index is None:
+                return False
+            self._busy[index] = True
+            self._timestamps[index] = timestamp_ns
+            self._sources[index] = source
+            self._next_worker = (index + 1) % len(self._busy)
+        np.ndarray(gray.shape, dtype=np.uint8, buffer=self._shms[index].buf)[...] = gray
+        self._conns[index].send(gray.shape)
+        self.frames_submitted += 1
+        return True
+
+    def _collecting_loop(self) -> None:
+        conn_indexes = {conn: index for index, conn in enumerate(self._conns)}
+        while self._should_continue:
+            for conn in wait(self._conns, timeout=0.1):
+                try:
+                    data = conn.recv_bytes()
+                except (EOFError, OSError):
+                    self._should_continue = False
+                    break
+                index = conn_indexes[conn]
+                with self._condition:
+                    timestamp_ns = self._timestamps[index]
+                    source = self._sources[index]
+                    self._busy[index] = False
+                    self._condition.notify_all()
+                if timestamp_ns < self._last_handled_timestamps.get(source, 0):
+                    self.results_dropped += 1
+                    continue
+                self._last_handled_timestamps[source] = timestamp_ns
+                self._result_handler(decode_detections(data, self._tag_family), timestamp_ns, source)
+        with self._condition:
+            self._should_continue = False
+            self._condition.notify_all()
+
+    def close(self) -> None:
+        """
+        stop the workers and release the shared memory
+        """
+        self._should_continue = False
+        for conn in self._conns:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+        for process in self._processes:
+            process.join(timeout=1.)
+            if process.is_alive():
+                process.terminate()
+        self._collector.join()
+        for conn in self._conns:
+            conn.close()
+        for shm in self._shms:
+            shm.close()
+            shm.unlink()
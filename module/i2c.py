@@ -1,13 +1,42 @@
+import math
+import sys
 from abc import ABCMeta, abstractmethod
-from typing import Callable, Optional, Tuple, final
+from array import array
+from ctypes import c_uint16, c_uint8, Array
+from time import perf_counter_ns, sleep
+from typing import Callable, Optional, Tuple, final, List, Dict, TypeVar
 
+from .libuptech import IO_OP_LEVELS, IO_OP_MODES, IO_OP_SAMPLE, IO_OP_DELAY, IO_OP_WAIT_HIGH, IO_EXEC_TIMEOUT
 from .onboardsensors import \
     PinSetter, pin_setter_constructor, \
     PinGetter, pin_getter_constructor, \
     PinModeSetter, pin_mode_setter_constructor, \
-    HIGH, LOW, OUTPUT, INPUT, multiple_pin_mode_setter_constructor, IndexedGetter, IndexedSetter
+    HIGH, LOW, OUTPUT, INPUT, multiple_pin_mode_setter_constructor, IndexedGetter, IndexedSetter, \
+    MaskedSetter, masked_pin_mode_setter_constructor, IOExecutor
+from .sensors import SensorUpdaters
 from .timer import delay_us_constructor
 
+T = TypeVar('T')
+
+# keys of the SimulateI2C.error_counters
+NACK_ERRORS = 'nack'
+TIMEOUT_ERRORS = 'timeout'
+IO_ERRORS = 'io'
+RETRIES = 'retries'
+FAILURES = 'failures'
+
+
+class I2CTimeoutError(TimeoutError):
+    """
+    the slave holds the scl low longer than the timeout
+    """
+
+
+class I2CNackError(ConnectionError):
+    """
+    the slave doesn't acknowledge the address or the data
+    """
+
 
 class I2CBase(metaclass=ABCMeta):
     """
@@ -149,6 +178,277 @@ class I2CBase(metaclass=ABCMeta):
         self._sent_data_handler = handler
 
 
+class I2CWaveform(object):
+    """
+    a compiled transaction, the ops are played by the IOExecutor in one call
+
+    the samples are laid out in the order they are taken,
+    the ack of every byte sent, then 8 bits for every byte received
+    """
+    __slots__ = ('ops', 'op_count', 'samples', 'ack_count', 'read_count', 'clocked_bits', 'data')
+
+    def __init__(self, ops: List[int], ack_count: int, read_count: int, clocked_bits: int):
+        self.op_count: int = len(ops)
+        self.ops: Array = (c_uint16 * self.op_count)(*ops)
+        self.samples: Array = (c_uint8 * (ack_count + read_count * 8))()
+        self.ack_count: int = ack_count
+        self.read_count: int = read_count
+        self.clocked_bits: int = clocked_bits
+        self.data: bytearray = bytearray(read_count)
+
+
+class I2CWaveformEngine(object):
+    """
+    precompiles the whole pin waveform of a transaction(start, address, register, data, ack, stop),
+    and plays it through a single IOExecutor call, instead of one ctypes call and one busy-wait per edge.
+
+    the delays are deadline based, the time spent on the transactions is counted into the half period,
+    so the bus runs at the configured speed as long as the transactions are faster than it.
+
+    NOTE:
+        a waveform can't stop halfway, the acks are checked after the whole transaction is played
+    """
+
+    def __init__(self, SDA_PIN: int, SCL_PIN: int, speed: int, io_executor: IOExecutor,
+                 clock_stretching: bool = False, timeout_us: int = 1000):
+        """
+
+        Args:
+            SDA_PIN: the pin of the sda pin
+            SCL_PIN: the pin of the scl pin
+            speed: the speed of the i2c bus, in kHz
+            io_executor: plays the waveform, usually the OnBoardSensors.io_exec
+            clock_stretching: release the scl instead of driving it high, and wait for the slave to release it
+            timeout_us: the max time the slave is allowed to hold the scl low
+        """
+        self._sda: int = 1 << SDA_PIN
+        self._scl: int = 1 << SCL_PIN
+        self._mask: int = self._sda | self._scl
+        # rounded up, the bus is never clocked above the requested speed
+        self._half_period_us: int = max(math.ceil(500 / speed), 1)
+        self._io_executor: IOExecutor = io_executor
+        self._clock_stretching: bool = clock_stretching
+        self._timeout_us: int = timeout_us
+        self._read_waveforms: Dict[Tuple[int, Optional[int], int, bool], I2CWaveform] = {}
+        self._recover_waveform: Optional[I2CWaveform] = None
+
+        self.nack_count: int = 0
+        self.timeout_count: int = 0
+        self.last_bus_rate_hz: float = 0.
+
+    @property
+    def half_period_us(self) -> int:
+        return self._half_period_us
+
+    @property
+    def bus_speed_hz(self) -> float:
+        """
+        the configured bus speed, compare it with the last_bus_rate_hz
+        """
+        return 500000 / self._half_period_us
+
+    # region waveform compiling
+    def _levels(self, ops: List[int], sda: int, scl: int) -> None:
+        ops.append(IO_OP_LEVELS << 8 | (self._sda if sda else 0) | (self._scl if scl else 0))
+
+    def _sda_mode(self, ops: List[int], mode: int, scl_mode: int = OUTPUT) -> None:
+        # the scl is driven by the master, except being released for the clock stretching
+        ops.append(IO_OP_MODES << 8 | (self._sda if mode else 0) | (self._scl if scl_mode else 0))
+
+    @staticmethod
+    def _delay(ops: List[int], half_periods: int = 1) -> None:
+        ops.append(IO_OP_DELAY << 8 | half_periods)
+
+    def _raise_scl(self, ops: List[int], sda: int, sda_mode: int) -> None:
+        if self._clock_stretching:
+            # the scl rises when both the master and the slave release it
+            self._sda_mode(ops, sda_mode, INPUT)
+            ops.append(IO_OP_WAIT_HIGH << 8 | self._scl)
+        else:
+            self._levels(ops, sda, HIGH)
+
+    def _lower_scl(self, ops: List[int], sda: int, sda_mode: int) -> None:
+        if self._clock_stretching:
+            # the level of the scl stays low in the shadow register, so driving it pulls the scl low
+            self._sda_mode(ops, sda_mode)
+        else:
+            self._levels(ops, sda, LOW)
+
+    def _compile_start(self, ops: List[int]) -> None:
+        """
+        also serves as the repeated start, scl is low at the end
+        """
+        self._sda_mode(ops, OUTPUT)
+        self._levels(ops, HIGH, LOW)
+        self._delay(ops)
+        self._raise_scl(ops, HIGH, OUTPUT)
+        self._delay(ops)
+        # the sda falls while the scl is high, the scl level is kept low while it is released
+        self._levels(ops, LOW, LOW if self._clock_stretching else HIGH)
+        self._delay(ops)
+        self._lower_scl(ops, LOW, OUTPUT)
+
+    def _compile_stop(self, ops: List[int]) -> None:
+        """
+        the scl is left released in the clock stretching, which is the idle state of the bus
+        """
+        self._sda_mode(ops, OUTPUT)
+        self._levels(ops, LOW, LOW)
+        self._delay(ops)
+        self._raise_scl(ops, LOW, OUTPUT)
+        self._delay(ops)
+        # the sda rises while the scl is high
+        self._levels(ops, HIGH, LOW if self._clock_stretching else HIGH)
+        self._delay(ops)
+
+    def _compile_clock(self, ops: List[int], sda: int, sda_mode: int, sample: bool) -> None:
+        """
+        one scl pulse, the sda is set while scl is low and sampled while scl is high
+        """
+        self._levels(ops, sda, LOW)
+        self._delay(ops)
+        self._raise_scl(ops, sda, sda_mode)
+        self._delay(ops)
+        if sample:
+            ops.append(IO_OP_SAMPLE << 8)
+        self._lower_scl(ops, sda, sda_mode)
+
+    def _compile_write_byte(self, ops: List[int], byte: int) -> None:
+        """
+        8 data bits, then releases the sda and samples the ack
+        """
+        self._sda_mode(ops, OUTPUT)
+        for i in range(7, -1, -1):
+            self._compile_clock(ops, byte >> i & 1, OUTPUT, False)
+        self._sda_mode(ops, INPUT)
+        self._compile_clock(ops, HIGH, INPUT, True)
+
+    def _compile_read_byte(self, ops: List[int], ack: bool) -> None:
+        """
+        samples 8 data bits, then sends the ack, or the nack for the last byte
+        """
+        self._sda_mode(ops, INPUT)
+        for _ in range(8):
+            self._compile_clock(ops, HIGH, INPUT, True)
+        self._sda_mode(ops, OUTPUT)
+        self._compile_clock(ops, LOW if ack else HIGH, OUTPUT, False)
+
+    def compile_write(self, address: int, data: bytes, stop: bool = True) -> I2CWaveform:
+        ops: List[int] = []
+        self._compile_start(ops)
+        for byte in (address << 1, *data):
+            self._compile_write_byte(ops, byte)
+        if stop:
+            self._compile_stop(ops)
+        return I2CWaveform(ops, ack_count=len(data) + 1, read_count=0, clocked_bits=(len(data) + 1) * 9)
+
+    def compile_read(self, address: int, count: int, register: Optional[int] = None,
+                     stop: bool = True) -> I2CWaveform:
+        ops: List[int] = []
+        ack_count = 1
+        if register is not None:
+            self._compile_start(ops)
+            self._compile_write_byte(ops, address << 1)
+            self._compile_write_byte(ops, register)
+            ack_count += 2
+        self._compile_start(ops)
+        self._compile_write_byte(ops, address << 1 | 1)
+        for i in range(count):
+            self._compile_read_byte(ops, ack=i < count - 1)
+        if stop:
+            self._compile_stop(ops)
+        return I2CWaveform(ops, ack_count=ack_count, read_count=count, clocked_bits=(ack_count + count) * 9)
+
+    def compile_recover(self) -> I2CWaveform:
+        """
+        the bus clear, 9 clocks with the sda released to let a stuck slave finish its byte, then a stop
+        """
+        ops: List[int] = []
+        self._sda_mode(ops, INPUT)
+        for _ in range(9):
+            self._compile_clock(ops, HIGH, INPUT, False)
+        self._compile_stop(ops)
+        return I2CWaveform(ops, ack_count=0, read_count=0, clocked_bits=9)
+
+    # endregion
+
+    def execute(self, waveform: I2CWaveform) -> None:
+        """
+        play the waveform and decode the samples
+
+        Raises:
+            I2CTimeoutError: the slave holds the scl low longer than the timeout
+            I2CNackError: any of the bytes sent is not acknowledged
+            ConnectionError: the io transaction fails
+        """
+        start = perf_counter_ns()
+        result = self._io_executor(waveform.ops, waveform.op_count, self._mask, waveform.samples,
+                                   self._half_period_us, self._timeout_us)
+        if result == IO_EXEC_TIMEOUT:
+            self.timeout_count += 1
+            raise I2CTimeoutError(f'scl is held low for more than {self._timeout_us} us')
+        if result < 0:
+            raise ConnectionError('io transaction failed')
+        elapsed = perf_counter_ns() - start
+        self.last_bus_rate_hz = waveform.clocked_bits * 1e9 / elapsed if elapsed else 0.
+
+        samples = waveform.samples
+        sda = self._sda
+        nacks = 0
+        for i in range(waveform.ack_count):
+            if samples[i] & sda:
+                nacks += 1
+        if nacks:
+            self.nack_count += nacks
+            raise I2CNackError(f'{nacks} of {waveform.ack_count} bytes not acknowledged')
+
+        data = waveform.data
+        bit_index = waveform.ack_count
+        for i in range(waveform.read_count):
+            byte = 0
+            for sample in samples[bit_index:bit_index + 8]:
+                byte = byte << 1 | (1 if sample & sda else 0)
+            data[i] = byte
+            bit_index += 8
+
+    def write(self, address: int, data: bytes, stop: bool = True) -> None:
+        """
+        write the data to the slave in one transaction, raises as the execute does
+        """
+        self.execute(self.compile_write(address, data, stop))
+
+    def read(self, address: int, count: int, register: Optional[int] = None,
+             stop: bool = True) -> bytearray:
+        """
+        read the data from the slave in one transaction, raises as the execute does.
+        the waveforms are cached, so the repeated reads of the same registers cost no compiling
+
+        Args:
+            address: the address of the slave
+            count: the count of bytes to read
+            register: if given, written before the repeated start
+            stop: whether to send a stop signal after reading
+
+        Returns:
+            the data received.
+            NOTE: the bytearray is reused by the following reads of the same registers
+        """
+        key = (address, register, count, stop)
+        waveform = self._read_waveforms.get(key)
+        if waveform is None:
+            waveform = self._read_waveforms[key] = self.compile_read(address, count, register, stop)
+        self.execute(waveform)
+        return waveform.data
+
+    def recover(self) -> None:
+        """
+        clear the bus after a failed transaction
+        """
+        if self._recover_waveform is None:
+            self._recover_waveform = self.compile_recover()
+        self.execute(self._recover_waveform)
+
+
 class SimulateI2C(I2CBase):
     """
     # 假设要传输的数据为 0b10101010
@@ -172,6 +472,7 @@ class SimulateI2C(I2CBase):
         100: 5,
         400: 2
     }
+    __instances: Dict[str, 'SimulateI2C'] = {}
 
     @final
     def end(self):
@@ -181,107 +482,197 @@ class SimulateI2C(I2CBase):
         self.set_ALL_PINS_MODE(INPUT)
 
     def write(self, data: bytearray | bytes):
-        write_byte = self._write_byte
-        set_mode = self.set_ALL_PINS_MODE
-        delay = self.delay
-        for byte in data:
-            set_mode(OUTPUT)
-            write_byte(byte)
-            set_mode(INPUT)
-            delay()
-
-        # TODO should have a ack/nack receiver
+        # sent as one transaction by the endTransmission
+        self._write_buffer.extend(data)
 
     def requestFrom(self, target_address: int, request_data_size: int, stop: bool, register_address=None):
+        transaction = self._engine.read if self._engine else self._read_transaction
+        self._read_buffer.extend(self._transact(transaction, target_address, request_data_size, register_address,
+                                                stop))
 
-        set_all_pins_mode = self.set_ALL_PINS_MODE
-        set_all_pins_mode(OUTPUT)
-        ack = self._ack
-        buffer_append = self._read_buffer.append
-        get_scl_pin = self.get_SCL_PIN
-        get_sda_pin = self.get_SDA_PIN
-        delay = self.delay
+    def _transact(self, transaction: Callable[..., T], *args) -> T:
+        """
+        run the transaction, retry with the exponential backoff on the nack, the timeout or the io failure.
+        the bus is cleared before every retry, the backoff never exceeds the max_backoff_ms
+
+        Raises:
+            the error of the last attempt, if all the attempts fail
+        """
+        counters = self.error_counters
+        for attempt in range(self._retries + 1):
+            try:
+                return transaction(*args)
+            except (ConnectionError, TimeoutError) as error:
+                if isinstance(error, I2CNackError):
+                    counters[NACK_ERRORS] += 1
+                elif isinstance(error, I2CTimeoutError):
+                    counters[TIMEOUT_ERRORS] += 1
+                else:
+                    counters[IO_ERRORS] += 1
+                if attempt == self._retries:
+                    counters[FAILURES] += 1
+                    raise
+            counters[RETRIES] += 1
+            self._recover()
+            # the sleep is on the caller's thread, usually the control loop, so it is capped
+            sleep(min(self._backoff_ms * (1 << attempt), self._max_backoff_ms) / 1000)
+
+    def _recover(self) -> None:
+        """
+        free the bus after a failed transaction
+        """
+        try:
+            self._engine.recover() if self._engine else self._bus_clear()
+        except (ConnectionError, TimeoutError):
+            pass
+
+    @classmethod
+    def bus_error_stats(cls) -> Dict[str, Dict[str, int]]:
+        """
+        Returns: 'SDA{sda}/SCL{scl}' -> the error counters of the bus, for the monitoring
+        """
+        return {name: dict(bus.error_counters) for name, bus in cls.__instances.items()}
+
+    # region bit-banged transactions, used when there is no io_executor
+    def _write_transaction(self, address: int, data: bytes, stop: bool) -> None:
+        """
+        start, address|W, the data, then the stop if required
+        """
+        self.set_ALL_PINS_MODE(OUTPUT)
         self._start()
-        self._write_byte((target_address << 1) + 1)
-        delay()
+        for byte in (address << 1, *data):
+            self._write_byte(byte)
+        self._stop() if stop else None
 
-        def receive_byte() -> int:
-            """
-            Receive a byte from the slave device.
-            Returns: the 8bit byte received from the slave device
+    def _read_transaction(self, address: int, count: int, register: Optional[int], stop: bool) -> bytearray:
+        """
+        if the register is given, start, address|W, the register, then the repeated start.
+        start, address|R, the data acknowledged except the last byte, then the stop if required
+        """
+        self.set_ALL_PINS_MODE(OUTPUT)
+        if register is not None:
+            self._start()
+            self._write_byte(address << 1)
+            self._write_byte(register)
+        self._start()
+        self._write_byte(address << 1 | 1)
+        received = bytearray(self._read_byte(ack=i < count - 1) for i in range(count))
+        self._stop() if stop else None
+        return received
 
-            """
-            received_data = 0x00
-            for _ in range(8):
-                while not get_scl_pin():
-                    _ += 1
-                received_data = (received_data << 1) | get_sda_pin()
-            return received_data
+    def _scl_high(self) -> None:
+        """
+        raise the scl, released for the slave to stretch it in the clock stretching
 
-        self._write_byte(register_address) if register_address else None
+        Raises:
+            I2CTimeoutError: the slave holds the scl low longer than the timeout
+        """
+        if not self._clock_stretching:
+            self.set_SCL_PIN(HIGH)
+            return
+        self.set_SCL_PIN_MODE(INPUT)
+        get_scl_pin = self.get_SCL_PIN
+        timeout_at = perf_counter_ns() + self._timeout_us * 1000
+        while not get_scl_pin():
+            if perf_counter_ns() > timeout_at:
+                raise I2CTimeoutError(f'scl is held low for more than {self._timeout_us} us')
+
+    def _scl_low(self) -> None:
+        self.set_SCL_PIN(LOW)
+        # the level is set before driving it, so the scl never glitches high
+        self.set_SCL_PIN_MODE(OUTPUT) if self._clock_stretching else None
+
+    def _clock(self) -> int:
+        """
+        one scl pulse, the sda is sampled while the scl is high
+
+        Returns:
+            the level of the sda
+        """
+        delay = self.delay
+        delay()
+        self._scl_high()
         delay()
-        for _ in range(request_data_size):
-            set_all_pins_mode(INPUT)
-            buffer_append(receive_byte())
-            set_all_pins_mode(OUTPUT)
-            ack()
+        level = self.get_SDA_PIN()
+        self._scl_low()
+        return level
 
-        self._stop() if stop else None
+    def _write_byte(self, data: int) -> None:
+        """
+        8 data bits msb first, then releases the sda and clocks the ack
 
-    def _write_byte(self, data):
-        if self._is_idle:
-            raise ConnectionError('I2C is not transmitting')
+        Raises:
+            I2CNackError: the slave doesn't pull the sda low for the ack
+        """
         set_sda_pin = self.set_SDA_PIN
-        set_scl_pin = self.set_SCL_PIN
-        delay = self.delay
+        clock = self._clock
+        for i in range(7, -1, -1):
+            set_sda_pin(data >> i & 1)
+            clock()
+        self.set_SDA_PIN_MODE(INPUT)
+        nack = clock()
+        self.set_SDA_PIN_MODE(OUTPUT)
+        if nack:
+            self._stop()
+            raise I2CNackError(f'I2C slave not acknowledging {hex(data)}')
+
+    def _read_byte(self, ack: bool) -> int:
+        """
+        clocks 8 data bits msb first with the sda released, then sends the ack, or the nack for the last byte
+        """
+        clock = self._clock
+        self.set_SDA_PIN_MODE(INPUT)
+        received = 0
         for _ in range(8):
-            set_sda_pin(data & 0x80)
-            set_scl_pin(HIGH)
-            delay()
-            set_scl_pin(LOW)
-            set_sda_pin(LOW)
-            data <<= 1
-            delay()
+            received = received << 1 | clock()
+        self.set_SDA_PIN_MODE(OUTPUT)
+        self.set_SDA_PIN(LOW if ack else HIGH)
+        self._clock()
+        return received
 
     def _start(self):
+        """
+        also serves as the repeated start, scl is low at the end
+        """
         delay = self.delay
         self.set_SDA_PIN(HIGH)
-        self.set_SCL_PIN(HIGH)
         delay()
-        self.set_SDA_PIN(LOW)
+        self._scl_high()
         delay()
-        self.set_SCL_PIN(LOW)
+        self.set_SDA_PIN(LOW)
         delay()
+        self._scl_low()
 
     def _stop(self):
         delay = self.delay
         self.set_SDA_PIN(LOW)
-        self.set_SCL_PIN(HIGH)
-        delay()
-        self.set_SDA_PIN(HIGH)
-
-    def _nack(self):
-        delay = self.delay
-        self.set_SDA_PIN(HIGH)
         delay()
-        self.set_SCL_PIN(HIGH)
+        self._scl_high()
         delay()
-        self.set_SCL_PIN(LOW)
+        self.set_SDA_PIN(HIGH)
         delay()
 
-    def _ack(self):
-        delay = self.delay
-        self.set_SDA_PIN(LOW)
-        delay()
-        self.set_SCL_PIN(HIGH)
-        delay()
-        self.set_SCL_PIN(LOW)
-        delay()
-        self.set_SDA_PIN(HIGH)
+    def _bus_clear(self) -> None:
+        """
+        9 clocks with the sda released to let a stuck slave finish its byte, then a stop
+        """
+        self.set_ALL_PINS_MODE(OUTPUT)
+        self.set_SDA_PIN_MODE(INPUT)
+        for _ in range(9):
+            self._clock()
+        self.set_SDA_PIN_MODE(OUTPUT)
+        self._stop()
+
+    # endregion
 
     def endTransmission(self, stop: bool):
-        # TODO : should check if the data in the send buffer are all sent
-        self._stop() if stop else self._start()
+        if self._write_buffer:
+            transaction = self._engine.write if self._engine else self._write_transaction
+            try:
+                self._transact(transaction, self._target_address, self._write_buffer, stop)
+            finally:
+                self._write_buffer.clear()
+        self._is_idle = True
 
     def begin(self, slave_address: Optional[int] = None):
         """
@@ -300,7 +691,32 @@ class SimulateI2C(I2CBase):
                  indexed_setter: IndexedSetter,
                  indexed_getter: IndexedGetter,
                  indexed_mode_setter: IndexedSetter,
-                 self_address: Optional[int] = None):
+                 self_address: Optional[int] = None,
+                 masked_mode_setter: Optional[MaskedSetter] = None,
+                 io_executor: Optional[IOExecutor] = None,
+                 timeout_us: int = 1000,
+                 retries: int = 2,
+                 backoff_ms: float = 1.,
+                 clock_stretching: bool = False,
+                 max_backoff_ms: float = 4.):
+        """
+
+        Args:
+            SDA_PIN: the pin of the sda pin
+            SCL_PIN: the pin of the scl pin
+            speed: the speed of the i2c bus
+            indexed_setter: the setter that will be called to set the pin level,
+            indexed_getter: the getter that will be called to get the pin level,
+            indexed_mode_setter: the mode setter that will be called to set the pin mode,input or output
+            self_address: the address of the master itself
+            masked_mode_setter: if given, used to switch the modes of both pins in a single call
+            io_executor: if given, the transactions are played by an I2CWaveformEngine upon it
+            timeout_us: the max time the slave is allowed to hold the scl low
+            retries: the count of the retries of a failed transaction
+            backoff_ms: the wait before the first retry, doubled for every following retry
+            clock_stretching: release the scl instead of driving it high, and wait for the slave to release it
+            max_backoff_ms: the cap of the wait before a retry
+        """
         if speed not in self.__speed_delay_table:
             raise IndexError(f'speed must in {list(self.__speed_delay_table.keys())}')
         super().__init__(self_address)
@@ -316,9 +732,21 @@ class SimulateI2C(I2CBase):
                                                                            SCL_PIN)
         self.set_SDA_PIN_MODE: PinModeSetter = pin_mode_setter_constructor(indexed_mode_setter,
                                                                            SDA_PIN)
-        self.set_ALL_PINS_MODE: PinModeSetter = multiple_pin_mode_setter_constructor(indexed_mode_setter,
-                                                                                     [SDA_PIN, SCL_PIN])
+        self.set_ALL_PINS_MODE: PinModeSetter = masked_pin_mode_setter_constructor(
+            masked_mode_setter, [SDA_PIN, SCL_PIN]
+        ) if masked_mode_setter else multiple_pin_mode_setter_constructor(indexed_mode_setter, [SDA_PIN, SCL_PIN])
         self.delay = delay_us_constructor(speed)
+        self._engine: Optional[I2CWaveformEngine] = I2CWaveformEngine(SDA_PIN, SCL_PIN, speed, io_executor,
+                                                                      clock_stretching, timeout_us) \
+            if io_executor else None
+        self._timeout_us: int = timeout_us
+        self._clock_stretching: bool = clock_stretching
+        self._retries: int = retries
+        self._backoff_ms: float = backoff_ms
+        self._max_backoff_ms: float = max_backoff_ms
+        self.error_counters: Dict[str, int] = dict.fromkeys(
+            (NACK_ERRORS, TIMEOUT_ERRORS, IO_ERRORS, RETRIES, FAILURES), 0)
+        self.__instances[f'SDA{SDA_PIN}/SCL{SCL_PIN}'] = self
 
         self.begin()
 
@@ -344,13 +772,21 @@ class SensorI2CExpansion(SimulateI2C):
 
     the expansion board has a default address of 0x24
 
-    the default register address is 0x10
+    the default register address is 0x10, the adc registers of the channels are continuous and big-endian
     """
 
     def __init__(self, expansion_device_addr: int, register_addr: int, SDA_PIN: int, SCL_PIN: int, speed: int,
                  indexed_setter: Callable,
                  indexed_getter: Callable,
-                 indexed_mode_setter: Callable):
+                 indexed_mode_setter: Callable,
+                 masked_mode_setter: Optional[MaskedSetter] = None,
+                 io_executor: Optional[IOExecutor] = None,
+                 channel_count: int = 8,
+                 timeout_us: int = 1000,
+                 retries: int = 2,
+                 backoff_ms: float = 1.,
+                 max_backoff_ms: float = 4.,
+                 clock_stretching: bool = False):
         """
 
         Args:
@@ -362,13 +798,32 @@ class SensorI2CExpansion(SimulateI2C):
             indexed_setter: the setter that will be called to set the pin level,
             indexed_getter: the getter that will be called to get the pin level,
             indexed_mode_setter: the mode setter that will be called to set the pin mode,input or output
+            masked_mode_setter: if given, used to switch the modes of both pins in a single call
+            io_executor: if given, the transactions are played by an I2CWaveformEngine upon it
+            channel_count: the count of the adc channels read by the get_all_sensor
+            timeout_us: the max time the slave is allowed to hold the scl low
+            retries: the count of the retries of a failed transaction
+            backoff_ms: the wait before the first retry, doubled for every following retry
+            max_backoff_ms: the cap of the wait before a retry
+            clock_stretching: release the scl instead of driving it high, and wait for the slave to release it
         """
         super().__init__(SDA_PIN=SDA_PIN, SCL_PIN=SCL_PIN, speed=speed,
                          indexed_setter=indexed_setter,
                          indexed_getter=indexed_getter,
-                         indexed_mode_setter=indexed_mode_setter)
+                         indexed_mode_setter=indexed_mode_setter,
+                         masked_mode_setter=masked_mode_setter,
+                         io_executor=io_executor,
+                         timeout_us=timeout_us,
+                         retries=retries,
+                         backoff_ms=backoff_ms,
+                         max_backoff_ms=max_backoff_ms,
+                         clock_stretching=clock_stretching)
         self._expansion_device_addr = expansion_device_addr
         self._register_addr = register_addr
+        self._channel_count = channel_count
+        self._all_sensor = array('H', bytes(2 * channel_count))
+        # the byte view of the _all_sensor, the burst read is copied into it without any allocation
+        self._all_sensor_bytes = memoryview(self._all_sensor).cast('B')
         self.begin()
 
     def get_sensor_adc(self, index: int) -> int:
@@ -385,10 +840,31 @@ class SensorI2CExpansion(SimulateI2C):
         self.endTransmission(stop=True)
         return join_bytes_to_uint16(self.read_byte(), self.read_byte())
 
-    def get_all_sensor(self) -> Tuple[int, ...]:
+    def get_all_sensor(self) -> array:
         """
+        read all the adc channels in a single burst read, instead of one transaction per channel
 
-        Returns:
+        Returns: the adc values of all the channels, resolution is 1024.
+            NOTE: the array is preallocated and updated in place by the following reads, copy it if it should be kept
 
         """
-        raise NotImplementedError
+        byte_count = 2 * self._channel_count
+        if self._engine:
+            self._all_sensor_bytes[:] = self._transact(self._engine.read, self._expansion_device_addr, byte_count,
+                                                       self._register_addr)
+        else:
+            self.beginTransmission(self._expansion_device_addr)
+            self.requestFrom(self._expansion_device_addr, byte_count, True, self._register_addr)
+            self.endTransmission(stop=True)
+            self._all_sensor_bytes[:] = self._read_buffer[:byte_count]
+            del self._read_buffer[:byte_count]
+        if sys.byteorder == 'little':
+            self._all_sensor.byteswap()
+        return self._all_sensor
+
+    @property
+    def updaters(self) -> SensorUpdaters:
+        """
+        the updaters to pass to the SensorHub as the expansion_adc_updater
+        """
+        return self.get_all_sensor, self.get_sensor_adc
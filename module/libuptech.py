@@ -0,0 +1,271 @@
+"""
+binding table of the libuptech.so, and a pure-python fake of it
+"""
+import warnings
+from ctypes import c_int, c_uint, c_uint8, c_uint16, c_int16, c_float, c_char_p, POINTER, CDLL, Structure, \
+    RTLD_GLOBAL, DEFAULT_MODE
+from typing import Dict, Union, List, Optional
+
+import numpy as np
+
+from .os_tools import load_lib, declare_prototypes, Prototype
+
+LIBUPTECH_NAME: str = 'libuptech.so'
+LIBUPTECH_EXT_NAME: str = 'libuptech_ext.so'
+
+ADC_CHANNEL_COUNT: int = 10
+IO_CHANNEL_COUNT: int = 8
+MPU_AXIS_COUNT: int = 3
+
+# the UGUI uses UG_S16 as the coordinates and UG_COLOR(rgb565) as the color
+_COORD = c_int16
+_COLOR = c_uint16
+
+UPTECH_PROTOTYPES: Dict[str, Prototype] = {
+    # region adc-io
+    'adc_io_open': (c_int, ()),
+    'adc_io_close': (c_int, ()),
+    'ADC_GetAll': (c_int, (POINTER(c_uint16),)),
+    'adc_io_Set': (c_int, (c_uint, c_uint8)),
+    'adc_io_SetAll': (c_int, (c_uint,)),
+    'adc_io_ModeGetAll': (c_int, (POINTER(c_uint8),)),
+    'adc_io_ModeSetAll': (c_int, (c_uint8,)),
+    'adc_io_ModeSet': (c_int, (c_uint, c_int)),
+    'adc_io_InputGetAll': (c_int, ()),
+    'adc_led_set': (c_int, (c_int, c_int)),
+    # endregion
+
+    # region mpu6500
+    'mpu6500_dmp_init': (c_int, ()),
+    'mpu6500_Get_Accel': (c_int, (POINTER(c_float),)),
+    'mpu6500_Get_Gyro': (c_int, (POINTER(c_float),)),
+    'mpu6500_Get_Attitude': (c_int, (POINTER(c_float),)),
+    # endregion
+
+    # region lcd
+    'lcd_open': (c_int, (c_int,)),
+    'LCD_Refresh': (None, ()),
+    'LCD_SetFont': (None, (c_int,)),
+    'UG_SetForecolor': (None, (_COLOR,)),
+    'UG_SetBackcolor': (None, (_COLOR,)),
+    'UG_FillScreen': (None, (_COLOR,)),
+    'UG_PutString': (None, (_COORD, _COORD, c_char_p)),
+    'UG_FillFrame': (None, (_COORD, _COORD, _COORD, _COORD, _COLOR)),
+    'UG_FillRoundFrame': (None, (_COORD, _COORD, _COORD, _COORD, _COORD, _COLOR)),
+    'UG_FillCircle': (None, (_COORD, _COORD, _COORD, _COLOR)),
+    'UG_DrawMesh': (None, (_COORD, _COORD, _COORD, _COORD, _COLOR)),
+    'UG_DrawFrame': (None, (_COORD, _COORD, _COORD, _COORD, _COLOR)),
+    'UG_DrawRoundFrame': (None, (_COORD, _COORD, _COORD, _COORD, _COORD, _COLOR)),
+    'UG_DrawPixel': (None, (_COORD, _COORD, _COLOR)),
+    'UG_DrawCircle': (None, (_COORD, _COORD, _COORD, _COLOR)),
+    'UG_DrawArc': (None, (_COORD, _COORD, _COORD, c_uint8, _COLOR)),
+    'UG_DrawLine': (None, (_COORD, _COORD, _COORD, _COORD, _COLOR)),
+    # endregion
+}
+
+
+class SensorFrame(Structure):
+    """
+    a full snapshot of the on-board sensors, same layout as the SensorFrame in src/uptech_ext.c
+    """
+    _pack_ = 1
+    _fields_ = [('accel', c_float * MPU_AXIS_COUNT),
+                ('gyro', c_float * MPU_AXIS_COUNT),
+                ('atti', c_float * MPU_AXIS_COUNT),
+                ('adc', c_uint16 * ADC_CHANNEL_COUNT),
+                ('io', c_uint8)]
+
+
+SENSOR_FRAME_DTYPE = np.dtype([('accel', np.float32, (MPU_AXIS_COUNT,)),
+                               ('gyro', np.float32, (MPU_AXIS_COUNT,)),
+                               ('atti', np.float32, (MPU_AXIS_COUNT,)),
+                               ('adc', np.uint16, (ADC_CHANNEL_COUNT,)),
+                               ('io', np.uint8)])
+
+# io waveform ops, the high byte is the op code and the low byte is the arg, same as the IO_OP_* in src/uptech_ext.c
+IO_OP_LEVELS: int = 0x01
+IO_OP_MODES: int = 0x02
+IO_OP_SAMPLE: int = 0x03
+IO_OP_DELAY: int = 0x04
+IO_OP_WAIT_HIGH: int = 0x05
+# the errors returned by the io waveform
+IO_EXEC_FAIL: int = -1
+IO_EXEC_TIMEOUT: int = -2
+# the failure flags returned by the uptech_read_all, same as the READ_FAIL_* in src/uptech_ext.c
+READ_FAIL_ADC: int = 0x01
+READ_FAIL_IO: int = 0x02
+READ_FAIL_ACCEL: int = 0x04
+READ_FAIL_GYRO: int = 0x08
+READ_FAIL_ATTI: int = 0x10
+
+UPTECH_EXT_PROTOTYPES: Dict[str, Prototype] = {
+    'uptech_read_all': (c_int, (POINTER(SensorFrame),)),
+    'uptech_io_exec': (c_int, (POINTER(c_uint16), c_int, c_uint8, POINTER(c_uint8), POINTER(c_uint8),
+                               POINTER(c_uint8), c_uint, c_uint)),
+}
+
+
+class FakeUptechLib(object):
+    """
+    a pure-python stand-in of the libuptech.so, exports the same symbols as the UPTECH_PROTOTYPES does.
+
+    the sensor values are plain attributes, assign them to script what the sensors read,
+    the lcd calls are only counted.
+    """
+
+    def __init__(self):
+        self.adc_values: List[int] = [0] * ADC_CHANNEL_COUNT
+        self.io_input_levels: int = 0xFF
+        self.io_output_levels: int = 0x00
+        self.io_modes: int = 0x00
+        self.led_colors: Dict[int, int] = {}
+        self.accel_values: List[float] = [0.] * MPU_AXIS_COUNT
+        self.gyro_values: List[float] = [0.] * MPU_AXIS_COUNT
+        self.atti_values: List[float] = [0.] * MPU_AXIS_COUNT
+        self.lcd_calls: int = 0
+
+    # region adc-io
+    def adc_io_open(self) -> int:
+        return 0
+
+    def adc_io_close(self) -> int:
+        return 0
+
+    def ADC_GetAll(self, buffer) -> int:
+        buffer[:ADC_CHANNEL_COUNT] = self.adc_values
+        return 0
+
+    def adc_io_Set(self, index: int, level: int) -> int:
+        if index > 7:
+            return -1
+        if level:
+            self.io_output_levels |= 1 << index
+        else:
+            self.io_output_levels &= ~(1 << index)
+        return 0
+
+    def adc_io_SetAll(self, levels: int) -> int:
+        self.io_output_levels = levels & 0xFF
+        return 0
+
+    def adc_io_ModeGetAll(self, buffer) -> int:
+        buffer[0] = self.io_modes
+        return 0
+
+    def adc_io_ModeSetAll(self, modes: int) -> int:
+        self.io_modes = modes & 0xFF
+        return 0
+
+    def adc_io_ModeSet(self, index: int, mode: int) -> int:
+        if index > 7:
+            return -1
+        if mode:
+            self.io_modes |= 1 << index
+        else:
+            self.io_modes &= ~(1 << index)
+        return 0
+
+    def adc_io_InputGetAll(self) -> int:
+        # the pins in output mode read back what they are driving
+        return (self.io_input_levels & ~self.io_modes | self.io_output_levels & self.io_modes) & 0xFF
+
+    def adc_led_set(self, index: int, color: int) -> int:
+        self.led_colors[index] = color
+        return 0
+
+    # endregion
+
+    # region mpu6500
+    def mpu6500_dmp_init(self) -> int:
+        return 0
+
+    def mpu6500_Get_Accel(self, buffer) -> int:
+        buffer[:MPU_AXIS_COUNT] = self.accel_values
+        return 0
+
+    def mpu6500_Get_Gyro(self, buffer) -> int:
+        buffer[:MPU_AXIS_COUNT] = self.gyro_values
+        return 0
+
+    def mpu6500_Get_Attitude(self, buffer) -> int:
+        buffer[:MPU_AXIS_COUNT] = self.atti_values
+        return 0
+
+    # endregion
+
+    # region lcd
+    def lcd_open(self, direction: int) -> int:
+        return 0
+
+    def _lcd_call(self, *args) -> None:
+        self.lcd_calls += 1
+
+    LCD_Refresh = LCD_SetFont = UG_SetForecolor = UG_SetBackcolor = UG_FillScreen = _lcd_call
+    UG_PutString = UG_FillFrame = UG_FillRoundFrame = UG_FillCircle = UG_DrawMesh = _lcd_call
+    UG_DrawFrame = UG_DrawRoundFrame = UG_DrawPixel = UG_DrawCircle = UG_DrawArc = UG_DrawLine = _lcd_call
+    # endregion
+
+
+UptechLib = Union[CDLL, FakeUptechLib]
+
+# the results of the first load attempts, the failures included, so that every lib is resolved once per process
+_load_results: Dict[str, Union[CDLL, OSError]] = {}
+_fake_uptech_lib: Optional[FakeUptechLib] = None
+
+
+def _load_once(libname: str, prototypes: Dict[str, Prototype], mode: int = DEFAULT_MODE) -> CDLL:
+    """
+    load the lib with the prototypes declared, the load_lib doesn't cache the failures
+
+    Raises:
+        OSError: the error of the first attempt
+    """
+    if libname not in _load_results:
+        try:
+            _load_results[libname] = declare_prototypes(load_lib(libname, mode), prototypes)
+        except OSError as e:
+            _load_results[libname] = e
+    result = _load_results[libname]
+    if isinstance(result, OSError):
+        raise result.with_traceback(None)
+    return result
+
+
+def load_uptech_lib(fallback_to_fake: bool = True) -> UptechLib:
+    """
+    load the libuptech.so with all the prototypes declared, only the first call tries loading it
+
+    Args:
+        fallback_to_fake: use the FakeUptechLib if the libuptech.so can't be loaded
+
+    Returns:
+        the typed lib, or the FakeUptechLib instance shared by all the callers
+    """
+    global _fake_uptech_lib
+    try:
+        # loaded globally, so that the libuptech_ext.so could resolve the symbols at runtime
+        return _load_once(LIBUPTECH_NAME, UPTECH_PROTOTYPES, RTLD_GLOBAL)
+    except OSError:
+        if not fallback_to_fake:
+            raise
+        if _fake_uptech_lib is None:
+            warnings.warn(f'##Uptech: Failed to load {LIBUPTECH_NAME}, using FakeUptechLib instead##')
+            _fake_uptech_lib = FakeUptechLib()
+        return _fake_uptech_lib
+
+
+def load_uptech_ext_lib() -> Optional[CDLL]:
+    """
+    load the libuptech_ext.so built from src/uptech_ext.c, with all the prototypes declared,
+    only the first call tries loading it
+
+    Returns:
+        the typed lib, None if it is not built or the libuptech.so is not loaded
+    """
+    first_attempt = LIBUPTECH_EXT_NAME not in _load_results
+    try:
+        return _load_once(LIBUPTECH_EXT_NAME, UPTECH_EXT_PROTOTYPES)
+    except OSError:
+        if first_attempt:
+            warnings.warn(f'##Uptech: Failed to load {LIBUPTECH_EXT_NAME}, batched read runs in python##')
+        return None
@@ -1,9 +1,15 @@
 import ctypes
 import warnings
+from functools import wraps
 from time import perf_counter_ns
-from typing import Callable, Sequence
+from typing import Callable, Sequence, Optional, Dict, Tuple, Any
 
-from .os_tools import load_lib
+import numpy as np
+
+from .libuptech import load_uptech_lib, load_uptech_ext_lib, UptechLib, SensorFrame, SENSOR_FRAME_DTYPE, \
+    IO_OP_LEVELS, IO_OP_MODES, IO_OP_SAMPLE, IO_OP_DELAY, IO_OP_WAIT_HIGH, IO_EXEC_FAIL, IO_EXEC_TIMEOUT, \
+    READ_FAIL_ADC, READ_FAIL_IO, READ_FAIL_ACCEL, READ_FAIL_GYRO, READ_FAIL_ATTI
+from ..constant import SAMPLE_INTERVALS_MS
 
 E6 = 1000000
 
@@ -13,21 +19,97 @@ PinGetter = Callable[[], int]
 
 IndexedGetter = Callable[[int], int]
 IndexedSetter = Callable[[int, int], None]
+# takes a mask and the values, bit i for the channel i
+MaskedSetter = Callable[[int, int], None]
+# see OnBoardSensors.io_exec
+IOExecutor = Callable[[ctypes.Array, int, int, ctypes.Array, int, int], int]
 
 OUTPUT = 1
 INPUT = 0
 HIGH = 1
 LOW = 0
 
+ADC_SOURCE = 'adc'
+IO_SOURCE = 'io'
+ACCEL_SOURCE = 'accel'
+GYRO_SOURCE = 'gyro'
+ATTI_SOURCE = 'atti'
+
+# the decoded levels of every possible io input byte, bit i is the level of the channel i
+IO_LEVEL_TABLE: Tuple[Tuple[int, ...], ...] = tuple(tuple((packed >> i) & 1 for i in range(8))
+                                                    for packed in range(256))
+
+
+class SampleCache(object):
+    """
+    a decorator that reuses the result of a read within the min sample interval,
+    to prevent the over-sampling on the bus.
+
+    the interval starts at the moment a read happens, the reuses never move it forward
+    """
+    __instances: Dict[str, 'SampleCache'] = {}
+
+    def __init__(self, name: str, interval_ms: float):
+        """
+
+        Args:
+            name: the name of the source, used in the monitoring
+            interval_ms: the min sample interval, 0 for reading on every call
+        """
+        self.name: str = name
+        self.interval_ns: int = int(interval_ms * E6)
+        self.hits: int = 0
+        self.misses: int = 0
+        self._last_sample_ns: Optional[int] = None
+        self._result: Any = None
+        self.__instances[name] = self
+
+    @property
+    def interval_ms(self) -> float:
+        return self.interval_ns / E6
+
+    @interval_ms.setter
+    def interval_ms(self, value: float):
+        self.interval_ns = int(value * E6)
+
+    def __call__(self, read_func: Callable[[], Any]) -> Callable[[], Any]:
+        @wraps(read_func)
+        def cached_read() -> Any:
+            now = perf_counter_ns()
+            if self._last_sample_ns is not None and now - self._last_sample_ns < self.interval_ns:
+                self.hits += 1
+                return self._result
+            self._result = read_func()
+            self._last_sample_ns = now
+            self.misses += 1
+            return self._result
+
+        cached_read.sample_cache = self
+        return cached_read
+
+    def invalidate(self) -> None:
+        """
+        make the next call read from the bus
+        """
+        self._last_sample_ns = None
+
+    @classmethod
+    def stats(cls) -> Dict[str, Tuple[int, int]]:
+        """
+        Returns: source name -> (hits, misses)
+        """
+        return {name: (cache.hits, cache.misses) for name, cache in cls.__instances.items()}
+
+    @classmethod
+    def get_cache(cls, name: str) -> 'SampleCache':
+        return cls.__instances[name]
+
 
 class OnBoardSensors:
     """
     provides sealed methods accessing to the IOs and builtin sensors
     """
-    try:
-        __lib = load_lib('libuptech.so')
-    except OSError:
-        warnings.warn('##Uptech: Failed to load libuptech.so##')
+    __lib: UptechLib
 
     __adc_data_list_type = ctypes.c_uint16 * 10
 
@@ -36,8 +118,16 @@ class OnBoardSensors:
     _accel_all = __mpu_data_list_type()
     _gyro_all = __mpu_data_list_type()
     _atti_all = __mpu_data_list_type()
-    last_update_timestamp = perf_counter_ns()
-    __adc_min_sample_interval_ns = 5 * E6
+    _sensor_frame = SensorFrame()
+    _sensor_frame_view: np.ndarray = np.frombuffer(_sensor_frame, dtype=SENSOR_FRAME_DTYPE).reshape(())
+    # the READ_FAIL_* flags of the last read_all
+    _read_all_failures: int = 0
+    # shadow registers of the io modes and the io output levels, bit i for the channel i,
+    # None means the register content is unknown, which will be resolved on the next full write
+    _io_mode_shadow: Optional[int] = None
+    _io_level_shadow: Optional[int] = None
+    _io_mode_ref = (ctypes.c_uint8 * 1)()
+    _io_level_ref = (ctypes.c_uint8 * 1)()
 
     def __init__(self, open_mpu: bool = True,
                  debug: bool = False):
@@ -49,37 +139,71 @@ class OnBoardSensors:
         self.set_all_io_level(HIGH)
         print(f"Sensor channel Init times: {success}") if self.debug else None
 
+    @classmethod
+    def bind_lib(cls, lib: UptechLib, ext_lib: Optional[UptechLib] = None) -> None:
+        """
+        bind the sensors to the given lib, the function pointers are cached as class attributes
+        to save the attribute lookups on every call
+
+        Args:
+            lib: the typed libuptech, or any object that exports the same symbols
+            ext_lib: the typed libuptech_ext, the batched read falls back to python if not given
+        """
+        cls.__lib = lib
+        cls._adc_io_open = lib.adc_io_open
+        cls._adc_io_close = lib.adc_io_close
+        cls._ADC_GetAll = lib.ADC_GetAll
+        cls._adc_io_Set = lib.adc_io_Set
+        cls._adc_io_SetAll = lib.adc_io_SetAll
+        cls._adc_io_ModeGetAll = lib.adc_io_ModeGetAll
+        cls._adc_io_ModeSetAll = lib.adc_io_ModeSetAll
+        cls._adc_io_ModeSet = lib.adc_io_ModeSet
+        cls._adc_io_InputGetAll = lib.adc_io_InputGetAll
+        cls._mpu6500_dmp_init = lib.mpu6500_dmp_init
+        cls._mpu6500_Get_Accel = lib.mpu6500_Get_Accel
+        cls._mpu6500_Get_Gyro = lib.mpu6500_Get_Gyro
+        cls._mpu6500_Get_Attitude = lib.mpu6500_Get_Attitude
+        cls._uptech_read_all = ext_lib.uptech_read_all if ext_lib else cls._read_all_fallback
+        cls._uptech_io_exec = ext_lib.uptech_io_exec if ext_lib else cls._io_exec_fallback
+
     @property
-    def adc_min_sample_interval_ms(self) -> int:
+    def adc_min_sample_interval_ms(self) -> float:
         """
         get the minimum interval between two consecutive samples, this is to prevent
         over-sampling, the value is in milliseconds。
 
         NOTE:
-            the value is in milliseconds, but the unit is nanoseconds.
             a greater value means a lower rt performance
         """
-        return int(self.__adc_min_sample_interval_ns / E6)
+        return SampleCache.get_cache(ADC_SOURCE).interval_ms
 
     @adc_min_sample_interval_ms.setter
-    def adc_min_sample_interval_ms(self, value: int):
-        self.__adc_min_sample_interval_ns = value * E6
+    def adc_min_sample_interval_ms(self, value: float):
+        SampleCache.get_cache(ADC_SOURCE).interval_ms = value
+
+    @staticmethod
+    def sample_cache_stats() -> Dict[str, Tuple[int, int]]:
+        """
+        Returns: source name -> (hits, misses) of the sample caches
+        """
+        return SampleCache.stats()
 
     @staticmethod
     def adc_io_open():
         """
         open the adc-io plug
         """
-        return OnBoardSensors.__lib.adc_io_open()
+        return OnBoardSensors._adc_io_open()
 
     @staticmethod
     def adc_io_close():
         """
         close the adc-io plug
         """
-        OnBoardSensors.__lib.adc_io_close()
+        OnBoardSensors._adc_io_close()
 
     @staticmethod
+    @SampleCache(ADC_SOURCE, SAMPLE_INTERVALS_MS[ADC_SOURCE])
     def adc_all_channels():
         """
         这个函数的功能是从ADC（模拟到数字转换器）获取多个值，
@@ -115,11 +239,7 @@ class OnBoardSensors:
           return 0;                             // 返回0表示操作成功
         }
         """
-        current = perf_counter_ns()
-        if current - OnBoardSensors.last_update_timestamp < OnBoardSensors.__adc_min_sample_interval_ns:
-            OnBoardSensors.last_update_timestamp = current
-            return OnBoardSensors.acc_all
-        OnBoardSensors.__lib.ADC_GetAll(OnBoardSensors._adc_all)
+        OnBoardSensors._ADC_GetAll(OnBoardSensors._adc_all)
         return OnBoardSensors._adc_all
 
     @staticmethod
@@ -138,8 +258,21 @@ class OnBoardSensors:
           spi_write(pi_1, hspi1, v3, 2);
           return 0;
         }
+
+        NOTE:
+            the write is skipped if the shadow register shows the level is already set,
+            the shadow is only committed when the write succeeds, and becomes unknown when it fails
         """
-        OnBoardSensors.__lib.adc_io_Set(index, level)
+        shadow = OnBoardSensors._io_level_shadow
+        if shadow is None:
+            return OnBoardSensors._adc_io_Set(index, level)
+        bit = 1 << index
+        new_shadow = shadow | bit if level else shadow & ~bit
+        if new_shadow == shadow:
+            return 0
+        result = OnBoardSensors._adc_io_Set(index, level)
+        OnBoardSensors._io_level_shadow = None if result else new_shadow
+        return result
 
     @staticmethod
     def set_all_io_level(level: int):
@@ -163,11 +296,38 @@ class OnBoardSensors:
           spi_write(pi_1, hspi1, v3, 9);
           return 0;
         }
+
+        NOTE:
+            the level is a bitmask, bit i for the channel i
+        """
+        level &= 0xFF
+        if level == OnBoardSensors._io_level_shadow:
+            return 0
+        result = OnBoardSensors._adc_io_SetAll(level)
+        OnBoardSensors._io_level_shadow = None if result else level
+        return result
+
+    @staticmethod
+    def set_io_levels_masked(mask: int, levels: int):
+        """
+        set the levels of the channels selected by the mask in a single adc_io_SetAll,
+        the other channels keep the levels in the shadow register
+
+        Args:
+            mask: bit i selects the channel i
+            levels: bit i is the level of the channel i, the bits out of the mask are ignored
         """
-        OnBoardSensors.__lib.adc_io_SetAll(level)
+        shadow = OnBoardSensors._io_level_shadow
+        if shadow is None:
+            # the channels in output mode read back the levels they are driving, see the io_exec
+            io = OnBoardSensors._adc_io_InputGetAll()
+            if io < 0:
+                return -1
+            shadow = io & 0xFF
+        return OnBoardSensors.set_all_io_level(shadow & ~mask | levels & mask)
 
     @staticmethod
-    def get_all_io_mode(buffer: int):
+    def get_all_io_mode(buffer: ctypes.Array):
         """
         int __fastcall adc_io_ModeGetAll(_BYTE *a1)
         {
@@ -182,12 +342,12 @@ class OnBoardSensors:
           return result;
         }
         """
-        return OnBoardSensors.__lib.adc_io_ModeGetAll(buffer)
+        return OnBoardSensors._adc_io_ModeGetAll(buffer)
 
     @staticmethod
     def get_io_level(index: int) -> int:
 
-        return (OnBoardSensors.__lib.adc_io_InputGetAll() >> index) & 1
+        return (OnBoardSensors._adc_io_InputGetAll() >> index) & 1
 
     @staticmethod
     def set_all_io_mode(mode: int):
@@ -203,8 +363,43 @@ class OnBoardSensors:
           spi_write(pi_1, hspi1, v2, 2);
           return 0;
         }
+
+        NOTE:
+            the mode is a bitmask, bit i for the channel i, 1 for output, 0 for input
+        """
+        mode &= 0xFF
+        if mode == OnBoardSensors._io_mode_shadow:
+            return 0
+        result = OnBoardSensors._adc_io_ModeSetAll(mode)
+        OnBoardSensors._io_mode_shadow = None if result else mode
+        return result
+
+    @staticmethod
+    def set_io_modes_masked(mask: int, modes: int):
+        """
+        set the modes of the channels selected by the mask in a single adc_io_ModeSetAll,
+        the other channels keep the modes in the shadow register
+
+        Args:
+            mask: bit i selects the channel i
+            modes: bit i is the mode of the channel i, the bits out of the mask are ignored
+        """
+        shadow = OnBoardSensors._io_mode_shadow
+        if shadow is None:
+            # the modes can be read back, which takes only one more transaction than the shadowed writes
+            buffer = (ctypes.c_uint8 * 1)()
+            if OnBoardSensors._adc_io_ModeGetAll(buffer):
+                return -1
+            shadow = buffer[0]
+        return OnBoardSensors.set_all_io_mode(shadow & ~mask | modes & mask)
+
+    @staticmethod
+    def invalidate_io_shadow():
+        """
+        forget the shadow registers, call it when the io registers are written by others
         """
-        OnBoardSensors.__lib.adc_io_ModeSetAll(mode)
+        OnBoardSensors._io_mode_shadow = None
+        OnBoardSensors._io_level_shadow = None
 
     @staticmethod
     def set_io_mode(index: int, mode: int):
@@ -233,19 +428,32 @@ class OnBoardSensors:
           v4[0] &= ~(1 << v2);
           return j_adc_io_ModeSetAll();
         }
-        """
 
-        OnBoardSensors.__lib.adc_io_ModeSet(index, mode)
+        NOTE:
+            the read-modify-write above costs 2 transactions for each pin,
+            with the shadow register it costs at most one, and none if the mode is unchanged
+        """
+        bit = 1 << index
+        return OnBoardSensors.set_io_modes_masked(bit, bit if mode else 0)
 
     @staticmethod
-    def io_all_channels():
+    @SampleCache(IO_SOURCE, SAMPLE_INTERVALS_MS[IO_SOURCE])
+    def io_all_channels_packed() -> int:
         """
-        get all io plug input levels
+        get all io plug input levels in a single byte
 
         uint8, each bit represents a channel, 1 for high, 0 for low
         """
-        updated_data = OnBoardSensors.__lib.adc_io_InputGetAll()
-        return tuple((updated_data >> i) & 1 for i in range(8))
+        return OnBoardSensors._adc_io_InputGetAll() & 0xFF
+
+    @staticmethod
+    def io_all_channels() -> Tuple[int, ...]:
+        """
+        get all io plug input levels, decoded by the IO_LEVEL_TABLE
+
+        Returns: the levels of the channels, 1 for high, 0 for low
+        """
+        return IO_LEVEL_TABLE[OnBoardSensors.io_all_channels_packed()]
 
     @staticmethod
     def MPU6500_Open(debug_info: bool = False):
@@ -256,30 +464,33 @@ class OnBoardSensors:
             gyro: -+2000 degree/s
             sampling rate: 1kHz
         """
-        if OnBoardSensors.__lib.mpu6500_dmp_init():
+        if OnBoardSensors._mpu6500_dmp_init():
             warnings.warn('#failed to initialize MPU6500')
         elif debug_info:
             warnings.warn('#MPU6500 successfully initialized')
 
     @staticmethod
+    @SampleCache(ACCEL_SOURCE, SAMPLE_INTERVALS_MS[ACCEL_SOURCE])
     def acc_all():
         """
         get the acceleration from MPU6500
         """
-        OnBoardSensors.__lib.mpu6500_Get_Accel(OnBoardSensors._accel_all)
+        OnBoardSensors._mpu6500_Get_Accel(OnBoardSensors._accel_all)
 
         return OnBoardSensors._accel_all
 
     @staticmethod
+    @SampleCache(GYRO_SOURCE, SAMPLE_INTERVALS_MS[GYRO_SOURCE])
     def gyro_all():
         """
         get gyro from MPU6500
         """
-        OnBoardSensors.__lib.mpu6500_Get_Gyro(OnBoardSensors._gyro_all)
+        OnBoardSensors._mpu6500_Get_Gyro(OnBoardSensors._gyro_all)
 
         return OnBoardSensors._gyro_all
 
     @staticmethod
+    @SampleCache(ATTI_SOURCE, SAMPLE_INTERVALS_MS[ATTI_SOURCE])
     def atti_all():
         """
         Get attitude from MPU6500
@@ -289,15 +500,159 @@ class OnBoardSensors:
             So, high sampling-frequency may not be a good option
         """
 
-        OnBoardSensors.__lib.mpu6500_Get_Attitude(OnBoardSensors._atti_all)
+        OnBoardSensors._mpu6500_Get_Attitude(OnBoardSensors._atti_all)
 
         return OnBoardSensors._atti_all
 
+    @staticmethod
+    def read_all() -> np.ndarray:
+        """
+        read the adc, io, acceleration, gyro and attitude in one native call
+
+        Returns:
+            a zero-copy 0-d structured view of the sensor frame, see SENSOR_FRAME_DTYPE for the fields.
+
+        NOTE:
+            the view is shared and will be overwritten by the next call, copy it if it should be kept.
+            the fields failed to read keep the stale values, check the read_all_failures
+        """
+        OnBoardSensors._read_all_failures = OnBoardSensors._uptech_read_all(OnBoardSensors._sensor_frame)
+        return OnBoardSensors._sensor_frame_view
+
+    @staticmethod
+    def read_all_failures() -> int:
+        """
+        Returns:
+            the READ_FAIL_* flags of the fields the last read_all failed to read, 0 if all are fresh
+        """
+        return OnBoardSensors._read_all_failures
+
+    @staticmethod
+    def _read_all_fallback(frame: SensorFrame) -> int:
+        """
+        fill the sensor frame with separated calls, used when the libuptech_ext.so is not available
+
+        Returns:
+            the READ_FAIL_* flags, the same as the uptech_read_all does
+        """
+        failures = 0
+        if OnBoardSensors._ADC_GetAll(frame.adc):
+            failures |= READ_FAIL_ADC
+        io = OnBoardSensors._adc_io_InputGetAll()
+        if io < 0:
+            failures |= READ_FAIL_IO
+        else:
+            frame.io = io & 0xFF
+        if OnBoardSensors._mpu6500_Get_Accel(frame.accel):
+            failures |= READ_FAIL_ACCEL
+        if OnBoardSensors._mpu6500_Get_Gyro(frame.gyro):
+            failures |= READ_FAIL_GYRO
+        if OnBoardSensors._mpu6500_Get_Attitude(frame.atti):
+            failures |= READ_FAIL_ATTI
+        return failures
+
+    @staticmethod
+    def io_exec(ops: ctypes.Array, op_count: int, mask: int, samples: ctypes.Array, half_period_us: int,
+                timeout_us: int = 1000) -> int:
+        """
+        play an io waveform in one native call, see IO_OP_* for the ops.
+        only the channels selected by the mask are changed, the others keep the states in the shadow registers,
+        the unknown shadow registers are read back before playing
+
+        Args:
+            ops: the waveform, a c_uint16 array
+            op_count: the count of the ops to play
+            mask: bit i selects the channel i
+            samples: a c_uint8 array that receives the input levels of every IO_OP_SAMPLE
+            half_period_us: the unit of the IO_OP_DELAY
+            timeout_us: the timeout of every IO_OP_WAIT_HIGH
+
+        Returns:
+            the count of the samples, IO_EXEC_FAIL for the failure of the transaction,
+            IO_EXEC_TIMEOUT if the channels are not released in time
+        """
+        level_ref = OnBoardSensors._io_level_ref
+        mode_ref = OnBoardSensors._io_mode_ref
+        if OnBoardSensors._io_mode_shadow is None:
+            if OnBoardSensors._adc_io_ModeGetAll(mode_ref):
+                return IO_EXEC_FAIL
+            OnBoardSensors._io_mode_shadow = mode_ref[0]
+        if OnBoardSensors._io_level_shadow is None:
+            # the channels in output mode read back the levels they are driving, the input ones are kept
+            # as they read, masking them out would write zeros into their latches on the next IO_OP_LEVELS
+            io = OnBoardSensors._adc_io_InputGetAll()
+            if io < 0:
+                return IO_EXEC_FAIL
+            OnBoardSensors._io_level_shadow = io & 0xFF
+        level_ref[0] = OnBoardSensors._io_level_shadow
+        mode_ref[0] = OnBoardSensors._io_mode_shadow
+        result = OnBoardSensors._uptech_io_exec(ops, op_count, mask, level_ref, mode_ref, samples, half_period_us,
+                                                timeout_us)
+        OnBoardSensors._io_level_shadow = level_ref[0]
+        OnBoardSensors._io_mode_shadow = mode_ref[0]
+        return result
+
+    @staticmethod
+    def _io_exec_fallback(ops: ctypes.Array, op_count: int, mask: int, level_ref: ctypes.Array,
+                          mode_ref: ctypes.Array, samples: ctypes.Array, half_period_us: int,
+                          timeout_us: int) -> int:
+        """
+        play the io waveform in python, used when the libuptech_ext.so is not available
+        """
+        sample_count = 0
+        half_period_ns = half_period_us * 1000
+        timeout_ns = timeout_us * 1000
+        deadline = perf_counter_ns()
+        for op in ops[:op_count]:
+            code = op >> 8
+            arg = op & 0xFF
+            if code == IO_OP_LEVELS:
+                value = level_ref[0] & ~mask | arg & mask
+                if value != level_ref[0]:
+                    if OnBoardSensors._adc_io_SetAll(value):
+                        return IO_EXEC_FAIL
+                    level_ref[0] = value
+            elif code == IO_OP_MODES:
+                value = mode_ref[0] & ~mask | arg & mask
+                if value != mode_ref[0]:
+                    if OnBoardSensors._adc_io_ModeSetAll(value):
+                        return IO_EXEC_FAIL
+                    mode_ref[0] = value
+            elif code == IO_OP_SAMPLE:
+                io = OnBoardSensors._adc_io_InputGetAll()
+                if io < 0:
+                    return IO_EXEC_FAIL
+                samples[sample_count] = io
+                sample_count += 1
+            elif code == IO_OP_DELAY:
+                # count the time of the transactions into the half period, realign when falling behind
+                deadline = max(deadline + half_period_ns * arg, perf_counter_ns())
+                while perf_counter_ns() < deadline:
+                    pass
+            elif code == IO_OP_WAIT_HIGH:
+                timeout_at = perf_counter_ns() + timeout_ns
+                while True:
+                    io = OnBoardSensors._adc_io_InputGetAll()
+                    if io < 0:
+                        return IO_EXEC_FAIL
+                    if io & arg == arg:
+                        break
+                    if perf_counter_ns() > timeout_at:
+                        return IO_EXEC_TIMEOUT
+                # the following half periods start from the release
+                deadline = perf_counter_ns()
+            else:
+                return IO_EXEC_FAIL
+        return sample_count
+
     @staticmethod
     def get_handle(attr_name: str):
         return getattr(OnBoardSensors.__lib, attr_name)
 
 
+OnBoardSensors.bind_lib(load_uptech_lib(), load_uptech_ext_lib())
+
+
 def sample_freq_test(func):
     """
 
@@ -373,6 +728,27 @@ def pin_mode_setter_constructor(indexed_mode_setter: IndexedSetter, pin: int) ->
     return set_pin_mode
 
 
+def masked_pin_mode_setter_constructor(masked_mode_setter: MaskedSetter, pins: Sequence[int]) -> PinModeSetter:
+    """
+
+    Args:
+        masked_mode_setter: the function that sets the modes of the pins selected by the mask in bulk
+        pins: the pins to be connected
+
+    Returns:
+        the function that sets the mode of all the pins at once
+
+    """
+    mask = 0
+    for pin in pins:
+        mask |= 1 << pin
+
+    def set_pin_mode(mode: int):
+        masked_mode_setter(mask, mask if mode else 0)
+
+    return set_pin_mode
+
+
 def multiple_pin_mode_setter_constructor(indexed_mode_setter: IndexedSetter, pins: Sequence[int]) -> PinModeSetter:
     """
 
@@ -1,12 +1,14 @@
 import json
 import os
 import re
+import sys
 import warnings
 from abc import ABCMeta, abstractmethod
-from ctypes import CDLL, cdll
+from ctypes import CDLL, DEFAULT_MODE
+from ctypes.util import find_library
 from functools import wraps, singledispatch, lru_cache
 from types import MappingProxyType
-from typing import Optional, List, Dict, final, Any, Sequence, Set, Union, Tuple
+from typing import Optional, List, Dict, final, Any, Sequence, Set, Union, Tuple, Mapping
 
 from colorama import Back, Fore, Style
 from dill import dump, load
@@ -16,6 +18,9 @@ from ..constant import LIB_DIR_PATH
 Value = Union[str, int, float, List, Dict]
 CONFIG_PATH_PATTERN = r"[\\/]"
 
+Prototype = Tuple[Optional[type], Tuple[type, ...]]
+LIB_SUFFIXES: Dict[str, str] = {'linux': '.so', 'darwin': '.dylib', 'win32': '.dll', 'cygwin': '.dll'}
+
 
 def registry_path_to_chain(config_registry_path) -> List[str]:
     """
@@ -504,9 +509,63 @@ def format_json_file(file_path):
             return f"Failed to parse JSON: {e}"
 
 
+def find_lib_path(libname: str) -> str:
+    """
+    Find the path of a shared library.
+
+    The lookup order is as follows:
+        1. the file in the package lib dir, as it is named
+        2. the file in the package lib dir, with the suffix of the current platform
+        3. the library found by the system loader, see ctypes.util.find_library
+
+    Args:
+        libname: the name of the library, such as 'libuptech.so'
+
+    Returns:
+        the path of the library, falls back to the path in the lib dir if nothing is found,
+        so that the loader would raise a meaningful OSError
+    """
+    lib_file_name = os.path.join(LIB_DIR_PATH, libname)
+    if os.path.exists(lib_file_name):
+        return lib_file_name
+    stem = os.path.splitext(libname)[0]
+    platform_lib_file_name = os.path.join(LIB_DIR_PATH, stem + LIB_SUFFIXES.get(sys.platform, '.so'))
+    if os.path.exists(platform_lib_file_name):
+        return platform_lib_file_name
+    system_lib_file_name = find_library(stem[3:] if stem.startswith('lib') else stem)
+    return system_lib_file_name if system_lib_file_name else lib_file_name
+
+
 @lru_cache(maxsize=None)
-def load_lib(libname: str) -> CDLL:
+def load_lib(libname: str, mode: int = DEFAULT_MODE) -> CDLL:
     """Load a shared library, with caching"""
-    lib_file_name = f"{LIB_DIR_PATH}/{libname}"
+    lib_file_name = find_lib_path(libname)
     print(f"Loading [{lib_file_name}]")
-    return cdll.LoadLibrary(lib_file_name)
+    return CDLL(lib_file_name, mode=mode)
+
+
+def declare_prototypes(lib: CDLL, prototypes: Mapping[str, Prototype]) -> CDLL:
+    """
+    Declare the restype and the argtypes of the symbols exported by the lib.
+
+    Typed prototypes save the dynamic argument conversion on every call and prevent
+    the return values from being truncated to int.
+    CDLL caches the function pointers as attributes on the first access,
+    so the later accesses will get the typed ones.
+
+    Args:
+        lib: the loaded library
+        prototypes: the binding table, symbol name -> (restype, argtypes)
+
+    Returns:
+        the lib itself
+    """
+    for symbol, (restype, argtypes) in prototypes.items():
+        try:
+            func_ptr = getattr(lib, symbol)
+        except AttributeError:
+            warnings.warn(f'##Symbol [{symbol}] is not exported by {lib}##')
+            continue
+        func_ptr.restype = restype
+        func_ptr.argtypes = argtypes
+    return lib
@@ -1,13 +1,13 @@
-import warnings
+from abc import ABCMeta, abstractmethod
+from threading import Thread
+from time import perf_counter, sleep
+from typing import Dict, Optional, Tuple, Any, List
 
-from .os_tools import load_lib
+from .libuptech import load_uptech_lib, UptechLib
 
 
 class Screen(object):
-    try:
-        so_up = load_lib('libuptech.so')
-    except OSError:
-        warnings.warn('##Screen: Failed to load libuptech.so##')
+    so_up: UptechLib
     # region font size definitions
     FONT_4X6 = 0
     FONT_5X8 = 1
@@ -32,6 +32,13 @@ class Screen(object):
         FONT_16X26, FONT_22X36, FONT_24X40
 
     )
+    # the (width, height) of a char of the fonts, in pixel
+    FONT_SIZES = {
+        FONT_4X6: (4, 6), FONT_5X8: (5, 8), FONT_5X12: (5, 12), FONT_6X8: (6, 8),
+        FONT_6X10: (6, 10), FONT_7X12: (7, 12), FONT_8X8: (8, 8), FONT_8X12: (8, 12),
+        FONT_8X14: (8, 14), FONT_10X16: (10, 16), FONT_12X16: (12, 16), FONT_12X20: (12, 20),
+        FONT_16X26: (16, 26), FONT_22X36: (22, 36), FONT_24X40: (24, 40)
+    }
     # endregion
 
     # region color Hex value
@@ -73,6 +80,19 @@ class Screen(object):
             Screen.fill_screen(Screen.COLOR_BLACK)
             Screen.refresh()
 
+    @classmethod
+    def bind_lib(cls, lib: UptechLib) -> None:
+        """
+        bind the screen to the given lib, the function pointers are cached as class attributes
+        to save the attribute lookups on every call
+        """
+        cls.so_up = lib
+        for symbol in ('lcd_open', 'LCD_Refresh', 'LCD_SetFont', 'UG_SetForecolor', 'UG_SetBackcolor',
+                       'adc_led_set', 'UG_FillScreen', 'UG_PutString', 'UG_FillFrame', 'UG_FillRoundFrame',
+                       'UG_FillCircle', 'UG_DrawMesh', 'UG_DrawFrame', 'UG_DrawRoundFrame', 'UG_DrawPixel',
+                       'UG_DrawCircle', 'UG_DrawArc', 'UG_DrawLine'):
+            setattr(cls, f'_{symbol}', getattr(lib, symbol))
+
     @staticmethod
     def open(direction: int = 2):
         """
@@ -82,46 +102,46 @@ class Screen(object):
         """
         assert direction == 1 or direction == 2, "1 for vertical and 2 for horizontal"
 
-        return Screen.so_up.lcd_open(direction)
+        return Screen._lcd_open(direction)
 
     @staticmethod
     def refresh():
         """
         clear the displayed contents
         """
-        Screen.so_up.LCD_Refresh()
+        Screen._LCD_Refresh()
 
     @staticmethod
     def set_font_size(font_size: int):
-        Screen.so_up.LCD_SetFont(font_size)
+        Screen._LCD_SetFont(font_size)
 
     @staticmethod
     def set_fore_color(color: int):
         """
         set the fore color
         """
-        Screen.so_up.UG_SetForecolor(color)
+        Screen._UG_SetForecolor(color)
 
     @staticmethod
     def set_back_color(color: int):
         """
         set the LCD background color
         """
-        Screen.so_up.UG_SetBackcolor(color)
+        Screen._UG_SetBackcolor(color)
 
     @staticmethod
     def set_led_color(index: int, color: int):
         """
         set the color of the LED according to index and color
         """
-        Screen.so_up.adc_led_set(index, color)
+        Screen._adc_led_set(index, color)
 
     @staticmethod
     def fill_screen(color: int):
         """
         fill the screen with the given color
         """
-        Screen.so_up.UG_FillScreen(color)
+        Screen._UG_FillScreen(color)
 
     @staticmethod
     def put_string(x: int, y: int, display_string: str):
@@ -131,48 +151,358 @@ class Screen(object):
         display_string is  string that will be displayed in the LCD
 
         """
-        Screen.so_up.UG_PutString(x, y, display_string.encode())
+        Screen._UG_PutString(x, y, display_string.encode())
 
     @staticmethod
     def fill_frame(x1, y1, x2, y2, color: int):
-        Screen.so_up.UG_FillFrame(x1, y1, x2, y2, color)
+        Screen._UG_FillFrame(x1, y1, x2, y2, color)
 
     @staticmethod
     def fill_round_frame(x1, y1, x2, y2, r, color: int):
-        Screen.so_up.UG_FillRoundFrame(x1, y1, x2, y2, r, color)
+        Screen._UG_FillRoundFrame(x1, y1, x2, y2, r, color)
 
     @staticmethod
     def fill_circle(x0, y0, r, color: int):
-        Screen.so_up.UG_FillCircle(x0, y0, r, color)
+        Screen._UG_FillCircle(x0, y0, r, color)
 
     @staticmethod
     def draw_mesh(x1, y1, x2, y2, color: int):
-        Screen.so_up.UG_DrawMesh(x1, y1, x2, y2, color)
+        Screen._UG_DrawMesh(x1, y1, x2, y2, color)
 
     @staticmethod
     def draw_frame(x1, y1, x2, y2, color: int):
-        Screen.so_up.UG_DrawFrame(x1, y1, x2, y2, color)
+        Screen._UG_DrawFrame(x1, y1, x2, y2, color)
 
     @staticmethod
     def draw_round_frame(x1, y1, x2, y2, r, color: int):
-        Screen.so_up.UG_DrawRoundFrame(x1, y1, x2, y2, r, color)
+        Screen._UG_DrawRoundFrame(x1, y1, x2, y2, r, color)
 
     @staticmethod
     def draw_pixel(x0, y0, color: int):
-        Screen.so_up.UG_DrawPixel(x0, y0, color)
+        Screen._UG_DrawPixel(x0, y0, color)
 
     @staticmethod
     def draw_circle(x0, y0, r, color: int):
-        Screen.so_up.UG_DrawCircle(x0, y0, r, color)
+        Screen._UG_DrawCircle(x0, y0, r, color)
 
     @staticmethod
     def draw_arc(x0: int, y0: int, r, s, color: int):
-        Screen.so_up.UG_DrawArc(x0, y0, r, s, color)
+        Screen._UG_DrawArc(x0, y0, r, s, color)
 
     @staticmethod
     def draw_line(x1: int, y1: int, x2: int, y2: int, color: int):
-        Screen.so_up.UG_DrawLine(x1, y1, x2, y2, color)
+        Screen._UG_DrawLine(x1, y1, x2, y2, color)
+
+
+class Pen(object):
+    """
+    the drawing state of the lcd, the font and the colors are only set when they change
+    """
+
+    def __init__(self):
+        self._font: Optional[int] = None
+        self._fore_color: Optional[int] = None
+        self._back_color: Optional[int] = None
+        self.draw_calls: int = 0
+
+    def use(self, font: int, fore_color: int, back_color: int) -> None:
+        if font != self._font:
+            Screen.set_font_size(font)
+            self._font = font
+            self.draw_calls += 1
+        if fore_color != self._fore_color:
+            Screen.set_fore_color(fore_color)
+            self._fore_color = fore_color
+            self.draw_calls += 1
+        if back_color != self._back_color:
+            Screen.set_back_color(back_color)
+            self._back_color = back_color
+            self.draw_calls += 1
+
+    def reset(self) -> None:
+        """
+        forget the state, the next use sets everything again
+        """
+        self._font = self._fore_color = self._back_color = None
+
+
+class Widget(metaclass=ABCMeta):
+    """
+    a retained element of the ScreenLayer, holds the value to show and the one on the lcd,
+    only redrawn when they differ
+    """
+
+    def __init__(self, value: Any = None):
+        self.value: Any = value
+        self._drawn: Any = None
+        self._is_drawn: bool = False
+
+    @property
+    def dirty(self) -> bool:
+        return not self._is_drawn or self.value != self._drawn
+
+    def invalidate(self) -> None:
+        self._is_drawn = False
+
+    def render(self, pen: Pen, back_color: int) -> None:
+        """
+        draw the value if it changed since the last render
+        """
+        if self.dirty:
+            self.draw(pen, back_color)
+            self._drawn = self.value
+            self._is_drawn = True
+
+    @abstractmethod
+    def draw(self, pen: Pen, back_color: int) -> None:
+        """
+        draw the value on the lcd, called by the render only if the widget is dirty
+
+        Args:
+            pen: counts the draw calls and skips the redundant font and color settings
+            back_color: the back color of the layer
+        """
+
+
+class TextField(Widget):
+    """
+    a line of text, the value is formatted by the fmt.
+    the chars are drawn over the old ones with the back color, only the tail left by a longer old text is cleared
+    """
+
+    def __init__(self, x: int, y: int, fmt: str = '{}', value: Any = '', font: int = Screen.FONT_8X12,
+                 fore_color: int = Screen.COLOR_WHITE, back_color: Optional[int] = None):
+        """
+
+        Args:
+            x: the x of the top-left corner, in pixel
+            y: the y of the top-left corner, in pixel
+            fmt: formats the value into the text, such as 'adc0: {:4d}'
+            value: the initial value
+            font: one of the Screen.FONTS
+            fore_color: the color of the text
+            back_color: the color behind the text, defaults to the back color of the layer
+        """
+        super().__init__(value)
+        self.x: int = x
+        self.y: int = y
+        self.fmt: str = fmt
+        self.font: int = font
+        self.fore_color: int = fore_color
+        self.back_color: Optional[int] = back_color
+        self._drawn_text: str = ''
+        # formatted by the dirty check, and drawn by the draw following it
+        self._text: str = ''
+
+    @property
+    def dirty(self) -> bool:
+        # the text is compared instead of the value, the values formatted the same are not redrawn
+        self._text = self.fmt.format(self.value)
+        return not self._is_drawn or self._text != self._drawn_text
+
+    def draw(self, pen: Pen, back_color: int) -> None:
+        text = self._text
+        back_color = back_color if self.back_color is None else self.back_color
+        char_width, char_height = Screen.FONT_SIZES[self.font]
+        if len(text) < len(self._drawn_text):
+            Screen.fill_frame(self.x + len(text) * char_width, self.y,
+                              self.x + len(self._drawn_text) * char_width - 1, self.y + char_height - 1, back_color)
+            pen.draw_calls += 1
+        if text:
+            pen.use(self.font, self.fore_color, back_color)
+            Screen.put_string(self.x, self.y, text)
+            pen.draw_calls += 1
+        self._drawn_text = text
+
+
+class FilledBox(Widget):
+    """
+    a filled rectangle, the value is the color
+    """
+
+    def __init__(self, x1: int, y1: int, x2: int, y2: int, color: int = Screen.COLOR_WHITE):
+        super().__init__(color)
+        self.box: Tuple[int, int, int, int] = (x1, y1, x2, y2)
+
+    def draw(self, pen: Pen, back_color: int) -> None:
+        Screen.fill_frame(*self.box, self.value)
+        pen.draw_calls += 1
+
+
+class BarGauge(Widget):
+    """
+    a horizontal bar, the value is the filled ratio in [0, 1].
+    only the strip between the old and the new fill is drawn
+    """
+
+    def __init__(self, x1: int, y1: int, x2: int, y2: int, value: float = 0.,
+                 color: int = Screen.COLOR_GREEN, back_color: Optional[int] = None):
+        super().__init__(value)
+        self.box: Tuple[int, int, int, int] = (x1, y1, x2, y2)
+        self.color: int = color
+        self.back_color: Optional[int] = back_color
+        self._drawn_end: int = x1
+
+    def _fill_end(self) -> int:
+        x1, _, x2, _ = self.box
+        return x1 + int(round(min(max(self.value, 0.), 1.) * (x2 - x1 + 1)))
+
+    @property
+    def dirty(self) -> bool:
+        # the values filling the same pixels are not redrawn
+        return not self._is_drawn or self._fill_end() != self._drawn_end
+
+    def draw(self, pen: Pen, back_color: int) -> None:
+        x1, y1, x2, y2 = self.box
+        back_color = back_color if self.back_color is None else self.back_color
+        end = self._fill_end()
+        if not self._is_drawn:
+            Screen.fill_frame(x1, y1, x2, y2, back_color)
+            self._drawn_end = x1
+            pen.draw_calls += 1
+        if end > self._drawn_end:
+            Screen.fill_frame(self._drawn_end, y1, end - 1, y2, self.color)
+            pen.draw_calls += 1
+        elif end < self._drawn_end:
+            Screen.fill_frame(end, y1, self._drawn_end - 1, y2, back_color)
+            pen.draw_calls += 1
+        self._drawn_end = end
+
+
+class ScreenLayer(object):
+    """
+    a retained-mode layer over the Screen, the widgets keep what should be on the lcd,
+    a render draws only the widgets changed since the last one and refreshes the lcd once,
+    at no more than the max fps, so a dashboard of many fields costs a few ffi calls per frame.
+
+    Examples:
+        layer = ScreenLayer(max_fps=10)
+        speed = layer.add('speed', TextField(0, 0, 'speed:{:5d}'))
+        layer.start()
+        ...
+        layer['speed'] = 1200
+    """
+
+    def __init__(self, max_fps: float = 10., back_color: int = Screen.COLOR_BLACK):
+        """
+
+        Args:
+            max_fps: the max refresh rate of the lcd
+            back_color: the color of the blank screen, also the default back color of the widgets
+        """
+        self._min_interval: float = 1 / max_fps if max_fps > 0 else 0.
+        self.back_color: int = back_color
+        self._widgets: Dict[str, Widget] = {}
+        self._pen: Pen = Pen()
+        self._last_render: float = -float('inf')
+        self._needs_clear: bool = True
+
+        self.refresh_count: int = 0
+        self._should_continue: bool = False
+        self._render_thread: Optional[Thread] = None
+
+    def add(self, name: str, widget: Widget) -> Widget:
+        self._widgets[name] = widget
+        return widget
+
+    def remove(self, name: str) -> None:
+        """
+        remove the widget, the screen is cleared and everything is redrawn by the next render
+        """
+        del self._widgets[name]
+        self.invalidate()
+
+    def __getitem__(self, name: str) -> Any:
+        return self._widgets[name].value
+
+    def __setitem__(self, name: str, value: Any) -> None:
+        self._widgets[name].value = value
+
+    def widget(self, name: str) -> Widget:
+        return self._widgets[name]
+
+    @property
+    def widgets(self) -> List[Widget]:
+        return list(self._widgets.values())
+
+    @property
+    def draw_calls(self) -> int:
+        """
+        the count of the drawing calls made into the lib, the refreshes are not included
+        """
+        return self._pen.draw_calls
 
+    @property
+    def dirty(self) -> bool:
+        return self._needs_clear or any(widget.dirty for widget in self._widgets.values())
+
+    def invalidate(self) -> None:
+        """
+        clear the screen and redraw all the widgets by the next render, such as after the screen is drawn directly
+        """
+        self._needs_clear = True
+        self._pen.reset()
+
+    def render(self, force: bool = False) -> bool:
+        """
+        draw the changed widgets and refresh the lcd once
+        Args:
+            force: ignore the max fps
+
+        Returns:
+            if the lcd is refreshed
+        """
+        now = perf_counter()
+        if not force and now - self._last_render < self._min_interval:
+            return False
+        if not self.dirty:
+            return False
+        self._last_render = now
+        if self._needs_clear:
+            Screen.fill_screen(self.back_color)
+            self._pen.draw_calls += 1
+            for widget in self._widgets.values():
+                widget.invalidate()
+            self._needs_clear = False
+        pen, back_color = self._pen, self.back_color
+        for widget in self._widgets.values():
+            widget.render(pen, back_color)
+        Screen.refresh()
+        self.refresh_count += 1
+        return True
+
+    def start(self) -> None:
+        """
+        render in a daemon thread at the max fps, the control loop only sets the values
+        """
+        if self._should_continue:
+            return
+        self._should_continue = True
+        self._render_thread = Thread(target=self._rendering_loop, name='screen_render_thread')
+        self._render_thread.daemon = True
+        self._render_thread.start()
+
+    def stop(self) -> None:
+        """
+        stop the render thread, the values set after its last render are drawn
+        """
+        self._should_continue = False
+        if self._render_thread:
+            self._render_thread.join()
+            self._render_thread = None
+        self.render(force=True)
+
+    def _rendering_loop(self) -> None:
+        interval = max(self._min_interval, 0.001)
+        while self._should_continue:
+            start = perf_counter()
+            self.render()
+            rest = interval - (perf_counter() - start)
+            if rest > 0:
+                sleep(rest)
+
+
+Screen.bind_lib(load_uptech_lib())
 
 if __name__ == '__main__':
     pass
@@ -1,5 +1,9 @@
-from time import perf_counter_ns
-from typing import Callable, Tuple, Union, Dict, Sequence, Optional
+import struct
+from bisect import bisect_right
+from time import perf_counter_ns, sleep
+from typing import Callable, Tuple, Union, Dict, Sequence, Optional, List
+
+import numpy as np
 
 from .timer import delay_us
 
@@ -9,6 +13,11 @@ SensorUpdaters = Tuple[Optional[FullUpdater], Optional[IndexedUpdater]]
 FU_INDEX = 0
 IU_INDEX = 1
 
+# the indexes of the fields in a source record of the SensorHub
+_SOURCE_UPDATER = 0
+_SOURCE_INTERVAL = 1
+_SOURCE_LAST_SAMPLE = 2
+
 
 def default_full_updater() -> Sequence[Union[float, int]]:
     return [-1]
@@ -19,17 +28,39 @@ def default_indexed_updater(index: int) -> Union[float, int]:
 
 
 class SensorHub(object):
+    """
+    a hub that multiplexes the sensor sources.
+
+    every source is read in bulk by its full updater, at most once per its own sample interval,
+    the results are stored in a preallocated structured array, which is shared by all the consumers.
+    so the slow sources, such as the attitude, would not be polled at the speed of the fast ones.
+    """
     ON_BOARD_ADC_ID = 0
     ON_BOARD_IO_ID = 1
     EXPANSION_ADC_ID = 2
     EXPANSION_IO_ID = 3
 
+    ON_BOARD_ADC = 'on_board_adc'
+    ON_BOARD_IO = 'on_board_io'
+    EXPANSION_ADC = 'expansion_adc'
+    EXPANSION_IO = 'expansion_io'
+
     def __init__(self,
                  on_board_adc_updater: SensorUpdaters,
                  on_board_io_updater: SensorUpdaters,
                  expansion_adc_updater: SensorUpdaters,
-                 expansion_io_updater: SensorUpdaters
+                 expansion_io_updater: SensorUpdaters,
+                 sample_intervals_ms: Sequence[float] = (0., 0., 0., 0.)
                  ):
+        """
+
+        Args:
+            on_board_adc_updater:
+            on_board_io_updater:
+            expansion_adc_updater:
+            expansion_io_updater:
+            sample_intervals_ms: the min sample interval of each of the sources above, in ms
+        """
 
         self._full_updaters = (
             on_board_adc_updater[FU_INDEX] if on_board_adc_updater[FU_INDEX] else default_full_updater,
@@ -49,6 +80,14 @@ class SensorHub(object):
         self.expansion_adc_updater = expansion_adc_updater
         self.expansion_io_updater = expansion_io_updater
 
+        self._sources: Dict[str, List] = {}
+        self._snapshot: np.ndarray = np.zeros((), dtype=np.dtype([]))
+        self._fields: Dict[str, np.ndarray] = {}
+        for name, full_updater, sample_interval_ms in zip(
+                (self.ON_BOARD_ADC, self.ON_BOARD_IO, self.EXPANSION_ADC, self.EXPANSION_IO),
+                self._full_updaters, sample_intervals_ms):
+            self.register_source(name, full_updater, sample_interval_ms)
+
     def __str__(self):
         temp = 'Updaters:\n'
         for updater in self._full_updaters:
@@ -61,6 +100,92 @@ class SensorHub(object):
     def updaters(self):
         return self._full_updaters, self._indexed_updaters
 
+    @property
+    def sources(self) -> Tuple[str, ...]:
+        """
+        names of all registered sources
+        """
+        return tuple(self._sources.keys())
+
+    def register_source(self, name: str, full_updater: FullUpdater, sample_interval_ms: float = 0.,
+                        dtype: Optional[np.dtype] = None) -> None:
+        """
+        register a source, the snapshot will be reallocated with a new field for it
+
+        Args:
+            name: the name of the source, also the field name in the snapshot
+            full_updater: reads all channels of the source
+            sample_interval_ms: the min interval between two bulk reads, 0 for reading on every request
+            dtype: the dtype of the channels, inferred from the first read if not given
+        """
+        if name in self._sources:
+            raise KeyError(f'{name} already registered')
+        first_sample = np.asarray(full_updater(), dtype=dtype)
+        old_snapshot = self._snapshot
+        fields = [(field_name, old_snapshot.dtype[field_name].base, old_snapshot.dtype[field_name].shape)
+                  for field_name in self._sources]
+        fields.append((name, first_sample.dtype, first_sample.shape))
+        self._snapshot = np.zeros((), dtype=np.dtype(fields))
+        for field_name in self._sources:
+            self._snapshot[field_name] = old_snapshot[field_name]
+        self._snapshot[name] = first_sample
+        self._sources[name] = [full_updater, int(sample_interval_ms * 1000000), perf_counter_ns()]
+        self._fields = {field_name: self._snapshot[field_name] for field_name in self._sources}
+
+    def set_sample_interval(self, name: str, sample_interval_ms: float) -> None:
+        self._sources[name][_SOURCE_INTERVAL] = int(sample_interval_ms * 1000000)
+
+    def refresh(self, name: str) -> np.ndarray:
+        """
+        bulk read the source if its last sample is stale
+
+        Returns:
+            the view of the source field in the snapshot
+        """
+        source = self._sources[name]
+        field = self._fields[name]
+        now = perf_counter_ns()
+        if now - source[_SOURCE_LAST_SAMPLE] >= source[_SOURCE_INTERVAL]:
+            field[...] = source[_SOURCE_UPDATER]()
+            source[_SOURCE_LAST_SAMPLE] = now
+        return field
+
+    def snapshot(self) -> np.ndarray:
+        """
+        refresh all the stale sources
+
+        Returns:
+            the preallocated 0-d structured array that contains all the sources, indexed by the source names.
+
+        NOTE:
+            the array is shared and updated in place, copy it if it should be kept
+        """
+        for name in self._sources:
+            self.refresh(name)
+        return self._snapshot
+
+    def full_updater(self, name: str) -> FullUpdater:
+        """
+        a full updater of the source that shares the bulk reads with the other consumers
+        """
+        refresh = self.refresh
+
+        def updater() -> np.ndarray:
+            return refresh(name)
+
+        return updater
+
+    def indexed_updater(self, name: str) -> IndexedUpdater:
+        """
+        an indexed updater of the source that shares the bulk reads with the other consumers
+        """
+        refresh = self.refresh
+
+        def updater(index: int) -> Union[float, int]:
+            return refresh(name)[index]
+
+        return updater
+
     @staticmethod
     def _updaters_validity_check(updaters: Sequence[FullUpdater]):
         if not all(updater() for updater in updaters):
@@ -83,6 +208,19 @@ class LocalFullUpdaterConstructor(object):
 
         return updater
 
+    @staticmethod
+    def from_sensor_hub(sensor_hub: SensorHub, source_name: str, sensor_ids: Sequence[int]) -> FullUpdater:
+        """
+        pick the sensors from a single bulk read of the hub source, instead of reading them one by one
+        """
+        sensor_ids = list(sensor_ids)
+        refresh = sensor_hub.refresh
+
+        def updater() -> Sequence[Union[float, int]]:
+            return refresh(source_name)[sensor_ids]
+
+        return updater
+
 
 def record_updater(updater: FullUpdater, duration: int, interval: int) -> Dict:
     result = []
@@ -92,3 +230,163 @@ def record_updater(updater: FullUpdater, duration: int, interval: int) -> Dict:
         delay_us(interval * 1000)
         result.append(list(updater()))
     return {f'{updater.__name__}-{duration}-{interval}': result}
+
+
+# region trace recording
+TRACE_MAGIC: bytes = b'UPTR'
+TRACE_VERSION: int = 1
+# magic, version, value format, channel count, sample interval in us
+TRACE_HEADER = struct.Struct('<4sBcHI')
+# the sleep is too coarse for the last few hundreds of us, spin instead
+SPIN_THRESHOLD_NS: int = 500000
+
+
+def _record_struct(value_format: str, channel_count: int) -> struct.Struct:
+    """
+    a record is the timestamp in ns since the start, followed by the channel values
+    """
+    return struct.Struct(f'<q{channel_count}{value_format}')
+
+
+def record_trace(updater: FullUpdater, file_path: str, duration: int, interval: float,
+                 value_format: str = 'H') -> int:
+    """
+    stream timestamped samples of the updater into a struct-packed binary trace file at a fixed rate.
+
+    the samples are scheduled on fixed ticks, so the time spent in the updater does not stretch the interval.
+
+    Args:
+        updater: the full updater to record
+        file_path: the trace file to write
+        duration: the recording duration, in ms
+        interval: the sample interval, in ms
+        value_format: the struct format of the channel values, 'H' for adc, 'B' for io, 'f' for mpu
+
+    Returns:
+        the count of the recorded samples
+    """
+    channel_count = len(updater())
+    record = _record_struct(value_format, channel_count)
+    interval_ns = int(interval * 1000000)
+    print(f"recording updater: {updater}, duration: {duration} ms, interval: {interval} ms, into {file_path}")
+    sample_count = 0
+    with open(file_path, mode='wb') as f:
+        f.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, value_format.encode(), channel_count,
+                                  int(interval * 1000)))
+        start = perf_counter_ns()
+        end_time = start + duration * 1000000
+        next_tick = start
+        while next_tick < end_time:
+            remaining = next_tick - perf_counter_ns()
+            if remaining > SPIN_THRESHOLD_NS:
+                sleep((remaining - SPIN_THRESHOLD_NS) / 1e9)
+            while perf_counter_ns() < next_tick:
+                pass
+            f.write(record.pack(perf_counter_ns() - start, *updater()))
+            sample_count += 1
+            next_tick += interval_ns
+    return sample_count
+
+
+def load_trace(file_path: str) -> Tuple[float, List[int], List[Tuple[Union[float, int], ...]]]:
+    """
+    load a trace file written by the record_trace
+
+    Args:
+        file_path: the trace file
+
+    Returns:
+        the sample interval in ms, the timestamps in ns, the samples
+    """
+    with open(file_path, mode='rb') as f:
+        content = f.read()
+    magic, version, value_format, channel_count, interval_us = TRACE_HEADER.unpack_from(content)
+    if magic != TRACE_MAGIC or version != TRACE_VERSION:
+        raise ValueError(f'{file_path} is not a valid trace file')
+    record = _record_struct(value_format.decode(), channel_count)
+    body = memoryview(content)[TRACE_HEADER.size:]
+    body = body[:len(body) - len(body) % record.size]
+    timestamps = []
+    samples = []
+    for timestamp, *values in record.iter_unpack(body):
+        timestamps.append(timestamp)
+        samples.append(tuple(values))
+    return interval_us / 1000, timestamps, samples
+
+
+class TraceReplayer(object):
+    """
+    feed a recorded trace back as the updaters, can be used in the watchers and the SensorHub
+
+    two replay modes are supported:
+        timed: the sample is chosen by the time passed since the replay started, multiplied by the speed
+        stepped: only the step advances the replay, by exactly one sample, which is fully deterministic.
+            call it once per control tick, the updaters read the current sample and never advance,
+            so the first read of the SensorHub and the watchers in the same tick all see the same sample
+    """
+
+    def __init__(self, file_path: str, speed: float = 1., stepped: bool = False, loop: bool = False):
+        """
+
+        Args:
+            file_path: the trace file written by the record_trace
+            speed: the replay speed, 2. means twice as fast as the recording, ignored in the stepped mode
+            stepped: use the stepped mode
+            loop: restart at the end of the trace, otherwise the last sample holds
+        """
+        self.interval_ms, self._timestamps, self.samples = load_trace(file_path)
+        if not self.samples:
+            raise ValueError(f'{file_path} contains no sample')
+        self._speed: float = speed
+        self._stepped: bool = stepped
+        self._loop: bool = loop
+        # the index of the current sample in the stepped mode
+        self._step_index: int = 0
+        self._start_ns: int = perf_counter_ns()
+        self._duration_ns: int = self._timestamps[-1] + int(self.interval_ms * 1000000)
+
+    def restart(self) -> None:
+        self._step_index = 0
+        self._start_ns = perf_counter_ns()
+
+    @property
+    def finished(self) -> bool:
+        """
+        if the replay has gone through the trace, always False in the loop mode
+        """
+        if self._loop:
+            return False
+        if self._stepped:
+            return self._step_index >= len(self.samples) - 1
+        return (perf_counter_ns() - self._start_ns) * self._speed >= self._duration_ns
+
+    def step(self) -> None:
+        """
+        advance the stepped replay by one sample, call it once per control tick
+        """
+        self._step_index += 1
+
+    def _current_index(self) -> int:
+        if self._stepped:
+            if self._loop:
+                return self._step_index % len(self.samples)
+            return min(self._step_index, len(self.samples) - 1)
+        elapsed = int((perf_counter_ns() - self._start_ns) * self._speed)
+        if self._loop:
+            elapsed %= self._duration_ns
+        return max(bisect_right(self._timestamps, elapsed) - 1, 0)
+
+    def full_updater(self) -> Sequence[Union[float, int]]:
+        return self.samples[self._current_index()]
+
+    def indexed_updater(self, index: int) -> Union[float, int]:
+        return self.samples[self._current_index()][index]
+
+    @property
+    def updaters(self) -> SensorUpdaters:
+        """
+        the updaters in the form that the SensorHub accepts
+        """
+        return self.full_updater, self.indexed_updater
+
+# endregion
@@ -63,10 +63,11 @@ class SerialHelper:
         :param serial_config: a dict that contains the critical transport parameters
         :param port: the serial port to use
         """
-        available_serial_ports = find_serial_ports()
-        assert available_serial_ports, "No serial ports FOUND!"
         self._serial: Serial = Serial(port=port, **serial_config)
         if port is None:
+            # only the port search relies on the comports, a given port such as a pty may not be listed
+            available_serial_ports = find_serial_ports()
+            assert available_serial_ports, "No serial ports FOUND!"
 
             # try to search for a new port
             warnings.warn('Searching available Ports')
@@ -0,0 +1,242 @@
+"""
+hardware simulation backend, runs the sensors, the motor driver and the screen without the robot
+"""
+import os
+import sys
+import tty
+import warnings
+from threading import Thread
+from time import perf_counter_ns
+from typing import Callable, Sequence, Union, Any, Dict, Tuple, Optional, List
+
+from .close_loop_controller import CloseLoopController
+from .libuptech import FakeUptechLib
+from .onboardsensors import OnBoardSensors
+from .screen import Screen
+from .timer import get_time_scale, set_time_scale
+from .. import constant
+
+# a scripted trace maps the simulation time(ms) to the channel values,
+# a recorded trace is a sequence of channel values sampled at a fixed interval
+ScriptedTrace = Callable[[float], Any]
+RecordedTrace = Sequence[Any]
+Trace = Union[ScriptedTrace, RecordedTrace]
+
+ADC_CHANNEL = 'adc'
+IO_CHANNEL = 'io'
+ACCEL_CHANNEL = 'accel'
+GYRO_CHANNEL = 'gyro'
+ATTI_CHANNEL = 'atti'
+TRACE_CHANNELS = (ADC_CHANNEL, IO_CHANNEL, ACCEL_CHANNEL, GYRO_CHANNEL, ATTI_CHANNEL)
+
+
+class SimulatedBoard(FakeUptechLib):
+    """
+    a FakeUptechLib whose sensor values are produced by the traces, also serves as a headless screen
+
+    the simulation time follows the time scale of the timer module,
+    so the traces keep pace with the delays of the ActionFrames
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._start_ns: int = perf_counter_ns()
+        self._traces: Dict[str, Tuple[Trace, float, bool]] = {}
+        self.lcd_texts: Dict[Tuple[int, int], str] = {}
+        self.lcd_refresh_count: int = 0
+
+    @property
+    def sim_time_ms(self) -> float:
+        """
+        the simulation time since the board is created or reset
+        """
+        return (perf_counter_ns() - self._start_ns) * get_time_scale() / 1000000
+
+    def reset_time(self) -> None:
+        self._start_ns = perf_counter_ns()
+
+    def set_trace(self, channel: str, trace: Trace, interval_ms: float = 1., loop: bool = False) -> None:
+        """
+        set the trace of a channel
+
+        Args:
+            channel: one of the TRACE_CHANNELS
+            trace: a scripted trace, or a recorded trace
+            interval_ms: the sample interval of the recorded trace, ignored by the scripted trace
+            loop: if the recorded trace restarts at the end, otherwise the last sample holds
+        """
+        if channel not in TRACE_CHANNELS:
+            raise KeyError(f'channel should be one of {TRACE_CHANNELS}')
+        self._traces[channel] = (trace, interval_ms, loop)
+
+    def _sample(self, channel: str) -> Optional[Any]:
+        """
+        sample the trace of the channel at the current simulation time
+        """
+        if channel not in self._traces:
+            return None
+        trace, interval_ms, loop = self._traces[channel]
+        if callable(trace):
+            return trace(self.sim_time_ms)
+        index = int(self.sim_time_ms / interval_ms)
+        return trace[index % len(trace) if loop else min(index, len(trace) - 1)]
+
+    # region sensors
+    def ADC_GetAll(self, buffer) -> int:
+        values = self._sample(ADC_CHANNEL)
+        if values is not None:
+            self.adc_values = list(values)
+        return super().ADC_GetAll(buffer)
+
+    def adc_io_InputGetAll(self) -> int:
+        levels = self._sample(IO_CHANNEL)
+        if levels is not None:
+            self.io_input_levels = int(levels)
+        return super().adc_io_InputGetAll()
+
+    def mpu6500_Get_Accel(self, buffer) -> int:
+        values = self._sample(ACCEL_CHANNEL)
+        if values is not None:
+            self.accel_values = list(values)
+        return super().mpu6500_Get_Accel(buffer)
+
+    def mpu6500_Get_Gyro(self, buffer) -> int:
+        values = self._sample(GYRO_CHANNEL)
+        if values is not None:
+            self.gyro_values = list(values)
+        return super().mpu6500_Get_Gyro(buffer)
+
+    def mpu6500_Get_Attitude(self, buffer) -> int:
+        values = self._sample(ATTI_CHANNEL)
+        if values is not None:
+            self.atti_values = list(values)
+        return super().mpu6500_Get_Attitude(buffer)
+
+    # endregion
+
+    # region headless screen
+    def UG_FillScreen(self, color: int) -> None:
+        self.lcd_calls += 1
+        self.lcd_texts.clear()
+
+    def UG_PutString(self, x: int, y: int, display_string: bytes) -> None:
+        self.lcd_calls += 1
+        self.lcd_texts[(x, y)] = display_string.decode()
+
+    def LCD_Refresh(self) -> None:
+        self.lcd_calls += 1
+        self.lcd_refresh_count += 1
+    # endregion
+
+
+class PtyMotorDriver(object):
+    """
+    a fake motor driver listening on a pty, parses the \\r-delimited cmds sent by the CloseLoopController
+
+    supported cmds:
+        RESET: stop all motors
+        v{speed}: set the speed of all motors
+        {motor_id}v{speed}: set the speed of the motor
+    """
+
+    def __init__(self, motor_ids: Sequence[int] = constant.MOTOR_IDS,
+                 cmd_handler: Optional[Callable[[str], None]] = None):
+        """
+        :param motor_ids: the ids of the motors on the driver
+        :param cmd_handler: called with every cmd received
+        """
+        self._master_fd, self._slave_fd = os.openpty()
+        tty.setraw(self._slave_fd)
+        self._port: str = os.ttyname(self._slave_fd)
+        self._cmd_handler: Callable[[str], None] = cmd_handler if cmd_handler else lambda cmd: None
+
+        self.motor_speeds: Dict[int, int] = {motor_id: 0 for motor_id in motor_ids}
+        self.cmd_count: int = 0
+        self.unknown_cmds: List[str] = []
+
+        self._read_thread: Thread = Thread(target=self._reading_loop, name='pty_motor_driver_thread')
+        self._read_thread.daemon = True
+        self._read_thread.start()
+
+    @property
+    def port(self) -> str:
+        """
+        the device path of the pty, pass it to the CloseLoopController as the port
+        """
+        return self._port
+
+    def _reading_loop(self) -> None:
+        pending = b''
+        while True:
+            try:
+                data = os.read(self._master_fd, 1024)
+            except OSError:
+                break
+            if not data:
+                break
+            pending += data
+            *cmds, pending = pending.split(b'\r')
+            for cmd in cmds:
+                self.parse_cmd(cmd.decode('ascii'))
+        warnings.warn('##PtyMotorDriver: pty closed##')
+
+    def parse_cmd(self, cmd: str) -> None:
+        """
+        apply a single cmd to the motor speeds, the unknown and the malformed cmds go to the unknown_cmds
+        """
+        self.cmd_count += 1
+        try:
+            if cmd == 'RESET':
+                self.motor_speeds = dict.fromkeys(self.motor_speeds, 0)
+            elif cmd.startswith('v'):
+                self.motor_speeds = dict.fromkeys(self.motor_speeds, int(cmd[1:]))
+            elif 'v' in cmd:
+                motor_id, speed = cmd.split('v', 1)
+                self.motor_speeds[int(motor_id)] = int(speed)
+            else:
+                self.unknown_cmds.append(cmd)
+        except ValueError:
+            # a malformed cmd must not kill the reading thread
+            self.unknown_cmds.append(cmd)
+        self._cmd_handler(cmd)
+
+    def close(self) -> None:
+        os.close(self._slave_fd)
+        os.close(self._master_fd)
+
+
+class SimulationBackend(object):
+    """
+    glue the SimulatedBoard and the PtyMotorDriver to the OnBoardSensors, the Screen and the ActionFrame
+
+    NOTE:
+        the ActionFrame opens its controller on import, install the backend before importing the module.actions,
+        or the backend will replace the controller afterward.
+        the hang time of the controller is a real sleep, which is not affected by the time scale.
+    """
+
+    def __init__(self, time_scale: float = 1., cmd_handler: Optional[Callable[[str], None]] = None):
+        """
+        :param time_scale: the time scale of the delays
+        :param cmd_handler: called with every cmd received by the motor driver
+        """
+        self.board: SimulatedBoard = SimulatedBoard()
+        self.driver: PtyMotorDriver = PtyMotorDriver(cmd_handler=cmd_handler)
+        self._time_scale: float = time_scale
+
+    def install(self) -> None:
+        """
+        bind the simulated board and the motor driver
+        """
+        set_time_scale(self._time_scale)
+        self.board.reset_time()
+        OnBoardSensors.bind_lib(self.board)
+        Screen.bind_lib(self.board)
+        actions = sys.modules.get(f'{__package__}.actions')
+        if actions is None:
+            # read by the ActionFrame on import
+            constant.DRIVER_SERIAL_PORT = self.driver.port
+        else:
+            actions.ActionFrame.bind_controller(CloseLoopController(motor_ids=constant.MOTOR_IDS,
+                                                                    motor_dirs=constant.MOTOR_DIRS,
+                                                                    port=self.driver.port))
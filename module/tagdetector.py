@@ -2,17 +2,21 @@
 apriltag detecting app
 """
 import warnings
-from copy import deepcopy
-from threading import Thread
-from time import sleep
-from typing import Tuple, List, Dict, Optional
+from threading import Thread, Event
+from time import sleep, perf_counter, perf_counter_ns
+from typing import Tuple, List, Dict, Optional, Callable, Sequence
 
 import cv2
+import numpy as np
 from apriltag import DetectorOptions, Detector, Detection
 from cv2 import Mat, cvtColor, COLOR_RGB2GRAY
 
 from .algrithm_tools import calc_p2p_dst, calc_p2p_error
-from ..constant import TAG_GROUP
+from .close_loop_controller import CloseLoopController, is_rotate_cmd, is_list_all_zero
+from .camra import LatestFrameGrabber, CameraMode, read_camera_mode, negotiate_camera_mode
+from .detection_pool import DetectionPool
+from .utils import PreprocessPipeline
+from ..constant import TAG_GROUP, DETECTION_FPS, DETECTOR_OPTIONS
 
 DEFAULT_TAG_TABLE = {2: (None, 0.0), 1: (None, 0.0), 0: (None, 0.0)}
 
@@ -24,6 +28,29 @@ TABLE_INIT_VALUE = (None, 0.)
 
 CAMERA_RESOLUTION_MULTIPLIER = 0.4
 
+# the roi is expanded by this ratio of the tag size on each side
+ROI_MARGIN = 0.5
+# the roi is decimated to no less than CAMERA_RESOLUTION_MULTIPLIER, as long as the tag keeps this side length
+MIN_TAG_SIDE = 24
+MAX_ROI_MISSES = 3
+FULL_SCAN_INTERVAL = 1.0
+
+# the camera is considered lost if the grabber delivers no frame within this time, in seconds
+GRAB_TIMEOUT = 2.0
+# the results of a camera older than this are left out of the merged tag table, in seconds
+MAX_RESULT_AGE = 0.5
+# the dispatcher sleeps this long when none of the cameras has a new frame, in seconds
+DISPATCH_IDLE_SLEEP = 0.002
+
+TrackBox = Tuple[int, int, int, int]
+
+ROTATING = 'rotating'
+STRAIGHT = 'straight'
+STOPPED = 'stopped'
+# the yaw rate above which the robot is considered rotating, in degree/s
+GYRO_ROTATE_THRESHOLD = 30.
+YAW_AXIS = 2
+
 BLUE_TEAM = 'blue'
 YELLOW_TEAM = 'yellow'
 
@@ -50,66 +77,203 @@ def get_center_tag(frame_center: Tuple[int, int], tags: List):
     return closest_tag
 
 
-class TagDetector:
+def select_tag(tags_table: Dict[int, Tuple], single_tag_mode: bool) -> Optional[Detection]:
     """
-    use cam to detect apriltags
+    choose the tag from the tag table
+    Args:
+        tags_table: tag id -> (the tag obj, the error to the camera center, ...)
+        single_tag_mode: take the first valid tag, otherwise the one nearest to its camera center
+
+    Returns: the chosen tag, None if there is no valid tag
     """
-    options = DetectorOptions(families=TAG_GROUP,
-                              border=1,
-                              nthreads=2,
-                              quad_decimate=1.0,
-                              quad_blur=0.0,
-                              refine_edges=False,
-                              refine_decode=False,
-                              refine_pose=False,
-                              debug=False,
-                              quad_contours=False)
-    __tag_detect = Detector(options).detect
+    if single_tag_mode:
+        for tag_data in tags_table.values():
+            if tag_data[0]:
+                return tag_data[0]
+        return None
 
-    def __init__(self, cam_id: int,
-                 team_color: str,
-                 start_detect_tag: bool = True,
-                 single_tag_mode: bool = True,
-                 minimal_resolution: bool = True):
+    closest_dist = float('inf')
+    closest_tag = None
+    for tag_data in tags_table.values():
+        # check the tag obj is valid and compare with the closest tag
+        if tag_data[0] and tag_data[1] < closest_dist:
+            closest_dist = tag_data[1]
+            closest_tag = tag_data[0]
+    return closest_tag
+
+
+def offset_detection(tag: Detection, offset_x: int, offset_y: int, scale: float) -> Detection:
+    """
+    map the detection in a scaled roi back to the frame coordinates
+    Args:
+        tag: the detection in the roi
+        offset_x: the x of the roi top-left corner in the frame
+        offset_y: the y of the roi top-left corner in the frame
+        scale: the size of the roi over the size of the detected image
+
+    Returns: the detection whose center and corners are in the frame coordinates,
+        the homography is left in the roi coordinates
+    """
+    offset = (offset_x, offset_y)
+    return tag._replace(center=tag.center * scale + offset, corners=tag.corners * scale + offset)
+
+
+def calc_track_box(tags: List[Detection], frame_shape: Tuple[int, ...], margin: float) -> Optional[TrackBox]:
+    """
+    the bounding box of the tags, expanded by the margin and clipped to the frame
+    Returns: (x0, y0, x1, y1), None if there are no tags, or the box is clipped to nothing
+    """
+    if not tags:
+        return None
+    corners = np.concatenate([tag.corners for tag in tags])
+    (x0, y0), (x1, y1) = corners.min(axis=0), corners.max(axis=0)
+    expand = max(x1 - x0, y1 - y0) * margin
+    height, width = frame_shape[:2]
+    box = (max(int(x0 - expand), 0), max(int(y0 - expand), 0),
+           min(int(x1 + expand) + 1, width), min(int(y1 + expand) + 1, height))
+    return box if box[0] < box[2] and box[1] < box[3] else None
+
+
+class DetectionScheduler(object):
+    """
+    sets the detection fps from the motion state of the robot,
+    detects fast while rotating to search the tags, and slowly while charging straight,
+    the cpu saved goes to the control loop
+    """
+
+    def __init__(self, motor_speeds_getter: Callable[[], Sequence[int]],
+                 gyro_getter: Optional[Callable[[], Sequence[float]]] = None,
+                 fps_table: Optional[Dict[str, float]] = None,
+                 gyro_rotate_threshold: float = GYRO_ROTATE_THRESHOLD):
         """
 
         Args:
+            motor_speeds_getter: returns the speeds of the 4 motors, such as the CloseLoopController.motor_speeds
+            gyro_getter: returns the gyro of 3 axes in degree/s, the robot pushed around is also considered rotating
+            fps_table: the motion state -> the fps, 0 for detecting as fast as possible, defaults to the DETECTION_FPS
+            gyro_rotate_threshold: the yaw rate above which the robot is considered rotating
+        """
+        self._motor_speeds_getter = motor_speeds_getter
+        self._gyro_getter = gyro_getter
+        self.fps_table: Dict[str, float] = dict(fps_table if fps_table else DETECTION_FPS)
+        self._gyro_rotate_threshold = gyro_rotate_threshold
 
-            team_color:
-            start_detect_tag:
-            single_tag_mode:if check only a single tag one time
+    @classmethod
+    def from_controller(cls, controller: CloseLoopController,
+                        gyro_getter: Optional[Callable[[], Sequence[float]]] = None) -> 'DetectionScheduler':
+        return cls(lambda: controller.motor_speeds, gyro_getter)
+
+    def motion_state(self) -> str:
+        if self._gyro_getter and abs(self._gyro_getter()[YAW_AXIS]) >= self._gyro_rotate_threshold:
+            return ROTATING
+        speeds = tuple(self._motor_speeds_getter())
+        if is_list_all_zero(speeds):
+            return STOPPED
+        return ROTATING if is_rotate_cmd(speeds) else STRAIGHT
+
+    def target_fps(self) -> float:
+        return self.fps_table[self.motion_state()]
+
+    def throttle(self, frame_start: float) -> None:
+        """
+        sleep for the rest of the frame time of the target fps
+        Args:
+            frame_start: the perf_counter when the frame is started
         """
+        fps = self.target_fps()
+        if fps > 0:
+            rest = 1 / fps - (perf_counter() - frame_start)
+            if rest > 0:
+                sleep(rest)
 
-        self._camera: cv2.VideoCapture = cv2.VideoCapture(cam_id)
-        if minimal_resolution:
-            self._camera.set(cv2.CAP_PROP_FRAME_WIDTH, 1)
-            self._camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 1)
-        self._frame_center: Tuple[float, float] = (self._camera.get(cv2.CAP_PROP_FRAME_WIDTH) / 2,
-                                                   self._camera.get(cv2.CAP_PROP_FRAME_HEIGHT) / 2)
-        self._tags_table: Dict[int, Tuple[Optional[Detection], int | float]] = {}
 
-        self._tag_id: int = DEFAULT_TAG_ID
-        self._tag_monitor_switch: bool = True
-        self._enemy_tag_id: int = NULL_TAG
-        self._ally_tag_id: int = NULL_TAG
-        self._neutral_tag_id: int = NULL_TAG
+class TemporalTagFilter(object):
+    """
+    keeps the per-tag confidence over a sliding window of frames, the tag id is only committed
+    when its evidence reaches the commit threshold, so a single false detection never flips it.
 
-        self.team_color = team_color
-        self._init_tags_table()
-        self._single_tag_mode: bool = single_tag_mode
-        self._apriltag_detect: Optional[Thread] = None
-        self._detect_should_continue: bool = True
+    the history is a fixed (window, tag count) array with a running sum, an update costs O(tags) of the frame
+    """
 
-        self.apriltag_detect_start() if start_detect_tag else None
+    def __init__(self, tag_ids: Sequence[int] = tuple(DEFAULT_TAG_TABLE),
+                 window: int = 10,
+                 commit_threshold: float = 3.,
+                 release_threshold: Optional[float] = None,
+                 full_margin: float = 50.):
+        """
 
-    def _init_tags_table(self):
+        Args:
+            tag_ids: the ids of the tags to track, the others are ignored
+            window: the count of the frames in the sliding window
+            commit_threshold: the evidence needed to commit a tag id, a frame contributes at most 1
+            release_threshold: the committed id falls back to the DEFAULT_TAG_ID when its evidence drops below it,
+                defaults to the half of the commit threshold
+            full_margin: the decision margin that earns the full confidence
         """
-        the tag table stores the tag obj and the distance to the camera center
-        :return:
+        self._tag_ids: np.ndarray = np.array(tag_ids, dtype=np.int32)
+        self._columns: Dict[int, int] = {tag_id: column for column, tag_id in enumerate(tag_ids)}
+        self._history: np.ndarray = np.zeros((window, len(tag_ids)), dtype=np.float32)
+        self._evidence: np.ndarray = np.zeros(len(tag_ids), dtype=np.float32)
+        self._cursor: int = 0
+        self._commit_threshold: float = commit_threshold
+        self._release_threshold: float = commit_threshold / 2 if release_threshold is None else release_threshold
+        self._full_margin: float = full_margin
+        self._committed_column: Optional[int] = None
+
+    def confidence_of(self, tag: Detection) -> float:
         """
-        self._tags_table[self._enemy_tag_id] = TABLE_INIT_VALUE
-        self._tags_table[self._ally_tag_id] = TABLE_INIT_VALUE
-        self._tags_table[self._neutral_tag_id] = TABLE_INIT_VALUE
+        the confidence of a single detection in [0, 1], grows with the decision margin and drops with the hamming
+        """
+        return min(tag.decision_margin / self._full_margin, 1.) / (1 + tag.hamming)
+
+    def update(self, tags: Sequence[Detection]) -> int:
+        """
+        push the detections of a frame into the window
+        Returns:
+            the committed tag id
+        """
+        row = self._history[self._cursor]
+        evidence = self._evidence
+        # drop the oldest frame from the running sum
+        evidence -= row
+        row.fill(0.)
+        for tag in tags:
+            column = self._columns.get(tag.tag_id)
+            if column is not None:
+                row[column] = max(row[column], self.confidence_of(tag))
+        evidence += row
+        self._cursor = (self._cursor + 1) % len(self._history)
+
+        best = int(evidence.argmax())
+        if evidence[best] >= self._commit_threshold:
+            self._committed_column = best
+        elif self._committed_column is not None and evidence[self._committed_column] < self._release_threshold:
+            self._committed_column = None
+        return self.tag_id
+
+    @property
+    def tag_id(self) -> int:
+        return DEFAULT_TAG_ID if self._committed_column is None else int(self._tag_ids[self._committed_column])
+
+    def evidence(self, tag_id: int) -> float:
+        """
+        the sum of the confidences of the tag over the window
+        """
+        return float(self._evidence[self._columns[tag_id]])
+
+    def reset(self) -> None:
+        self._history.fill(0.)
+        self._evidence.fill(0.)
+        self._committed_column = None
+
+
+class TeamTags(object):
+    """
+    the ally/enemy/neutral tag ids of the team color
+    """
+    _enemy_tag_id: int = NULL_TAG
+    _ally_tag_id: int = NULL_TAG
+    _neutral_tag_id: int = NULL_TAG
 
     @property
     def team_color(self) -> str:
@@ -140,6 +304,134 @@ class TagDetector:
             self._enemy_tag_id = 1
             self._ally_tag_id = 2
 
+    @property
+    def ally_tag_id(self) -> int:
+        """
+
+        Returns: the tag id of ally
+
+        """
+        return self._ally_tag_id
+
+    @property
+    def enemy_tag_id(self) -> int:
+        """
+
+        Returns: the tag id of the enemy
+
+        """
+        return self._enemy_tag_id
+
+    @property
+    def neutral_tag_id(self) -> int:
+        """
+
+        Returns: the tag id of the neutral
+
+        """
+        return self._neutral_tag_id
+
+
+class TagDetector(TeamTags):
+    """
+    use cam to detect apriltags
+    """
+    # the tunable options are loaded from the config, see the benchmark.tune_detector_options
+    options = DetectorOptions(families=TAG_GROUP,
+                              border=1,
+                              debug=False,
+                              quad_contours=False,
+                              **DETECTOR_OPTIONS)
+
+    def __init__(self, cam_id: int | str | cv2.VideoCapture,
+                 team_color: str,
+                 start_detect_tag: bool = True,
+                 single_tag_mode: bool = True,
+                 minimal_resolution: bool = True,
+                 tracking_mode: bool = False,
+                 max_roi_misses: int = MAX_ROI_MISSES,
+                 full_scan_interval: float = FULL_SCAN_INTERVAL,
+                 threaded_capture: bool = True,
+                 detection_processes: int = 0,
+                 scheduler: Optional[DetectionScheduler] = None,
+                 tag_filter: Optional[TemporalTagFilter] = None,
+                 options: Optional[DetectorOptions] = None,
+                 preprocess: Optional[PreprocessPipeline] = None):
+        """
+
+        Args:
+            cam_id: the device id, the path of a video file, or an opened capture
+            team_color:
+            start_detect_tag:
+            single_tag_mode:if check only a single tag one time
+            tracking_mode: once the tags are found, search only the roi around them in the following frames
+            max_roi_misses: fall back to the full-frame scan after this count of empty roi scans
+            full_scan_interval: the max interval between two full-frame scans in tracking mode, in seconds
+            threaded_capture: capture in a LatestFrameGrabber thread, so the detection always works on the newest frame
+            detection_processes: if positive, detect in a DetectionPool of this many processes,
+                the tracking mode is not available in this mode
+            scheduler: if given, adapts the detection fps to the motion state of the robot
+            tag_filter: if given, the tag id only changes after enough evidence over the recent frames
+            options: overrides the class-level options
+            preprocess: applied to the gray frame before the detection, only the stages keeping the pixels
+                at their coordinates are accepted, the tags, the roi and the errors stay in the camera coordinates
+        """
+
+        self.options: DetectorOptions = options if options else self.options
+        # each instance owns a detector, the instances on different cameras never contend for one
+        self._tag_detect = Detector(self.options).detect
+        self._camera: cv2.VideoCapture = cv2.VideoCapture(cam_id) if isinstance(cam_id, (int, str)) else cam_id
+        # replaced as a whole on the reconfiguration, the frame center and the errors always come from one mode
+        self._mode: CameraMode = negotiate_camera_mode(self._camera, 1, 1) if minimal_resolution \
+            else read_camera_mode(self._camera)
+        # (width, height, fps) requested by the reconfigure, applied by the detection thread between two frames
+        self._mode_request: Optional[Tuple[Optional[int], Optional[int], Optional[float]]] = None
+        self._mode_applied: Event = Event()
+        # a new table is published by every frame, the table held by a reader is never modified
+        self._tags_table: Dict[int, Tuple[Optional[Detection], int | float]] = dict(DEFAULT_TAG_TABLE)
+        # reused by every frame, reallocated only when the resolution changes
+        self._frame_buffer: Optional[np.ndarray] = None
+        self._gray_buffer: Optional[np.ndarray] = None
+        self._grabber: Optional[LatestFrameGrabber] = LatestFrameGrabber(self._camera) if threaded_capture else None
+        self._frame_timestamp_ns: int = 0
+        self._result_timestamp_ns: int = 0
+        self._detection_processes: int = detection_processes
+        self._detection_pool: Optional[DetectionPool] = None
+        self.scheduler: Optional[DetectionScheduler] = scheduler
+        self.tag_filter: Optional[TemporalTagFilter] = tag_filter
+        self._preprocess: Optional[PreprocessPipeline] = None
+        self.preprocess = preprocess
+
+        self._tracking_mode: bool = tracking_mode
+        self._max_roi_misses: int = max_roi_misses
+        self._full_scan_interval: float = full_scan_interval
+        self._track_box: Optional[TrackBox] = None
+        self._roi_misses: int = 0
+        self._last_full_scan: float = 0.
+
+        self._tag_id: int = DEFAULT_TAG_ID
+        self._tag_monitor_switch: bool = True
+        self._enemy_tag_id: int = NULL_TAG
+        self._ally_tag_id: int = NULL_TAG
+        self._neutral_tag_id: int = NULL_TAG
+
+        self.team_color = team_color
+        self._init_tags_table()
+        self._single_tag_mode: bool = single_tag_mode
+        self._apriltag_detect: Optional[Thread] = None
+        self._detect_should_continue: bool = True
+
+        self.apriltag_detect_start() if start_detect_tag else None
+
+    def _init_tags_table(self):
+        """
+        the tag table stores the tag obj and the distance to the camera center
+        :return:
+        """
+        self._tags_table[self._enemy_tag_id] = TABLE_INIT_VALUE
+        self._tags_table[self._ally_tag_id] = TABLE_INIT_VALUE
+        self._tags_table[self._neutral_tag_id] = TABLE_INIT_VALUE
+
     @property
     def detect_should_continue(self) -> bool:
         """
@@ -173,73 +465,270 @@ class TagDetector:
         这是一个线程函数，它从摄像头捕获视频帧，处理帧以检测 AprilTags，
         :return:
         """
-        frame_updater = self._camera.read
+        frame_updater = self._read_gray_frame
 
         warnings.warn('Detection Activated')
+        grabber = self._grabber
         while self._detect_should_continue:
+            if self._mode_request:
+                self._apply_mode_request()
             if self._tag_monitor_switch:  # 台上开启 台下关闭 节约性能
-                success, frame = frame_updater()  # extract frame from the cam
-                if success:
-                    self._update_tags(frame)  # extract tags in the detection
+                frame_start = perf_counter()
+                grabber.start() if grabber else None
+                success, gray = frame_updater()  # extract frame from the cam
+                if success and self._detection_processes:
+                    self._submit_to_pool(gray)
+                elif success:
+                    self._update_tags(gray)  # extract tags in the detection
                     # extract the correct tag in the detection,
                     # for example, the tag in the center of the frame
                     self._update_tag_id()
+                    self._result_timestamp_ns = self._frame_timestamp_ns
                 else:
                     break
+                self.scheduler.throttle(frame_start) if self.scheduler else None
             else:
+                grabber.stop() if grabber else None
                 sleep(0.4)
+        grabber.stop() if grabber else None
+        if self._detection_pool:
+            self._detection_pool.close()
+            self._detection_pool = None
         warnings.warn('\n##########CAMERA CLOSED###########\n'
                       '###ENTERING NO CAMERA MODE###')
         self._tag_id = DEFAULT_TAG_ID
 
-    def _update_tags(self, frame: Mat):
+    def reconfigure(self, width: Optional[int] = None, height: Optional[int] = None,
+                    fps: Optional[float] = None, timeout: float = GRAB_TIMEOUT) -> CameraMode:
+        """
+        renegotiate the resolution and the fps of the camera at runtime,
+        such as a low resolution for searching the tags and a high one for the precise alignment
+        Args:
+            width: None to keep the current one
+            height: None to keep the current one
+            fps: None to keep the current one
+            timeout: how long to wait for the detection thread to apply it, in seconds
+
+        Returns:
+            the negotiated mode, the old one if the detection thread didn't apply it in time
+        """
+        self._mode_applied.clear()
+        self._mode_request = (width, height, fps)
+        if self._apriltag_detect and self._apriltag_detect.is_alive():
+            # the camera can't be set while the grabber or the detection thread is reading it
+            self._mode_applied.wait(timeout)
+        else:
+            self._apply_mode_request()
+        return self._mode
+
+    def _apply_mode_request(self) -> None:
+        width, height, fps = self._mode_request
+        grabber = self._grabber
+        grabbing = grabber is not None and grabber.is_running
+        grabber.stop() if grabbing else None
+        self._mode = negotiate_camera_mode(self._camera, width, height, fps)
+        # the roi is in the coordinates of the old resolution
+        self._track_box = None
+        if self._detection_pool:
+            # the shared memory is sized for the old resolution, the pool is recreated on the next frame
+            self._detection_pool.close()
+            self._detection_pool = None
+        grabber.start() if grabbing else None
+        self._mode_request = None
+        self._mode_applied.set()
+
+    def _submit_to_pool(self, gray: Mat) -> None:
+        """
+        hand the frame to the detection pool, the results are applied by the _handle_pool_result
+        """
+        if self._detection_pool and gray.size > self._detection_pool.frame_size:
+            # the resolution grew without the reconfigure
+            self._detection_pool.close()
+            self._detection_pool = None
+        if self._detection_pool is None:
+            self._detection_pool = DetectionPool(self.options, gray.shape, self._detection_processes,
+                                                 self._handle_pool_result)
+        if self._detection_pool.wait_idle(GRAB_TIMEOUT):
+            self._detection_pool.submit(gray, self._frame_timestamp_ns)
+
+    def _handle_pool_result(self, tags: List[Detection], timestamp_ns: int, source: int) -> None:
+        """
+        called in the collector thread of the detection pool
+        """
+        self._apply_tags(tags)
+        self._update_tag_id()
+        self._result_timestamp_ns = timestamp_ns
+
+    def _read_gray_frame(self) -> Tuple[bool, Optional[Mat]]:
+        """
+        read a frame into the frame buffer, or take the newest one from the grabber,
+        and convert it into the gray buffer, no allocation in the steady state
+        :return: the read status and the gray frame
+        """
+        if self._grabber:
+            grabbed = self._grabber.wait_latest(GRAB_TIMEOUT)
+            if grabbed is None:
+                return False, None
+            _, self._frame_timestamp_ns, frame = grabbed
+        else:
+            success, frame = self._camera.read(image=self._frame_buffer)
+            self._frame_timestamp_ns = perf_counter_ns()
+            if not success:
+                return False, None
+            self._frame_buffer = frame
+        if self._gray_buffer is None or self._gray_buffer.shape != frame.shape[:2]:
+            # the first frame, or the resolution changed
+            self._gray_buffer = np.empty(frame.shape[:2], dtype=frame.dtype)
+            if self._mode.shape != frame.shape[:2]:
+                # the driver may report a size other than the one it delivers, the frame is the truth
+                self._mode = self._mode._replace(width=frame.shape[1], height=frame.shape[0])
+        gray = cvtColor(frame, COLOR_RGB2GRAY, dst=self._gray_buffer)
+        return True, self._preprocess(gray) if self._preprocess else gray
+
+    def _update_tags(self, gray: Mat):
         """
-        update tags from the newly sampled frame
+        update tags from the newly sampled gray frame
         :return:
         """
-        # 将帧转换为灰度并存储在 gray 变量中。
-        # 使用 AprilTag 检测器对象（self.tag_detector）在灰度帧中检测 AprilTags。检测到的标记存储在 self._tags 变量中。
-        # override old tags
-        temp_dict = deepcopy(DEFAULT_TAG_TABLE)
-        for tag in self.__tag_detect(cvtColor(frame, COLOR_RGB2GRAY)):
-            temp_dict[tag.tag_id] = (tag, calc_p2p_error(tag.center, self._frame_center))
-        self._tags_table = temp_dict
+        # 使用 AprilTag 检测器对象（self.tag_detector）在灰度帧中检测 AprilTags。
+        self._apply_tags(self._detect(gray))
 
-    def _update_tag_id(self):
+    def _apply_tags(self, tags: List[Detection]):
         """
-        update the tag id from the self._tags_table
+        fill the tags into the tag table
         :return:
         """
+        # the tag ids seen so far are kept, the table is filled before being published
+        tags_table = dict.fromkeys(self._tags_table, TABLE_INIT_VALUE)
+        frame_center = self._mode.center
+        for tag in tags:
+            tags_table[tag.tag_id] = (tag, calc_p2p_error(tag.center, frame_center))
+        self._tags_table = tags_table
 
-        def _single_mode():
+    def _detect(self, gray: Mat) -> List[Detection]:
+        """
+        detect the tags in the roi of the tracked tags, or in the full frame
+        :return: the detections in the frame coordinates
+        """
+        now = perf_counter()
+        box = self._track_box
+        if not self._tracking_mode or box is None or now - self._last_full_scan >= self._full_scan_interval:
+            self._last_full_scan = now
+            tags = self._tag_detect(gray)
+            self._roi_misses = 0
+            self._track_box = calc_track_box(tags, gray.shape, ROI_MARGIN) if self._tracking_mode else None
+            return tags
 
-            self._tag_id = DEFAULT_TAG_ID
-            for tag_data in self._tags_table.values():
-                if tag_data[0]:
-                    self._tag_id = tag_data[0].tag_id
-                    break
+        x0, y0, x1, y1 = box
+        roi = gray[y0:y1, x0:x1]
+        if not roi.size:
+            # the box is out of the frame, such as after the resolution shrank
+            self._track_box = None
+            return self._detect(gray)
+        # the tags take about 1 / (1 + 2 * ROI_MARGIN) of the roi
+        scale = min(max(CAMERA_RESOLUTION_MULTIPLIER, MIN_TAG_SIDE * (1 + 2 * ROI_MARGIN) / min(roi.shape)), 1.)
+        if scale < 1.:
+            roi = cv2.resize(roi, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        tags = [offset_detection(tag, x0, y0, 1 / scale) for tag in self._tag_detect(roi)]
+        if tags:
+            self._roi_misses = 0
+            self._track_box = calc_track_box(tags, gray.shape, ROI_MARGIN)
+        else:
+            self._roi_misses += 1
+            if self._roi_misses >= self._max_roi_misses:
+                self._track_box = None
+        return tags
+
+    @property
+    def preprocess(self) -> Optional[PreprocessPipeline]:
+        return self._preprocess
+
+    @preprocess.setter
+    def preprocess(self, pipeline: Optional[PreprocessPipeline]):
+        """
+        the resize and the rotate would move the tags out of the camera coordinates, which the frame center,
+        the roi tracking and the shared memory of the detection pool are all in, so they are rejected
+        """
+        if pipeline is not None and pipeline.changes_geometry:
+            raise ValueError('the preprocess of the TagDetector must not resize or rotate the frame, '
+                             f'got stages {[stage.name for stage in pipeline.stages]}')
+        self._preprocess = pipeline
+
+    @property
+    def tracking_mode(self) -> bool:
+        return self._tracking_mode
+
+    @tracking_mode.setter
+    def tracking_mode(self, enable: bool):
+        self._tracking_mode = enable
+        self._track_box = None
+
+    @property
+    def track_box(self) -> Optional[TrackBox]:
+        """
+
+        Returns: the roi searched by the next frame, (x0, y0, x1, y1), None for the full-frame scan
 
-        def _nearest_mode():
-            closest_dist = float('inf')
-            closest_tag = None
-            for tag_data in self._tags_table.values():
-                # check the tag obj is valid and compare with the closest tag
-                if tag_data[0] and tag_data[1] < closest_dist:
-                    closest_dist = tag_data[1]
-                    closest_tag = tag_data[0]
-            self._tag_id = closest_tag.tag_id if closest_tag else DEFAULT_TAG_ID
+        """
+        return self._track_box
 
-        _single_mode() if self._single_tag_mode else _nearest_mode()
+    def _update_tag_id(self):
+        """
+        update the tag id from the self._tags_table
+        :return:
+        """
+        tag = select_tag(self._tags_table, self._single_tag_mode)
+        if self.tag_filter:
+            # the tag chosen by this frame is only an evidence, the filter decides when the tag id changes
+            self._tag_id = self.tag_filter.update((tag,) if tag else ())
+        else:
+            self._tag_id = tag.tag_id if tag else DEFAULT_TAG_ID
 
     @property
     def tag_table(self):
         """
 
-        Returns: the tag table that contains all the results
+        Returns: the tag table that contains all the results of the latest frame,
+            it is replaced, never modified, by the following frames
 
         """
         return self._tags_table
 
+    @property
+    def result_timestamp_ns(self) -> int:
+        """
+
+        Returns: the capture time of the frame the current tag table comes from, in perf_counter_ns
+
+        """
+        return self._result_timestamp_ns
+
+    @property
+    def frame_age_ms(self) -> float:
+        """
+
+        Returns: how old the frame the current tag table comes from is
+
+        """
+        return (perf_counter_ns() - self._result_timestamp_ns) / 1000000
+
+    @property
+    def frame_grabber(self) -> Optional[LatestFrameGrabber]:
+        return self._grabber
+
+    @property
+    def mode(self) -> CameraMode:
+        """
+
+        Returns: the mode negotiated with the camera
+
+        """
+        return self._mode
+
+    @property
+    def frame_center(self) -> Tuple[float, float]:
+        return self._mode.center
+
     @property
     def tag_id(self):
         """
@@ -267,29 +756,272 @@ class TagDetector:
             self._tag_monitor_switch = switch
             self._tag_id = DEFAULT_TAG_ID
 
+
+class CameraSource(object):
+    """
+    a camera of the MultiCameraTagDetector, with its own grabber, gray buffer and the latest tag table
+    """
+    __slots__ = ('name', 'camera', 'grabber', 'mode', 'min_interval', 'last_submit', 'gray_buffer',
+                 'tags_table', 'result_timestamp_ns')
+
+    def __init__(self, name: str, camera: cv2.VideoCapture, max_fps: float = 0.):
+        self.name: str = name
+        self.camera: cv2.VideoCapture = camera
+        self.grabber: LatestFrameGrabber = LatestFrameGrabber(camera)
+        self.mode: CameraMode = read_camera_mode(camera)
+        self.min_interval: float = 1 / max_fps if max_fps > 0 else 0.
+        self.last_submit: float = 0.
+        self.gray_buffer: Optional[np.ndarray] = None
+        self.tags_table: Dict[int, Tuple[Detection, int | float]] = {}
+        self.result_timestamp_ns: int = 0
+
     @property
-    def ally_tag_id(self) -> int:
+    def frame_center(self) -> Tuple[float, float]:
+        return self.mode.center
+
+    def to_gray(self, frame: np.ndarray) -> Mat:
+        if self.gray_buffer is None or self.gray_buffer.shape != frame.shape[:2]:
+            self.gray_buffer = np.empty(frame.shape[:2], dtype=frame.dtype)
+            if self.mode.shape != frame.shape[:2]:
+                self.mode = self.mode._replace(width=frame.shape[1], height=frame.shape[0])
+        return cvtColor(frame, COLOR_RGB2GRAY, dst=self.gray_buffer)
+
+
+class MultiCameraTagDetector(TeamTags):
+    """
+    detect the tags on several cameras, such as the front and the rear ones, with a shared DetectionPool.
+
+    every camera is captured by its own LatestFrameGrabber, a dispatcher thread takes their newest frames
+    in turn and hands them to the idle workers, the results are merged into one tag table with the camera
+    each tag is seen by. with at least as many workers as cameras, a camera never waits for the detection
+    of the others, the max fps of the secondary cameras keeps the workers for the primary one otherwise
+    """
+
+    def __init__(self, cameras: Dict[str, int | str | cv2.VideoCapture],
+                 team_color: str,
+                 detection_processes: int = 0,
+                 max_fps: Optional[Dict[str, float]] = None,
+                 start_detect_tag: bool = True,
+                 single_tag_mode: bool = True,
+                 minimal_resolution: bool = True,
+                 tag_filter: Optional[TemporalTagFilter] = None,
+                 options: Optional[DetectorOptions] = None):
         """
 
-        Returns: the tag id of ally
+        Args:
+            cameras: the camera name -> the device id, the path of a video file, or an opened capture,
+                the cameras are served in this order
+            team_color:
+            detection_processes: the count of the detection processes, defaults to one per camera
+            max_fps: the camera name -> the max detection fps of it, the cameras not in it run as fast as possible
+            start_detect_tag:
+            single_tag_mode: if check only a single tag one time, otherwise the tag nearest to its camera center
+            minimal_resolution:
+            tag_filter: if given, the tag id only changes after enough evidence over the recent frames
+            options: the options of the detectors, defaults to the TagDetector.options
+        """
+        max_fps = max_fps if max_fps else {}
+        self._sources: List[CameraSource] = []
+        for name, cam_id in cameras.items():
+            camera = cv2.VideoCapture(cam_id) if isinstance(cam_id, (int, str)) else cam_id
+            negotiate_camera_mode(camera, 1, 1) if minimal_resolution else None
+            self._sources.append(CameraSource(name, camera, max_fps.get(name, 0.)))
+        self.options: DetectorOptions = options if options else TagDetector.options
+        self._detection_processes: int = detection_processes if detection_processes > 0 else len(self._sources)
+        self._detection_pool: Optional[DetectionPool] = None
+        self.tag_filter: Optional[TemporalTagFilter] = tag_filter
+        self._single_tag_mode: bool = single_tag_mode
+
+        self.team_color = team_color
+        # tag id -> (the tag obj, the distance to the center of its camera, the name of the camera),
+        # replaced as a whole on every result, so the readers never see a half-merged table
+        self._tags_table: Dict[int, Tuple[Optional[Detection], int | float, Optional[str]]] = \
+            self._init_tags_table()
+        self._tag_id: int = DEFAULT_TAG_ID
+        self._tag_origin: Optional[str] = None
+        self._result_timestamp_ns: int = 0
+
+        self._tag_monitor_switch: bool = True
+        self._detect_should_continue: bool = True
+        self._dispatcher: Optional[Thread] = None
+        self.apriltag_detect_start() if start_detect_tag else None
 
+    def _init_tags_table(self) -> Dict[int, Tuple[Optional[Detection], int | float, Optional[str]]]:
+        table = {tag_id: TABLE_INIT_VALUE + (None,) for tag_id in DEFAULT_TAG_TABLE}
+        for tag_id in (self._enemy_tag_id, self._ally_tag_id, self._neutral_tag_id):
+            table[tag_id] = TABLE_INIT_VALUE + (None,)
+        return table
+
+    def apriltag_detect_start(self):
         """
-        return self._ally_tag_id
+        start the dispatcher thread and set it to daemon
+        :return:
+        """
+        warnings.warn('Multi-camera AprilTag detect Activating')
+        self._detect_should_continue = True
+        dispatcher = Thread(target=self._dispatching_loop, name='apriltag_dispatch_thread')
+        dispatcher.daemon = True
+        dispatcher.start()
+        self._dispatcher = dispatcher
+
+    def _ensure_pool(self, gray: Optional[Mat] = None) -> DetectionPool:
+        """
+        create the pool on the first call, and recreate it when the gray frame outgrows its shared memory
+        """
+        if self._detection_pool and gray is not None and gray.size > self._detection_pool.frame_size:
+            # the camera delivers larger frames than the mode it reported
+            self._detection_pool.close()
+            self._detection_pool = None
+        if self._detection_pool is None:
+            # the shared memory of the workers holds the largest frame of all the cameras,
+            # the modes are updated to the frames actually delivered by the to_gray
+            shapes = [source.mode.shape for source in self._sources]
+            frame_shape = (max(shape[0] for shape in shapes), max(shape[1] for shape in shapes))
+            self._detection_pool = DetectionPool(self.options, frame_shape, self._detection_processes,
+                                                 self._handle_pool_result)
+        return self._detection_pool
+
+    def _dispatching_loop(self):
+        sources = self._sources
+        try:
+            self._ensure_pool()
+            while self._detect_should_continue:
+                if not self._tag_monitor_switch:
+                    for source in sources:
+                        source.grabber.stop()
+                    sleep(0.4)
+                    continue
+                dispatched = False
+                for index, source in enumerate(sources):
+                    source.grabber.start()
+                    now = perf_counter()
+                    if now - source.last_submit < source.min_interval:
+                        continue
+                    # never wait on a camera, the others may have frames ready
+                    grabbed = source.grabber.wait_latest(0)
+                    if grabbed is None:
+                        continue
+                    _, timestamp_ns, frame = grabbed
+                    gray = source.to_gray(frame)
+                    pool = self._ensure_pool(gray)
+                    if not pool.wait_idle(GRAB_TIMEOUT):
+                        self._detect_should_continue = False
+                        break
+                    pool.submit(gray, timestamp_ns, index)
+                    source.last_submit = now
+                    dispatched = True
+                if not dispatched:
+                    if not any(source.grabber.is_running for source in sources):
+                        break
+                    sleep(DISPATCH_IDLE_SLEEP)
+        finally:
+            # the grabbers and the workers never outlive the dispatcher, even if it dies of an error
+            for source in sources:
+                source.grabber.stop()
+            if self._detection_pool:
+                self._detection_pool.close()
+                self._detection_pool = None
+        warnings.warn('\n##########CAMERAS CLOSED###########\n'
+                      '###ENTERING NO CAMERA MODE###')
+        self._tag_id = DEFAULT_TAG_ID
+        self._tag_origin = None
+
+    def _handle_pool_result(self, tags: List[Detection], timestamp_ns: int, source_index: int) -> None:
+        """
+        called in the collector thread of the detection pool, replaces the table of the camera and merges them
+        """
+        source = self._sources[source_index]
+        source.tags_table = {tag.tag_id: (tag, calc_p2p_error(tag.center, source.frame_center)) for tag in tags}
+        source.result_timestamp_ns = timestamp_ns
+        self._merge_tags_tables()
+
+    def _merge_tags_tables(self) -> None:
+        """
+        merge the latest tables of the cameras, a tag seen by several cameras is taken from
+        the one it is nearest to the center of
+        """
+        oldest_ns = perf_counter_ns() - int(MAX_RESULT_AGE * 1e9)
+        tags_table = self._init_tags_table()
+        result_timestamp_ns = 0
+        for source in self._sources:
+            if source.result_timestamp_ns < oldest_ns:
+                continue
+            result_timestamp_ns = max(result_timestamp_ns, source.result_timestamp_ns)
+            for tag_id, (tag, error) in source.tags_table.items():
+                merged = tags_table.get(tag_id)
+                if merged is None or merged[0] is None or error < merged[1]:
+                    tags_table[tag_id] = (tag, error, source.name)
+        self._tags_table = tags_table
+        self._result_timestamp_ns = result_timestamp_ns
+
+        tag = select_tag(tags_table, self._single_tag_mode)
+        if self.tag_filter:
+            self._tag_id = self.tag_filter.update((tag,) if tag else ())
+        else:
+            self._tag_id = tag.tag_id if tag else DEFAULT_TAG_ID
+        self._tag_origin = tags_table[self._tag_id][2] if self._tag_id in tags_table else None
+
+    def close(self) -> None:
+        """
+        stop the dispatcher, the grabbers and the detection pool
+        """
+        self._detect_should_continue = False
+        if self._dispatcher:
+            self._dispatcher.join()
+            self._dispatcher = None
 
     @property
-    def enemy_tag_id(self) -> int:
+    def camera_names(self) -> List[str]:
+        return [source.name for source in self._sources]
+
+    def camera_tag_table(self, name: str) -> Dict[int, Tuple[Detection, int | float]]:
         """
 
-        Returns: the tag id of the enemy
+        Returns: the tags seen by the camera in its latest result
 
         """
-        return self._enemy_tag_id
+        for source in self._sources:
+            if source.name == name:
+                return source.tags_table
+        raise KeyError(f'no camera named {name}, the cameras are {self.camera_names}')
 
     @property
-    def neutral_tag_id(self) -> int:
+    def tag_table(self) -> Dict[int, Tuple[Optional[Detection], int | float, Optional[str]]]:
         """
 
-        Returns: the tag id of the neutral
+        Returns: the merged tag table, tag id -> (the tag obj, the distance to the center of its camera, the camera name)
 
         """
-        return self._neutral_tag_id
+        return self._tags_table
+
+    @property
+    def tag_id(self) -> int:
+        return self._tag_id
+
+    @property
+    def tag_origin(self) -> Optional[str]:
+        """
+
+        Returns: the name of the camera that sees the current tag id, None if it is not seen by any camera
+
+        """
+        return self._tag_origin
+
+    @property
+    def result_timestamp_ns(self) -> int:
+        return self._result_timestamp_ns
+
+    @property
+    def frames_submitted(self) -> int:
+        return self._detection_pool.frames_submitted if self._detection_pool else 0
+
+    @property
+    def tag_detection_switch(self) -> bool:
+        return self._tag_monitor_switch
+
+    @tag_detection_switch.setter
+    def tag_detection_switch(self, switch: bool):
+        if switch != self._tag_monitor_switch:
+            self._tag_monitor_switch = switch
+            self._tag_id = DEFAULT_TAG_ID
+            self._tag_origin = None
@@ -1,6 +1,28 @@
 from time import perf_counter_ns
 from typing import Callable, Optional
 
+# a scale greater than 1 makes the delays run faster than the real time, used by the simulation
+_TIME_SCALE: float = 1.
+
+
+def set_time_scale(scale: float) -> None:
+    """
+    set the scale applied to delay_ms and delay_us
+    Args:
+        scale: 2. means a 100 ms delay only takes 50 ms in the real time
+
+    Returns:
+
+    """
+    global _TIME_SCALE
+    if scale <= 0:
+        raise ValueError('time scale should be positive')
+    _TIME_SCALE = scale
+
+
+def get_time_scale() -> float:
+    return _TIME_SCALE
+
 
 def delay_ms(milliseconds: int,
              breaker_func: Optional[Callable[[], bool]] = None) -> bool:
@@ -13,14 +35,14 @@ def delay_ms(milliseconds: int,
     """
 
     def delay(millisecond: int) -> bool:
-        end = perf_counter_ns() + millisecond * 1000000
+        end = perf_counter_ns() + millisecond * 1000000 / _TIME_SCALE
         while perf_counter_ns() < end:
             continue
         return False
 
     def delay_with_breaker(millisecond: int,
                            breaker: Callable[[], bool]) -> bool:
-        end = perf_counter_ns() + millisecond * 1000000
+        end = perf_counter_ns() + millisecond * 1000000 / _TIME_SCALE
         while perf_counter_ns() < end:
             if breaker():
                 return True
@@ -35,7 +57,7 @@ def delay_ms(milliseconds: int,
 
 
 def delay_us(microseconds: int):
-    end = perf_counter_ns() + microseconds * 1000
+    end = perf_counter_ns() + microseconds * 1000 / _TIME_SCALE
     while perf_counter_ns() < end:
         pass
 
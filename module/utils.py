@@ -1,6 +1,9 @@
+from abc import ABCMeta, abstractmethod
+from time import perf_counter_ns
+from typing import Optional, Tuple, List, Dict
+
 import cv2
 import numpy as np
-from numpy import xrange
 
 
 def rotate90(src: np.ndarray) -> np.ndarray:
@@ -36,19 +39,16 @@ def resize(src: np.ndarray, scale_percent: float) -> np.ndarray:
     return cv2.resize(src, dsize=None, fx=scale_percent, fy=scale_percent, interpolation=cv2.INTER_AREA)
 
 
-def calcGrayHist(src: np.ndarray) -> np.ndarray:
+def calcGrayHist(src: np.ndarray, stride: int = 1) -> np.ndarray:
     """
     计算灰度图像直方图。
 
     :param src: 原始图像数据，类型为np.ndarray。
+    :param stride: 采样步长，每隔stride行/列取一个像素，大于1时只统计1/stride^2的像素。
     :return: 灰度图像直方图，类型为np.ndarray。
     """
-    rows, cols = src.shape
-    grayHist = np.zeros([256], np.uint64)
-    for r in xrange(rows):
-        for c in xrange(cols):
-            grayHist[src[r][c]] += 1
-    return grayHist
+    sample = src[::stride, ::stride] if stride > 1 else src
+    return np.bincount(sample.ravel(), minlength=256).astype(np.uint64)
 
 
 def linear_trans(src: np.ndarray, alpha: float) -> np.ndarray:
@@ -161,3 +161,373 @@ def morphologyEx(src: np.ndarray, r: int, i: int, type: int) -> np.ndarray:
         s = cv2.getStructuringElement(cv2.MORPH_RECT, (2 * r + 1, 2 * r + 1))
         d = cv2.morphologyEx(src, cv2.MORPH_CLOSE, s, iterations=i)
     return d
+
+
+class PreprocessStage(metaclass=ABCMeta):
+    """
+    a stage of the PreprocessPipeline, the state such as the luts and the kernels is built once in the __init__,
+    the output is written into a buffer owned by the stage, reallocated only when the input shape changes.
+    NOTE: the output is valid until the next call of the stage
+    """
+    name: str = 'stage'
+    # if the output pixels are at other coordinates than the input ones, such as the resize and the rotate
+    changes_geometry: bool = False
+
+    def __init__(self):
+        self._buffer: Optional[np.ndarray] = None
+
+    def _output_buffer(self, shape: Tuple[int, ...], dtype=np.uint8) -> np.ndarray:
+        if self._buffer is None or self._buffer.shape != shape or self._buffer.dtype != dtype:
+            self._buffer = np.empty(shape, dtype=dtype)
+        return self._buffer
+
+    @abstractmethod
+    def __call__(self, src: np.ndarray) -> np.ndarray:
+        """
+        Returns:
+            the processed frame, in the buffer of the stage or the src itself
+        """
+
+
+class GammaStage(PreprocessStage):
+    """
+    the gamma correction through a precomputed lut, keeps the uint8 range unlike the gamma_correct
+    """
+    name = 'gamma'
+
+    def __init__(self, gamma: float = 0.5):
+        super().__init__()
+        self.lut: np.ndarray = np.round(np.power(np.arange(256) / 255.0, gamma) * 255).astype(np.uint8)
+
+    def __call__(self, src: np.ndarray) -> np.ndarray:
+        return cv2.LUT(src, self.lut, dst=self._output_buffer(src.shape))
+
+
+class ClaheStage(PreprocessStage):
+    """
+    the adaptive histogram equalization, the clahe object is created once
+    """
+    name = 'clahe'
+
+    def __init__(self, clip_limit: float = 2.0, tile_grid_size: Tuple[int, int] = (8, 8)):
+        super().__init__()
+        self._clahe = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=tile_grid_size)
+
+    def __call__(self, src: np.ndarray) -> np.ndarray:
+        return self._clahe.apply(src, dst=self._output_buffer(src.shape))
+
+
+class ResizeStage(PreprocessStage):
+    name = 'resize'
+    changes_geometry = True
+
+    def __init__(self, scale: float, interpolation: int = cv2.INTER_AREA):
+        super().__init__()
+        self._scale: float = scale
+        self._interpolation: int = interpolation
+
+    def __call__(self, src: np.ndarray) -> np.ndarray:
+        height, width = int(src.shape[0] * self._scale), int(src.shape[1] * self._scale)
+        return cv2.resize(src, (width, height), dst=self._output_buffer((height, width) + src.shape[2:], src.dtype),
+                          interpolation=self._interpolation)
+
+
+class RotateStage(PreprocessStage):
+    name = 'rotate'
+    changes_geometry = True
+
+    def __init__(self, rotate_code: int = cv2.ROTATE_90_CLOCKWISE):
+        super().__init__()
+        self._rotate_code: int = rotate_code
+
+    def __call__(self, src: np.ndarray) -> np.ndarray:
+        shape = src.shape if self._rotate_code == cv2.ROTATE_180 else (src.shape[1], src.shape[0]) + src.shape[2:]
+        return cv2.rotate(src, self._rotate_code, dst=self._output_buffer(shape, src.dtype))
+
+
+class ThresholdStage(PreprocessStage):
+    """
+    the binary threshold, the threshold of 0 uses the otsu's method like the threshold does
+    """
+    name = 'threshold'
+
+    def __init__(self, thresh: float = 0, maxval: float = 255):
+        super().__init__()
+        self._thresh: float = thresh
+        self._maxval: float = maxval
+        self._type: int = cv2.THRESH_BINARY | cv2.THRESH_OTSU if thresh == 0 else cv2.THRESH_BINARY
+
+    def __call__(self, src: np.ndarray) -> np.ndarray:
+        return cv2.threshold(src, self._thresh, self._maxval, self._type, dst=self._output_buffer(src.shape))[1]
+
+
+class AdaptiveThreshStage(PreprocessStage):
+    """
+    same as the adaptiveThresh, the pixels no less than (1 - ratio) of the local mean are set to 255,
+    the float buffers of the mean and the source are reused
+    """
+    name = 'adaptive_thresh'
+
+    def __init__(self, win_size: Tuple[int, int], ratio: float = 0.15):
+        super().__init__()
+        self._win_size: Tuple[int, int] = win_size
+        self._mean_factor: float = 1.0 - ratio
+        self._mean_buffer: Optional[np.ndarray] = None
+        self._src_buffer: Optional[np.ndarray] = None
+
+    def __call__(self, src: np.ndarray) -> np.ndarray:
+        if self._mean_buffer is None or self._mean_buffer.shape != src.shape:
+            self._mean_buffer = np.empty(src.shape, dtype=np.float32)
+            self._src_buffer = np.empty(src.shape, dtype=np.float32)
+        mean = cv2.boxFilter(src, cv2.CV_32F, self._win_size, dst=self._mean_buffer)
+        np.multiply(mean, self._mean_factor, out=mean)
+        np.copyto(self._src_buffer, src)
+        return cv2.compare(self._src_buffer, mean, cv2.CMP_GE, dst=self._output_buffer(src.shape))
+
+
+class MorphologyStage(PreprocessStage):
+    """
+    the morphological operation with a rectangular kernel of (2 * radius + 1), the kernel is built once
+    """
+    name = 'morphology'
+
+    def __init__(self, radius: int, iterations: int = 1, op: int = cv2.MORPH_OPEN):
+        super().__init__()
+        self._kernel: np.ndarray = cv2.getStructuringElement(cv2.MORPH_RECT, (2 * radius + 1, 2 * radius + 1))
+        self._iterations: int = iterations
+        self._op: int = op
+
+    def __call__(self, src: np.ndarray) -> np.ndarray:
+        return cv2.morphologyEx(src, self._op, self._kernel, dst=self._output_buffer(src.shape, src.dtype),
+                                iterations=self._iterations)
+
+
+class PreprocessPipeline(object):
+    """
+    runs the stages in order and times each of them, no allocation in the steady state.
+
+    Examples:
+        pipeline = PreprocessPipeline(GammaStage(0.5), ClaheStage())
+        processed = pipeline(gray)
+        print(pipeline.timing_report())
+    """
+
+    def __init__(self, *stages: PreprocessStage):
+        self._stages: List[PreprocessStage] = list(stages)
+        self._elapsed_ns: List[int] = [0] * len(self._stages)
+        self._call_count: int = 0
+
+    def add(self, stage: PreprocessStage) -> 'PreprocessPipeline':
+        self._stages.append(stage)
+        self._elapsed_ns.append(0)
+        return self
+
+    @property
+    def stages(self) -> List[PreprocessStage]:
+        return self._stages
+
+    @property
+    def changes_geometry(self) -> bool:
+        return any(stage.changes_geometry for stage in self._stages)
+
+    def __call__(self, src: np.ndarray) -> np.ndarray:
+        """
+        Returns: the output of the last stage, valid until the next call
+        """
+        elapsed_ns = self._elapsed_ns
+        start = perf_counter_ns()
+        for index, stage in enumerate(self._stages):
+            src = stage(src)
+            end = perf_counter_ns()
+            elapsed_ns[index] += end - start
+            start = end
+        self._call_count += 1
+        return src
+
+    def timing_report(self) -> Dict[str, float]:
+        """
+        Returns: the stage name -> the mean time of the stage in ms, the stages with the same name are numbered
+        """
+        report = {}
+        count = max(self._call_count, 1)
+        for stage, elapsed_ns in zip(self._stages, self._elapsed_ns):
+            name = stage.name
+            suffix = 1
+            while name in report:
+                suffix += 1
+                name = f'{stage.name}_{suffix}'
+            report[name] = elapsed_ns / count / 1000000
+        report['total'] = sum(self._elapsed_ns) / count / 1000000
+        return report
+
+    def reset_timing(self) -> None:
+        self._elapsed_ns = [0] * len(self._stages)
+        self._call_count = 0
+
+
+def otsu_from_hist(hist: np.ndarray) -> int:
+    """
+    the otsu's threshold of a 256-bin histogram, costs O(256) instead of a pass over the image
+    """
+    hist = hist.astype(np.float64)
+    total = hist.sum()
+    if total == 0:
+        return 0
+    levels = np.arange(256)
+    weight_bg = np.cumsum(hist)
+    weight_fg = total - weight_bg
+    sum_bg = np.cumsum(hist * levels)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_bg = sum_bg / weight_bg
+        mean_fg = (sum_bg[-1] - sum_bg) / weight_fg
+        between = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+    return int(np.nanargmax(np.nan_to_num(between, nan=-1.)))
+
+
+class IncrementalGrayHist(object):
+    """
+    the gray histogram of a video, kept up to date with the frame deltas.
+
+    the frame is sampled every stride pixels, only the sampled pixels changed by more than the tolerance
+    are moved between the bins. the sensor noise changes most of the pixels of every frame, so with the
+    tolerance of 0 the delta often costs more than a recompute, the update falls back to the strided bincount
+    once the changed ratio exceeds the max_changed_ratio. the auto-exposure and the threshold estimation
+    read the histogram instead of scanning the frame, see the benchmark.benchmark_gray_hist
+
+    NOTE:
+        the delta is only cheaper than the cv2.calcHist of the strided sample at the stride 1 or 2,
+        at the default stride 4 both cost about the same, the class then only saves keeping the frames around
+    """
+
+    def __init__(self, stride: int = 4, tolerance: int = 4, max_changed_ratio: float = 0.1):
+        """
+
+        Args:
+            stride: the sampling stride
+            tolerance: the pixels changed by no more than it keep their old bins, so the noise is ignored,
+                the default covers a sensor noise of +-2, the histogram is accurate within it
+            max_changed_ratio: recompute instead when more sampled pixels than this ratio changed
+        """
+        self._stride: int = stride
+        self._tolerance: int = tolerance
+        self._max_changed_ratio: float = max_changed_ratio
+        self._hist: np.ndarray = np.zeros(256, dtype=np.int64)
+        # the counted sample, and the buffers of the current one and the change mask
+        self._sample: Optional[np.ndarray] = None
+        self._current: Optional[np.ndarray] = None
+        self._diff: Optional[np.ndarray] = None
+        self._changed: Optional[np.ndarray] = None
+
+        self.incremental_updates: int = 0
+        self.full_updates: int = 0
+
+    @property
+    def hist(self) -> np.ndarray:
+        """
+        Returns: the histogram of the sampled pixels, NOTE: updated in place
+        """
+        return self._hist
+
+    @property
+    def sample_count(self) -> int:
+        return 0 if self._sample is None else self._sample.size
+
+    def update(self, src: np.ndarray) -> np.ndarray:
+        """
+        apply the delta of the frame to the histogram
+        Returns:
+            the updated histogram
+        """
+        sample = src[::self._stride, ::self._stride]
+        if self._sample is None or self._sample.shape != sample.shape:
+            # the first frame, or the resolution changed
+            # always copied, the strided view of the stride 1 is the frame of the caller itself
+            self._sample = np.array(sample, copy=True)
+            self._current = np.empty_like(self._sample)
+            self._diff = np.empty_like(self._sample)
+            self._changed = np.empty(sample.shape, dtype=bool)
+            self._recount(self._sample)
+            self.full_updates += 1
+            return self._hist
+        current = self._current
+        np.copyto(current, sample)
+        if self._tolerance:
+            changed = np.greater(cv2.absdiff(current, self._sample, dst=self._diff), self._tolerance,
+                                 out=self._changed)
+        else:
+            changed = np.not_equal(current, self._sample, out=self._changed)
+        changed_count = np.count_nonzero(changed)
+        if changed_count > self._max_changed_ratio * current.size:
+            # moving this many pixels costs more than counting them all
+            self._recount(current)
+            self._sample, self._current = current, self._sample
+            self.full_updates += 1
+        else:
+            if changed_count:
+                indexes = np.flatnonzero(changed)
+                counted = self._sample.reshape(-1)
+                values = current.reshape(-1)[indexes]
+                self._hist -= np.bincount(counted[indexes], minlength=256)
+                self._hist += np.bincount(values, minlength=256)
+                # the pixels within the tolerance keep the values they are counted with
+                counted[indexes] = values
+            self.incremental_updates += 1
+        return self._hist
+
+    def _recount(self, sample: np.ndarray) -> None:
+        # the calcHist counts a contiguous sample several times faster than the bincount
+        self._hist[:] = cv2.calcHist([sample], [0], None, [256], [0, 256]).ravel()
+
+    def mean(self) -> float:
+        count = self._hist.sum()
+        return float(self._hist @ np.arange(256) / count) if count else 0.
+
+    def percentile(self, q: float) -> int:
+        """
+        Returns: the gray level below which q percent of the sampled pixels fall
+        """
+        cumsum = np.cumsum(self._hist)
+        return int(np.searchsorted(cumsum, cumsum[-1] * q / 100))
+
+    def otsu_threshold(self) -> int:
+        return otsu_from_hist(self._hist)
+
+    def reset(self) -> None:
+        self._sample = None
+        self._hist.fill(0)
+
+
+class IncrementalAdaptiveThreshStage(PreprocessStage):
+    """
+    the adaptiveThresh for the video, the local mean is computed on the frame downsampled by the stride,
+    and only every refresh_interval frames, since the lighting changes much slower than the frame rate.
+    the threshold map is kept as uint8, so a frame without the refresh costs a single compare pass
+    """
+    name = 'incremental_adaptive_thresh'
+
+    def __init__(self, win_size: Tuple[int, int], ratio: float = 0.15, stride: int = 4, refresh_interval: int = 5):
+        super().__init__()
+        self._win_size: Tuple[int, int] = (max(win_size[0] // stride, 1), max(win_size[1] // stride, 1))
+        self._mean_factor: float = 1.0 - ratio
+        self._stride: int = stride
+        self._refresh_interval: int = refresh_interval
+        self._frame_count: int = 0
+        self._thresh_map: Optional[np.ndarray] = None
+
+    def _refresh(self, src: np.ndarray) -> None:
+        height, width = src.shape[:2]
+        small = cv2.resize(src, (max(width // self._stride, 1), max(height // self._stride, 1)),
+                           interpolation=cv2.INTER_AREA)
+        mean = cv2.boxFilter(small, cv2.CV_32F, self._win_size)
+        # the src is integer, src >= ceil(t) is the same as src >= t
+        small_thresh = np.ceil(mean * self._mean_factor).astype(np.uint8)
+        if self._thresh_map is None or self._thresh_map.shape != src.shape:
+            self._thresh_map = np.empty(src.shape, dtype=np.uint8)
+        cv2.resize(small_thresh, (width, height), dst=self._thresh_map, interpolation=cv2.INTER_LINEAR)
+
+    def __call__(self, src: np.ndarray) -> np.ndarray:
+        if self._thresh_map is None or self._thresh_map.shape != src.shape \
+                or self._frame_count % self._refresh_interval == 0:
+            self._refresh(src)
+        self._frame_count += 1
+        return cv2.compare(src, self._thresh_map, cv2.CMP_GE, dst=self._output_buffer(src.shape))
@@ -1,7 +1,7 @@
 from copy import deepcopy
 from typing import Callable, Sequence, Any, Tuple, Optional, Dict, List
 
-from .onboardsensors import OnBoardSensors
+from .onboardsensors import OnBoardSensors, HIGH, LOW
 from ..constant import EDGE_REAR_SENSOR_ID, EDGE_FRONT_SENSOR_ID, SIDES_SENSOR_ID, DEFAULT_EDGE_BASELINE, \
     START_MIN_LINE, \
     EDGE_REAR_WATCHER_NAME, EDGE_FRONT_WATCHER_NAME, SIDES_WATCHER_NAME, GRAYS_WATCHER_NAME, DEFAULT_GRAYS_BASELINE, \
@@ -55,6 +55,41 @@ def build_io_watcher_from_indexed(sensor_update: Callable[[int], int],
     return _watcher
 
 
+def build_io_watcher_from_packed(packed_updater: Callable[[], int],
+                                 sensor_ids: Sequence[int],
+                                 activate_status_describer: Sequence[int],
+                                 use_any: bool = False) -> Watcher:
+    """
+    use packed io updater to construct watcher, the expected levels are precomputed into a mask/value pair,
+    so the watcher costs a single read and a bitwise comparison
+    Args:
+        packed_updater (): returns the levels of all the channels in a single int, bit i for the channel i
+        sensor_ids ():
+        activate_status_describer ():
+        use_any ():
+
+    Returns:
+
+    """
+    if len(sensor_ids) != len(activate_status_describer):
+        raise IndexError('should be with same length')
+    mask = 0
+    value = 0
+    for sensor_id, describer in zip(sensor_ids, activate_status_describer):
+        mask |= 1 << sensor_id
+        value |= (1 if describer else 0) << sensor_id
+
+    if use_any:
+        def _watcher() -> bool:
+            # the matched channels are left as 1 in the masked xnor
+            return bool(~(packed_updater() ^ value) & mask)
+    else:
+        def _watcher() -> bool:
+            return packed_updater() & mask == value
+
+    return _watcher
+
+
 # TODO: to manage all sort of breakers ,shall we create a registry system?
 def build_watcher_simple(sensor_update: Callable[..., Sequence[Any]],
                          sensor_id: Tuple[int, ...],
@@ -374,9 +409,14 @@ default_sides_watcher: Watcher = build_watcher_simple(sensor_update=OnBoardSenso
                                                       sensor_id=SIDES_SENSOR_ID,
                                                       max_line=START_MIN_LINE)
 
-default_grays_watcher: Watcher = build_watcher_simple(sensor_update=OnBoardSensors.io_all_channels,
-                                                      sensor_id=GRAYS_SENSOR_ID,
-                                                      max_line=DEFAULT_GRAYS_BASELINE)
+# the io levels lower than the baseline of HIGH are exactly LOW, which is a single mask comparison
+default_grays_watcher: Watcher = build_io_watcher_from_packed(
+    packed_updater=OnBoardSensors.io_all_channels_packed,
+    sensor_ids=GRAYS_SENSOR_ID,
+    activate_status_describer=(LOW,) * len(GRAYS_SENSOR_ID)
+) if DEFAULT_GRAYS_BASELINE == HIGH else build_watcher_simple(sensor_update=OnBoardSensors.io_all_channels,
+                                                              sensor_id=GRAYS_SENSOR_ID,
+                                                              max_line=DEFAULT_GRAYS_BASELINE)
 watchers = {EDGE_REAR_WATCHER_NAME: default_edge_rear_watcher,
             REAR_WATCHER_NAME: default_rear_watcher,
             EDGE_FRONT_WATCHER_NAME: default_edge_front_watcher,
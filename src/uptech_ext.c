@@ -0,0 +1,165 @@
+#include <stdint.h>
+#include <time.h>
+
+/* exported by libuptech.so */
+extern int ADC_GetAll(uint16_t *adc);
+extern int adc_io_InputGetAll(void);
+extern int adc_io_SetAll(unsigned int levels);
+extern int adc_io_ModeSetAll(uint8_t modes);
+extern int mpu6500_Get_Accel(float *accel);
+extern int mpu6500_Get_Gyro(float *gyro);
+extern int mpu6500_Get_Attitude(float *atti);
+
+#define ADC_CHANNEL_COUNT 10
+#define MPU_AXIS_COUNT 3
+
+/* IO 波形指令，高字节为操作码，低字节为参数，与 python 端的 IO_OP_* 一一对应 */
+#define IO_OP_LEVELS 0x01 /* 设置 mask 选中的通道的电平 */
+#define IO_OP_MODES 0x02  /* 设置 mask 选中的通道的模式 */
+#define IO_OP_SAMPLE 0x03 /* 读取一次全部通道的输入电平 */
+#define IO_OP_DELAY 0x04  /* 等待参数个半周期，从上一个等待的截止时刻起算 */
+#define IO_OP_WAIT_HIGH 0x05 /* 等待参数选中的通道全部变为高电平，用于时钟延展 */
+
+/* uptech_io_exec 的错误码 */
+#define IO_EXEC_FAIL (-1)
+#define IO_EXEC_TIMEOUT (-2)
+
+/* 读取失败的标志位 */
+#define READ_FAIL_ADC 0x01
+#define READ_FAIL_IO 0x02
+#define READ_FAIL_ACCEL 0x04
+#define READ_FAIL_GYRO 0x08
+#define READ_FAIL_ATTI 0x10
+
+/*
+ * 一帧完整的板载传感器数据，与 python 端的 SensorFrame/SENSOR_FRAME_DTYPE 一一对应
+ * 成员按照自然对齐的顺序排列，packed 只是去掉了末尾的填充
+ */
+typedef struct __attribute__((packed)) {
+    float accel[MPU_AXIS_COUNT];
+    float gyro[MPU_AXIS_COUNT];
+    float atti[MPU_AXIS_COUNT];
+    uint16_t adc[ADC_CHANNEL_COUNT];
+    uint8_t io;
+} SensorFrame;
+
+#pragma GCC diagnostic push
+#pragma GCC diagnostic ignored "-Waddress-of-packed-member"
+
+/*
+ * 一次调用读取 ADC，IO，加速度，角速度以及姿态
+ * 返回值为读取失败的标志位，0 表示全部成功
+ */
+int uptech_read_all(SensorFrame *frame) {
+    int failures = 0;
+    int io;
+
+    if (ADC_GetAll(frame->adc)) {
+        failures |= READ_FAIL_ADC;
+    }
+    io = adc_io_InputGetAll();
+    if (io < 0) {
+        failures |= READ_FAIL_IO;
+    } else {
+        frame->io = (uint8_t) io;
+    }
+    if (mpu6500_Get_Accel(frame->accel)) {
+        failures |= READ_FAIL_ACCEL;
+    }
+    if (mpu6500_Get_Gyro(frame->gyro)) {
+        failures |= READ_FAIL_GYRO;
+    }
+    if (mpu6500_Get_Attitude(frame->atti)) {
+        failures |= READ_FAIL_ATTI;
+    }
+    return failures;
+}
+
+#pragma GCC diagnostic pop
+
+static int64_t now_ns(void) {
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (int64_t) ts.tv_sec * 1000000000 + ts.tv_nsec;
+}
+
+/*
+ * 执行一段 IO 波形，只有 mask 选中的通道会被改变
+ * levels 与 modes 为电平与模式的影子寄存器，执行后更新为最终的状态
+ * samples 按顺序存放每一次 IO_OP_SAMPLE 读到的输入电平
+ * timeout_us 为每一次 IO_OP_WAIT_HIGH 的超时时间
+ * 返回值为采样的次数，IO_EXEC_FAIL 表示 SPI 传输失败，IO_EXEC_TIMEOUT 表示等待超时
+ */
+int uptech_io_exec(const uint16_t *ops, int op_count, uint8_t mask, uint8_t *levels, uint8_t *modes,
+                   uint8_t *samples, unsigned int half_period_us, unsigned int timeout_us) {
+    int sample_count = 0;
+    int64_t half_period_ns = (int64_t) half_period_us * 1000;
+    int64_t timeout_ns = (int64_t) timeout_us * 1000;
+    int64_t deadline = now_ns();
+    int64_t current;
+    int64_t timeout_at;
+    uint8_t arg;
+    uint8_t value;
+    int io;
+
+    for (int i = 0; i < op_count; i++) {
+        arg = (uint8_t) (ops[i] & 0xFF);
+        switch (ops[i] >> 8) {
+            case IO_OP_LEVELS:
+                value = (uint8_t) ((*levels & ~mask) | (arg & mask));
+                if (value != *levels) {
+                    if (adc_io_SetAll(value)) {
+                        return IO_EXEC_FAIL;
+                    }
+                    *levels = value;
+                }
+                break;
+            case IO_OP_MODES:
+                value = (uint8_t) ((*modes & ~mask) | (arg & mask));
+                if (value != *modes) {
+                    if (adc_io_ModeSetAll(value)) {
+                        return IO_EXEC_FAIL;
+                    }
+                    *modes = value;
+                }
+                break;
+            case IO_OP_SAMPLE:
+                io = adc_io_InputGetAll();
+                if (io < 0) {
+                    return IO_EXEC_FAIL;
+                }
+                samples[sample_count++] = (uint8_t) io;
+                break;
+            case IO_OP_DELAY:
+                /* 以截止时刻计时，SPI 传输的耗时计入半周期内；落后时重新对齐 */
+                deadline += half_period_ns * arg;
+                current = now_ns();
+                if (current > deadline) {
+                    deadline = current;
+                }
+                while (now_ns() < deadline) {
+                }
+                break;
+            case IO_OP_WAIT_HIGH:
+                timeout_at = now_ns() + timeout_ns;
+                for (;;) {
+                    io = adc_io_InputGetAll();
+                    if (io < 0) {
+                        return IO_EXEC_FAIL;
+                    }
+                    if ((io & arg) == arg) {
+                        break;
+                    }
+                    if (now_ns() > timeout_at) {
+                        return IO_EXEC_TIMEOUT;
+                    }
+                }
+                /* 从机释放时钟后，后续的半周期从此刻起算 */
+                deadline = now_ns();
+                break;
+            default:
+                return IO_EXEC_FAIL;
+        }
+    }
+    return sample_count;
+}
@@ -0,0 +1,45 @@
+from typing import List, Tuple
+
+import pytest
+
+from ..module.libuptech import FakeUptechLib, load_uptech_lib, load_uptech_ext_lib
+from ..module.onboardsensors import OnBoardSensors
+
+
+class RecordingUptechLib(FakeUptechLib):
+    """
+    a FakeUptechLib that records the io calls, and plays the scripted input levels.
+    every adc_io_InputGetAll takes the next of the inputs, the last one is kept once the script runs out
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.calls: List[Tuple] = []
+        self.inputs: List[int] = []
+
+    def adc_io_SetAll(self, levels: int) -> int:
+        self.calls.append(('SetAll', levels))
+        return super().adc_io_SetAll(levels)
+
+    def adc_io_ModeSetAll(self, modes: int) -> int:
+        self.calls.append(('ModeSetAll', modes))
+        return super().adc_io_ModeSetAll(modes)
+
+    def adc_io_InputGetAll(self) -> int:
+        self.calls.append(('InputGetAll',))
+        if self.inputs:
+            self.io_input_levels = self.inputs.pop(0) if len(self.inputs) > 1 else self.inputs[0]
+        return super().adc_io_InputGetAll()
+
+
+@pytest.fixture
+def fake_lib() -> RecordingUptechLib:
+    """
+    the OnBoardSensors bound to a fresh fake, the io_exec runs in python
+    """
+    lib = RecordingUptechLib()
+    OnBoardSensors.bind_lib(lib)
+    OnBoardSensors.invalidate_io_shadow()
+    yield lib
+    OnBoardSensors.bind_lib(load_uptech_lib(), load_uptech_ext_lib())
+    OnBoardSensors.invalidate_io_shadow()
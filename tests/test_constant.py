@@ -0,0 +1,29 @@
+import json
+
+import pytest
+
+from .. import constant
+
+
+def test_write_config_keeps_the_other_entries(tmp_path, monkeypatch):
+    path = tmp_path / 'config.json'
+    path.write_text(json.dumps({'MOTOR_IDS': [1, 2, 3, 4], 'DETECTION_FPS': {'straight': 5}}))
+    monkeypatch.setattr(constant, 'PATH_CONFIG', str(path))
+    constant.write_config({'DETECTION_FPS': {'straight': 8}})
+    assert json.loads(path.read_text()) == {'MOTOR_IDS': [1, 2, 3, 4], 'DETECTION_FPS': {'straight': 8}}
+
+
+def test_write_config_creates_the_missing_file(tmp_path, monkeypatch):
+    path = tmp_path / 'config.json'
+    monkeypatch.setattr(constant, 'PATH_CONFIG', str(path))
+    constant.write_config({'DETECTION_FPS': {'straight': 8}})
+    assert json.loads(path.read_text()) == {'DETECTION_FPS': {'straight': 8}}
+
+
+def test_write_config_refuses_to_overwrite_an_invalid_file(tmp_path, monkeypatch):
+    path = tmp_path / 'config.json'
+    path.write_text('{"MOTOR_IDS": [1, 2, 3, 4],')
+    monkeypatch.setattr(constant, 'PATH_CONFIG', str(path))
+    with pytest.raises(ValueError):
+        constant.write_config({'DETECTION_FPS': {'straight': 8}})
+    assert path.read_text() == '{"MOTOR_IDS": [1, 2, 3, 4],'
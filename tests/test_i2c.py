@@ -0,0 +1,437 @@
+from typing import List, Tuple
+
+import pytest
+
+from ..module import i2c
+from ..module.i2c import I2CWaveformEngine, SimulateI2C, SensorI2CExpansion, I2CNackError, I2CTimeoutError, \
+    NACK_ERRORS, TIMEOUT_ERRORS, IO_ERRORS, RETRIES, FAILURES
+from ..module.libuptech import IO_OP_LEVELS, IO_OP_MODES, IO_OP_SAMPLE, IO_OP_DELAY, IO_OP_WAIT_HIGH, \
+    IO_EXEC_FAIL, IO_EXEC_TIMEOUT
+from ..module.onboardsensors import OnBoardSensors, HIGH, LOW, OUTPUT, INPUT
+
+SDA_PIN = 0
+SCL_PIN = 1
+SDA = 1 << SDA_PIN
+SCL = 1 << SCL_PIN
+
+# a clock is (sda driven, sda level, sampled) at the rising edge of the scl
+Clock = Tuple[bool, int, bool]
+START: Clock = (True, 1, False)
+STOP: Clock = (True, 0, False)
+ACK_SAMPLE: Clock = (False, 1, True)
+DATA_SAMPLE: Clock = (False, 1, True)
+MASTER_ACK: Clock = (True, 0, False)
+MASTER_NACK: Clock = (True, 1, False)
+
+
+def op(code: int, arg: int = 0) -> int:
+    return code << 8 | arg
+
+
+def scl_clocks(ops: List[int]) -> List[Clock]:
+    """
+    the state of the sda at every rising edge of the scl driven push-pull
+    """
+    modes = levels = 0
+    clocks = []
+    for o in ops:
+        code, arg = o >> 8, o & 0xFF
+        if code == IO_OP_MODES:
+            modes = arg
+        elif code == IO_OP_LEVELS:
+            if arg & SCL and not levels & SCL:
+                clocks.append((bool(modes & SDA), 1 if arg & SDA else 0, False))
+            levels = arg
+        elif code == IO_OP_SAMPLE:
+            clocks[-1] = clocks[-1][:2] + (True,)
+    return clocks
+
+
+def bits(byte: int) -> List[Clock]:
+    return [(True, byte >> i & 1, False) for i in range(7, -1, -1)]
+
+
+def scripted_executor(*sda_samples: int, result: int = None):
+    """
+    an IOExecutor that fills the samples with the given sda levels, or returns the given result
+    """
+
+    def executor(ops, op_count, mask, samples, half_period_us, timeout_us) -> int:
+        if result is not None:
+            return result
+        for i, level in enumerate(sda_samples):
+            samples[i] = SDA if level else 0
+        return len(sda_samples)
+
+    return executor
+
+
+def make_engine(executor, clock_stretching: bool = False, timeout_us: int = 1000) -> I2CWaveformEngine:
+    return I2CWaveformEngine(SDA_PIN, SCL_PIN, 100, executor, clock_stretching, timeout_us)
+
+
+def make_bus(executor, **kwargs) -> SimulateI2C:
+    return SimulateI2C(SDA_PIN, SCL_PIN, 100,
+                       OnBoardSensors.set_io_level, OnBoardSensors.get_io_level, OnBoardSensors.set_io_mode,
+                       io_executor=executor, **kwargs)
+
+
+# region waveforms
+def test_start_waveform():
+    ops = []
+    make_engine(None)._compile_start(ops)
+    assert ops == [op(IO_OP_MODES, SDA | SCL),
+                   op(IO_OP_LEVELS, SDA), op(IO_OP_DELAY, 1),
+                   op(IO_OP_LEVELS, SDA | SCL), op(IO_OP_DELAY, 1),
+                   op(IO_OP_LEVELS, SCL), op(IO_OP_DELAY, 1),
+                   op(IO_OP_LEVELS, 0)]
+
+
+def test_stop_waveform():
+    ops = []
+    make_engine(None)._compile_stop(ops)
+    assert ops == [op(IO_OP_MODES, SDA | SCL),
+                   op(IO_OP_LEVELS, 0), op(IO_OP_DELAY, 1),
+                   op(IO_OP_LEVELS, SCL), op(IO_OP_DELAY, 1),
+                   op(IO_OP_LEVELS, SDA | SCL), op(IO_OP_DELAY, 1)]
+
+
+def test_stretching_start_stop_release_scl():
+    ops = []
+    engine = make_engine(None, clock_stretching=True)
+    engine._compile_start(ops)
+    assert ops == [op(IO_OP_MODES, SDA | SCL),
+                   op(IO_OP_LEVELS, SDA), op(IO_OP_DELAY, 1),
+                   op(IO_OP_MODES, SDA), op(IO_OP_WAIT_HIGH, SCL), op(IO_OP_DELAY, 1),
+                   op(IO_OP_LEVELS, 0), op(IO_OP_DELAY, 1),
+                   op(IO_OP_MODES, SDA | SCL)]
+    ops.clear()
+    engine._compile_stop(ops)
+    assert ops == [op(IO_OP_MODES, SDA | SCL),
+                   op(IO_OP_LEVELS, 0), op(IO_OP_DELAY, 1),
+                   op(IO_OP_MODES, SDA), op(IO_OP_WAIT_HIGH, SCL), op(IO_OP_DELAY, 1),
+                   op(IO_OP_LEVELS, SDA), op(IO_OP_DELAY, 1)]
+
+
+def test_stretching_never_drives_scl_high():
+    waveform = make_engine(None, clock_stretching=True).compile_read(0x50, 2, register=0x10)
+    for o in waveform.ops:
+        if o >> 8 == IO_OP_LEVELS:
+            assert not o & SCL
+
+
+def test_write_waveform_samples_the_acks():
+    waveform = make_engine(None).compile_write(0x50, b'\x3c')
+    assert scl_clocks(list(waveform.ops)) == [START, *bits(0x50 << 1), ACK_SAMPLE, *bits(0x3c), ACK_SAMPLE, STOP]
+    assert waveform.ack_count == 2
+    assert len(waveform.samples) == 2
+
+
+def test_read_waveform_acks_all_but_the_last_byte():
+    waveform = make_engine(None).compile_read(0x50, 2)
+    assert scl_clocks(list(waveform.ops)) == [START, *bits(0x50 << 1 | 1), ACK_SAMPLE,
+                                              *[DATA_SAMPLE] * 8, MASTER_ACK,
+                                              *[DATA_SAMPLE] * 8, MASTER_NACK,
+                                              STOP]
+    assert len(waveform.samples) == 1 + 2 * 8
+
+
+def test_register_read_waveform_restarts():
+    waveform = make_engine(None).compile_read(0x50, 1, register=0x10, stop=False)
+    assert scl_clocks(list(waveform.ops)) == [START, *bits(0x50 << 1), ACK_SAMPLE, *bits(0x10), ACK_SAMPLE,
+                                              START, *bits(0x50 << 1 | 1), ACK_SAMPLE,
+                                              *[DATA_SAMPLE] * 8, MASTER_NACK]
+    assert waveform.ack_count == 3
+
+
+# endregion
+
+# region execute
+def test_execute_decodes_the_data():
+    engine = make_engine(scripted_executor(0, 1, 0, 1, 0, 0, 1, 0, 1))
+    assert engine.read(0x50, 1) == bytearray(b'\xa5')
+
+
+def test_execute_raises_on_nack():
+    engine = make_engine(scripted_executor(0, 1))
+    with pytest.raises(I2CNackError):
+        engine.write(0x50, b'\x01')
+    assert engine.nack_count == 1
+
+
+def test_execute_raises_on_timeout():
+    engine = make_engine(scripted_executor(result=IO_EXEC_TIMEOUT))
+    with pytest.raises(I2CTimeoutError):
+        engine.write(0x50, b'\x01')
+    assert engine.timeout_count == 1
+
+
+def test_execute_raises_on_io_failure():
+    engine = make_engine(scripted_executor(result=IO_EXEC_FAIL))
+    with pytest.raises(ConnectionError) as info:
+        engine.write(0x50, b'\x01')
+    assert not isinstance(info.value, I2CNackError)
+
+
+def test_write_plays_on_the_fake_lib(fake_lib):
+    # the slave pulls the sda low for every ack, the channel 7 belongs to someone else,
+    # the other input channels read low, so their latches are read back as low
+    fake_lib.io_input_levels = 0x00
+    fake_lib.io_modes = 0x80
+    fake_lib.io_output_levels = 0x80
+    make_engine(OnBoardSensors.io_exec).write(0x50, b'\x3c')
+    assert fake_lib.io_modes == 0x80 | SDA | SCL
+    assert fake_lib.io_output_levels == 0x80 | SDA | SCL
+
+
+def test_stretching_times_out_on_the_fake_lib(fake_lib):
+    # the slave holds the scl low
+    fake_lib.io_input_levels = 0xFF & ~SDA & ~SCL
+    with pytest.raises(I2CTimeoutError):
+        make_engine(OnBoardSensors.io_exec, clock_stretching=True, timeout_us=200).write(0x50, b'\x3c')
+    assert all(not call[1] & SCL for call in fake_lib.calls if call[0] == 'SetAll')
+
+
+def test_stretching_releases_scl_when_idle(fake_lib):
+    fake_lib.io_input_levels = 0xFF & ~SDA
+    make_engine(OnBoardSensors.io_exec, clock_stretching=True).write(0x50, b'\x3c')
+    assert fake_lib.io_modes & (SDA | SCL) == SDA
+    assert all(not call[1] & SCL for call in fake_lib.calls if call[0] == 'SetAll')
+
+
+# endregion
+
+# region retries
+def test_retries_back_off_with_a_cap(fake_lib, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(i2c, 'sleep', sleeps.append)
+    bus = make_bus(scripted_executor(result=IO_EXEC_TIMEOUT), retries=3, backoff_ms=1., max_backoff_ms=3.)
+    with pytest.raises(I2CTimeoutError):
+        bus.requestFrom(0x50, 1, True)
+    assert bus.error_counters == {NACK_ERRORS: 0, TIMEOUT_ERRORS: 4, IO_ERRORS: 0, RETRIES: 3, FAILURES: 1}
+    assert sleeps == [0.001, 0.002, 0.003]
+
+
+def test_retry_recovers_after_a_nack(fake_lib, monkeypatch):
+    monkeypatch.setattr(i2c, 'sleep', lambda seconds: None)
+    played = []
+
+    def executor(ops, op_count, mask, samples, half_period_us, timeout_us) -> int:
+        played.append(len(samples))
+        if not samples:
+            # the bus clear
+            return 0
+        nack = played.count(len(samples)) == 1
+        return scripted_executor(1 if nack else 0, 1, 0, 1, 0, 0, 1, 0, 1)(ops, op_count, mask, samples,
+                                                                         half_period_us, timeout_us)
+
+    bus = make_bus(executor)
+    bus.requestFrom(0x50, 1, True)
+    assert bus.read_byte() == 0xA5
+    assert played == [9, 0, 9]
+    assert bus.error_counters == {NACK_ERRORS: 1, TIMEOUT_ERRORS: 0, IO_ERRORS: 0, RETRIES: 1, FAILURES: 0}
+
+
+def test_io_failure_without_retries(fake_lib, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(i2c, 'sleep', sleeps.append)
+    bus = make_bus(scripted_executor(result=IO_EXEC_FAIL), retries=0)
+    bus.beginTransmission(0x50)
+    bus.write(b'\x01')
+    with pytest.raises(ConnectionError):
+        bus.endTransmission(True)
+    assert bus.error_counters == {NACK_ERRORS: 0, TIMEOUT_ERRORS: 0, IO_ERRORS: 1, RETRIES: 0, FAILURES: 1}
+    assert sleeps == []
+    assert bus._write_buffer == bytearray()
+# endregion
+
+# region bit-banged
+IDLE, ADDRESS, WRITE, READ = range(4)
+
+
+class FakeSlave(object):
+    """
+    an i2c slave with 256 registers on a wired-and bus, it follows the edges made by the pin calls of the master.
+    the first byte written selects the register, the following ones are written from it,
+    the reads start from the selected register, both increment it
+    """
+
+    def __init__(self, address: int = 0x24, stretch_polls: int = 0):
+        """
+
+        Args:
+            address: the address of the slave
+            stretch_polls: how many reads of the scl it is held low for, every time the master releases it
+        """
+        self.address = address
+        self.registers = bytearray(range(255, -1, -1))
+        self.pointer = 0
+        self.stretch_polls = stretch_polls
+        self.levels = {SDA_PIN: HIGH, SCL_PIN: HIGH}
+        self.modes = {SDA_PIN: INPUT, SCL_PIN: INPUT}
+        self.starts = 0
+        self.stops = 0
+        self.master_nacks = 0
+        self._stretch_left = 0
+        self._pull_sda = False
+        self._state = IDLE
+        self._next_state = IDLE
+        self._acking = False
+        self._first_write = True
+        self._byte = 0
+        self._bits = 0
+        self._sda, self._scl = self._line(SDA_PIN), self._line(SCL_PIN)
+
+    def _line(self, pin: int) -> int:
+        if pin == SDA_PIN and self._pull_sda or pin == SCL_PIN and self._stretch_left:
+            return LOW
+        return self.levels[pin] if self.modes[pin] == OUTPUT else HIGH
+
+    def set_level(self, pin: int, level: int) -> None:
+        self.levels[pin] = HIGH if level else LOW
+        self._update()
+
+    def set_mode(self, pin: int, mode: int) -> None:
+        if pin == SCL_PIN and mode == INPUT and self.modes[pin] == OUTPUT:
+            self._stretch_left = self.stretch_polls
+        self.modes[pin] = mode
+        self._update()
+
+    def get_level(self, pin: int) -> int:
+        if pin == SCL_PIN and self._stretch_left:
+            self._stretch_left -= 1
+            self._update()
+        return self._line(pin)
+
+    def _update(self) -> None:
+        sda, scl = self._line(SDA_PIN), self._line(SCL_PIN)
+        if scl and self._scl and sda != self._sda:
+            if sda:
+                self.stops += 1
+                self._state = IDLE
+            else:
+                self.starts += 1
+                self._state = ADDRESS
+                self._acking = False
+                self._bits = self._byte = 0
+            self._pull_sda = False
+        elif scl and not self._scl:
+            self._rise(sda)
+        elif not scl and self._scl:
+            self._fall()
+        self._sda, self._scl = self._line(SDA_PIN), self._line(SCL_PIN)
+
+    def _rise(self, sda: int) -> None:
+        if self._state in (ADDRESS, WRITE) and not self._acking and self._bits < 8:
+            self._byte = self._byte << 1 | sda
+            self._bits += 1
+        elif self._state == READ and self._bits < 8:
+            self._bits += 1
+        elif self._state == READ and self._bits == 8:
+            self.master_nacks += sda
+            self._bits = 9 if not sda else 10
+
+    def _fall(self) -> None:
+        if self._state in (ADDRESS, WRITE):
+            if self._acking:
+                self._acking = False
+                self._pull_sda = False
+                self._state = self._next_state
+                self._bits = self._byte = 0
+                if self._state == READ:
+                    self._load()
+            elif self._bits == 8:
+                self._receive()
+        elif self._state == READ:
+            if self._bits < 8:
+                self._pull_sda = not self._byte >> 7 - self._bits & 1
+            elif self._bits == 8:
+                # released for the ack of the master
+                self._pull_sda = False
+            elif self._bits == 9:
+                self._load()
+            else:
+                self._state = IDLE
+
+    def _receive(self) -> None:
+        if self._state == ADDRESS:
+            if self._byte >> 1 != self.address:
+                self._state = IDLE
+                return
+            self._next_state = READ if self._byte & 1 else WRITE
+            self._first_write = True
+        elif self._first_write:
+            self.pointer = self._byte
+            self._first_write = False
+        else:
+            self.registers[self.pointer] = self._byte
+            self.pointer = (self.pointer + 1) & 0xFF
+        self._acking = True
+        self._pull_sda = True
+
+    def _load(self) -> None:
+        self._byte = self.registers[self.pointer]
+        self.pointer = (self.pointer + 1) & 0xFF
+        self._bits = 0
+        self._pull_sda = not self._byte >> 7 & 1
+
+
+def make_bit_banged_bus(slave: FakeSlave, **kwargs) -> SimulateI2C:
+    return SimulateI2C(SDA_PIN, SCL_PIN, 100, slave.set_level, slave.get_level, slave.set_mode, **kwargs)
+
+
+def test_bit_banged_register_read():
+    slave = FakeSlave()
+    bus = make_bit_banged_bus(slave)
+    bus.requestFrom(0x24, 3, True, 0x10)
+    assert bytes(bus.read_byte() for _ in range(3)) == bytes(slave.registers[0x10:0x13])
+    # the repeated start after the register, and the nack of the last byte
+    assert (slave.starts, slave.stops, slave.master_nacks) == (2, 1, 1)
+
+
+def test_bit_banged_register_zero():
+    slave = FakeSlave()
+    slave.pointer = 0x40
+    bus = make_bit_banged_bus(slave)
+    bus.requestFrom(0x24, 1, True, 0)
+    assert bus.read_byte() == slave.registers[0]
+    assert slave.starts == 2
+
+
+def test_bit_banged_write():
+    slave = FakeSlave()
+    bus = make_bit_banged_bus(slave)
+    bus.beginTransmission(0x24)
+    bus.write(b'\x20\xaa\xbb')
+    bus.endTransmission(True)
+    assert slave.registers[0x20:0x22] == b'\xaa\xbb'
+    assert (slave.starts, slave.stops) == (1, 1)
+
+
+def test_bit_banged_write_retries_on_nack(monkeypatch):
+    monkeypatch.setattr(i2c, 'sleep', lambda seconds: None)
+    bus = make_bit_banged_bus(FakeSlave(address=0x30), retries=1)
+    bus.beginTransmission(0x24)
+    bus.write(b'\x20')
+    with pytest.raises(I2CNackError):
+        bus.endTransmission(True)
+    assert bus.error_counters == {NACK_ERRORS: 2, TIMEOUT_ERRORS: 0, IO_ERRORS: 0, RETRIES: 1, FAILURES: 1}
+
+
+def test_bit_banged_clock_stretching():
+    slave = FakeSlave(stretch_polls=3)
+    bus = make_bit_banged_bus(slave, clock_stretching=True)
+    bus.requestFrom(0x24, 2, True, 0x10)
+    assert bytes(bus.read_byte() for _ in range(2)) == bytes(slave.registers[0x10:0x12])
+
+
+def test_expansion_forwards_clock_stretching(monkeypatch):
+    monkeypatch.setattr(i2c, 'sleep', lambda seconds: None)
+    slave = FakeSlave(stretch_polls=3)
+    expansion = SensorI2CExpansion(0x24, 0x10, SDA_PIN, SCL_PIN, 100, slave.set_level, slave.get_level,
+                                   slave.set_mode, channel_count=2, clock_stretching=True)
+    assert list(expansion.get_all_sensor()) == [0xEFEE, 0xEDEC]
+    slave.stretch_polls = 10 ** 9
+    with pytest.raises(I2CTimeoutError):
+        expansion.get_all_sensor()
+# endregion
@@ -0,0 +1,160 @@
+import os
+import shutil
+import subprocess
+from ctypes import CDLL, CFUNCTYPE, c_int, c_uint, c_uint8, c_uint16
+from time import perf_counter_ns
+from typing import Callable, List, NamedTuple, Tuple
+
+import pytest
+
+from ..module.libuptech import IO_OP_LEVELS, IO_OP_MODES, IO_OP_SAMPLE, IO_OP_DELAY, IO_OP_WAIT_HIGH, \
+    IO_EXEC_FAIL, IO_EXEC_TIMEOUT, UPTECH_EXT_PROTOTYPES
+from ..module.onboardsensors import OnBoardSensors
+from ..module.os_tools import declare_prototypes
+
+UPTECH_EXT_SOURCE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'uptech_ext.c')
+
+# the symbols the libuptech_ext.so imports from the libuptech.so, forwarded to the python callbacks
+FAKE_UPTECH_SOURCE = '''
+#include <stdint.h>
+
+static int (*input_get_all)(void);
+static int (*set_all)(unsigned int);
+static int (*mode_set_all)(uint8_t);
+
+void fake_bind(int (*input_get_all_cb)(void), int (*set_all_cb)(unsigned int), int (*mode_set_all_cb)(uint8_t)) {
+    input_get_all = input_get_all_cb;
+    set_all = set_all_cb;
+    mode_set_all = mode_set_all_cb;
+}
+
+int adc_io_InputGetAll(void) { return input_get_all(); }
+int adc_io_SetAll(unsigned int levels) { return set_all(levels); }
+int adc_io_ModeSetAll(uint8_t modes) { return mode_set_all(modes); }
+int ADC_GetAll(uint16_t *adc) { return 0; }
+int mpu6500_Get_Accel(float *accel) { return 0; }
+int mpu6500_Get_Gyro(float *gyro) { return 0; }
+int mpu6500_Get_Attitude(float *atti) { return 0; }
+'''
+
+INPUT_GET_ALL = CFUNCTYPE(c_int)
+SET_ALL = CFUNCTYPE(c_int, c_uint)
+MODE_SET_ALL = CFUNCTYPE(c_int, c_uint8)
+
+
+def op(code: int, arg: int = 0) -> int:
+    return code << 8 | arg
+
+
+class Program(NamedTuple):
+    ops: List[int]
+    mask: int
+    levels: int
+    modes: int
+    inputs: List[int]
+    result: int
+    samples: List[int]
+    final_levels: int
+    final_modes: int
+    calls: List[Tuple]
+    half_period_us: int = 5
+    timeout_us: int = 100000
+
+
+PROGRAMS = {
+    'levels': Program(ops=[op(IO_OP_LEVELS, 0b101), op(IO_OP_LEVELS, 0b101)], mask=0b111, levels=0xF2, modes=0xFF,
+                      inputs=[], result=0, samples=[], final_levels=0xF5, final_modes=0xFF,
+                      calls=[('SetAll', 0xF5)]),
+    'modes': Program(ops=[op(IO_OP_MODES, 0b11), op(IO_OP_MODES, 0b01)], mask=0b11, levels=0, modes=0x80,
+                     inputs=[], result=0, samples=[], final_levels=0, final_modes=0x81,
+                     calls=[('ModeSetAll', 0x83), ('ModeSetAll', 0x81)]),
+    'sample': Program(ops=[op(IO_OP_SAMPLE), op(IO_OP_SAMPLE)], mask=0xFF, levels=0, modes=0,
+                      inputs=[0x12, 0x34], result=2, samples=[0x12, 0x34], final_levels=0, final_modes=0,
+                      calls=[('InputGetAll',)] * 2),
+    'delay': Program(ops=[op(IO_OP_DELAY, 4), op(IO_OP_SAMPLE)], mask=0xFF, levels=0, modes=0,
+                     inputs=[0x5A], result=1, samples=[0x5A], final_levels=0, final_modes=0,
+                     calls=[('InputGetAll',)], half_period_us=250),
+    'wait_high': Program(ops=[op(IO_OP_WAIT_HIGH, 0b10), op(IO_OP_SAMPLE)], mask=0xFF, levels=0, modes=0,
+                         inputs=[0x00, 0x01, 0x02, 0x06], result=1, samples=[0x06], final_levels=0, final_modes=0,
+                         calls=[('InputGetAll',)] * 4),
+    'wait_high_timeout': Program(ops=[op(IO_OP_SAMPLE), op(IO_OP_WAIT_HIGH, 0b10), op(IO_OP_SAMPLE)], mask=0xFF,
+                                 levels=0, modes=0, inputs=[0x01, 0x00], result=IO_EXEC_TIMEOUT, samples=[0x01],
+                                 final_levels=0, final_modes=0, calls=[('InputGetAll',)] * 2, timeout_us=200),
+    'unknown_op': Program(ops=[op(IO_OP_LEVELS, 0b1), op(0x7F)], mask=0b1, levels=0, modes=0xFF,
+                          inputs=[], result=IO_EXEC_FAIL, samples=[], final_levels=0b1, final_modes=0xFF,
+                          calls=[('SetAll', 0b1)]),
+}
+
+
+@pytest.fixture(scope='module')
+def native_lib(tmp_path_factory) -> CDLL:
+    """
+    the libuptech_ext.so built upon a stub of the libuptech.so
+    """
+    if shutil.which('gcc') is None:
+        pytest.skip('gcc is not available')
+    build_dir = tmp_path_factory.mktemp('uptech_ext')
+    stub_source = build_dir / 'fake_uptech.c'
+    stub_source.write_text(FAKE_UPTECH_SOURCE)
+    lib_path = build_dir / 'libuptech_ext.so'
+    build = subprocess.run(['gcc', '-shared', '-fPIC', '-O2', '-o', str(lib_path), str(stub_source),
+                            UPTECH_EXT_SOURCE], capture_output=True, text=True)
+    if build.returncode:
+        pytest.skip(f'failed to build the libuptech_ext.so: {build.stderr}')
+    return declare_prototypes(CDLL(str(lib_path)), UPTECH_EXT_PROTOTYPES)
+
+
+@pytest.fixture
+def native_io_exec(native_lib, fake_lib) -> Callable[..., int]:
+    """
+    the native uptech_io_exec, playing on the same fake as the fallback does
+    """
+    callbacks = (INPUT_GET_ALL(fake_lib.adc_io_InputGetAll),
+                 SET_ALL(fake_lib.adc_io_SetAll),
+                 MODE_SET_ALL(fake_lib.adc_io_ModeSetAll))
+    native_lib.fake_bind(*callbacks)
+    yield native_lib.uptech_io_exec
+    del callbacks
+
+
+def play(io_exec: Callable[..., int], program: Program, fake_lib) -> None:
+    """
+    play the program and check the results against the expected ones
+    """
+    fake_lib.io_output_levels = program.levels
+    fake_lib.io_modes = program.modes
+    fake_lib.inputs = list(program.inputs)
+    level_ref = (c_uint8 * 1)(program.levels)
+    mode_ref = (c_uint8 * 1)(program.modes)
+    samples = (c_uint8 * 8)()
+    ops = (c_uint16 * len(program.ops))(*program.ops)
+
+    start = perf_counter_ns()
+    result = io_exec(ops, len(program.ops), program.mask, level_ref, mode_ref, samples, program.half_period_us,
+                     program.timeout_us)
+    elapsed = perf_counter_ns() - start
+
+    assert result == program.result
+    assert list(samples[:len(program.samples)]) == program.samples
+    assert not any(samples[len(program.samples):])
+    assert (level_ref[0], mode_ref[0]) == (program.final_levels, program.final_modes)
+    assert (fake_lib.io_output_levels, fake_lib.io_modes) == (program.final_levels, program.final_modes)
+    if result == IO_EXEC_TIMEOUT:
+        # the count of the polls depends on the timing
+        assert fake_lib.calls[:len(program.calls)] == program.calls
+        assert set(fake_lib.calls) == {('InputGetAll',)}
+        assert elapsed >= program.timeout_us * 1000
+    else:
+        assert fake_lib.calls == program.calls
+    delay_half_periods = sum(o & 0xFF for o in program.ops if o >> 8 == IO_OP_DELAY)
+    assert elapsed >= delay_half_periods * program.half_period_us * 1000
+
+
+@pytest.mark.parametrize('name', PROGRAMS)
+def test_io_exec_fallback(name, fake_lib):
+    play(OnBoardSensors._io_exec_fallback, PROGRAMS[name], fake_lib)
+
+
+@pytest.mark.parametrize('name', PROGRAMS)
+def test_io_exec_native_matches_fallback(name, fake_lib, native_io_exec):
+    play(native_io_exec, PROGRAMS[name], fake_lib)
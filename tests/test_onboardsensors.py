@@ -0,0 +1,62 @@
+import ctypes
+
+from ..module.libuptech import READ_FAIL_ADC, READ_FAIL_IO, READ_FAIL_GYRO, IO_OP_LEVELS
+from ..module.onboardsensors import OnBoardSensors
+
+
+def test_read_all(fake_lib):
+    fake_lib.adc_values = list(range(10))
+    fake_lib.io_input_levels = 0x5A
+    frame = OnBoardSensors.read_all()
+    assert list(frame['adc']) == list(range(10))
+    assert frame['io'] == 0x5A
+    assert OnBoardSensors.read_all_failures() == 0
+
+
+def test_read_all_reports_the_failures(fake_lib):
+    fake_lib.io_input_levels = 0x5A
+    OnBoardSensors.read_all()
+    fake_lib.ADC_GetAll = lambda buffer: -1
+    fake_lib.adc_io_InputGetAll = lambda: -1
+    fake_lib.mpu6500_Get_Gyro = lambda buffer: -1
+    OnBoardSensors.bind_lib(fake_lib)
+    frame = OnBoardSensors.read_all()
+    assert OnBoardSensors.read_all_failures() == READ_FAIL_ADC | READ_FAIL_IO | READ_FAIL_GYRO
+    # the stale value is kept instead of the error code
+    assert frame['io'] == 0x5A
+
+
+def test_masked_levels_with_an_unknown_shadow(fake_lib):
+    fake_lib.io_modes = 0x0F
+    fake_lib.io_output_levels = 0x05
+    fake_lib.io_input_levels = 0xF0
+    assert OnBoardSensors.set_io_levels_masked(0x02, 0x02) == 0
+    assert fake_lib.calls == [('InputGetAll',), ('SetAll', 0xF7)]
+    assert OnBoardSensors._io_level_shadow == 0xF7
+    # the shadow is known now, the same levels are not written again
+    assert OnBoardSensors.set_io_levels_masked(0x02, 0x02) == 0
+    assert fake_lib.calls == [('InputGetAll',), ('SetAll', 0xF7)]
+
+
+def test_masked_levels_propagate_the_failures(fake_lib):
+    fake_lib.adc_io_InputGetAll = lambda: -1
+    OnBoardSensors.bind_lib(fake_lib)
+    assert OnBoardSensors.set_io_levels_masked(0x02, 0x02) == -1
+    assert OnBoardSensors._io_level_shadow is None
+
+    fake_lib = type(fake_lib)()
+    fake_lib.adc_io_SetAll = lambda levels: -1
+    OnBoardSensors.bind_lib(fake_lib)
+    assert OnBoardSensors.set_io_levels_masked(0x02, 0x02) == -1
+    assert OnBoardSensors._io_level_shadow is None
+
+
+def test_io_exec_keeps_the_latches_of_the_input_channels(fake_lib):
+    fake_lib.io_modes = 0x0F
+    fake_lib.io_output_levels = 0x05
+    fake_lib.io_input_levels = 0xF0
+    ops = (ctypes.c_uint16 * 1)(IO_OP_LEVELS << 8 | 0x00)
+    samples = (ctypes.c_uint8 * 1)()
+    assert OnBoardSensors.io_exec(ops, 1, 0x01, samples, 5) == 0
+    assert fake_lib.calls[-1] == ('SetAll', 0xF4)
+    assert OnBoardSensors._io_level_shadow == 0xF4
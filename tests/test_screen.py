@@ -0,0 +1,37 @@
+import pytest
+
+from ..module.screen import Widget, TextField, Pen
+
+
+class CountingFormat(str):
+    """
+    a fmt that counts how many times it formats
+    """
+    calls = 0
+
+    def format(self, *args, **kwargs) -> str:
+        CountingFormat.calls += 1
+        return super().format(*args, **kwargs)
+
+
+def test_widget_without_draw_fails_on_creation():
+    class Blank(Widget):
+        pass
+
+    with pytest.raises(TypeError):
+        Blank()
+
+
+def test_text_field_formats_once_per_render():
+    CountingFormat.calls = 0
+    field = TextField(0, 0, CountingFormat('adc: {:4d}'), 12)
+    pen = Pen()
+    field.render(pen, 0)
+    assert CountingFormat.calls == 1
+    assert field._drawn_text == 'adc:   12'
+    field.render(pen, 0)
+    assert CountingFormat.calls == 2
+    field.value = 345
+    field.render(pen, 0)
+    assert CountingFormat.calls == 3
+    assert field._drawn_text == 'adc:  345'
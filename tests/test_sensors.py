@@ -0,0 +1,37 @@
+from itertools import count
+
+from ..module.sensors import SensorHub, TraceReplayer, record_trace
+
+
+def record_counter_trace(file_path: str) -> int:
+    counter = count()
+    return record_trace(lambda: (next(counter),), file_path, duration=5, interval=1.)
+
+
+def test_stepped_replay_advances_only_on_step(tmp_path):
+    path = str(tmp_path / 'adc.trace')
+    record_counter_trace(path)
+    replayer = TraceReplayer(path, stepped=True)
+    first = replayer.full_updater()
+    hub = SensorHub(replayer.updaters, (None, None), (None, None), (None, None))
+    hub.refresh(SensorHub.ON_BOARD_ADC)
+    # the first read of the hub and the watchers in the same tick see the same sample
+    assert replayer.full_updater() == first
+    assert replayer.indexed_updater(0) == first[0]
+    replayer.step()
+    assert replayer.full_updater() == replayer.samples[1]
+    assert replayer.full_updater() == replayer.samples[1]
+
+
+def test_stepped_replay_holds_the_last_sample(tmp_path):
+    path = str(tmp_path / 'adc.trace')
+    record_counter_trace(path)
+    replayer = TraceReplayer(path, stepped=True)
+    for _ in range(len(replayer.samples) - 1):
+        assert not replayer.finished
+        replayer.step()
+    assert replayer.finished
+    replayer.step()
+    assert replayer.full_updater() == replayer.samples[-1]
+    replayer.restart()
+    assert replayer.full_updater() == replayer.samples[0]
@@ -0,0 +1,40 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+try:
+    from ..module.tagdetector import TagDetector, calc_track_box
+except OSError as e:
+    # the libreg.so is built from src/reg.c
+    pytest.skip(f'the native libs are not built: {e}', allow_module_level=True)
+
+
+def fake_tag(*corners) -> SimpleNamespace:
+    return SimpleNamespace(corners=np.array(corners, dtype=float))
+
+
+def test_track_box_past_the_edge_is_none():
+    tag = fake_tag((700, 10), (720, 10), (720, 30), (700, 30))
+    assert calc_track_box([tag], (480, 640), 0.1) is None
+
+
+def test_track_box_is_clipped():
+    tag = fake_tag((600, 10), (630, 10), (630, 40), (600, 40))
+    assert calc_track_box([tag], (480, 640), 0.5) == (585, 0, 640, 56)
+
+
+def test_empty_roi_falls_back_to_the_full_scan():
+    detector = object.__new__(TagDetector)
+    scanned = []
+    detector._tag_detect = lambda gray: scanned.append(gray.shape) or []
+    detector._tracking_mode = True
+    # the box of a larger resolution, out of the current frame
+    detector._track_box = (700, 500, 760, 560)
+    detector._last_full_scan = float('inf')
+    detector._full_scan_interval = 1.
+    detector._roi_misses = 0
+    detector._max_roi_misses = 3
+    assert detector._detect(np.zeros((480, 640), dtype=np.uint8)) == []
+    assert scanned == [(480, 640)]
+    assert detector._track_box is None
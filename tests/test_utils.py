@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from ..module.utils import IncrementalGrayHist, PreprocessStage, calcGrayHist
+
+
+def test_gray_hist_copies_the_reused_frame():
+    frame = np.full((32, 32), 10, dtype=np.uint8)
+    hist = IncrementalGrayHist(stride=1)
+    hist.update(frame)
+    # the caller reuses the buffer for the next frame
+    frame.fill(200)
+    hist.update(frame)
+    assert hist.hist[200] == frame.size
+    assert hist.hist[10] == 0
+
+
+def test_gray_hist_never_writes_the_frame_of_the_caller():
+    first = np.full((32, 32), 10, dtype=np.uint8)
+    hist = IncrementalGrayHist(stride=1)
+    hist.update(first)
+    # changes every pixel, so the update falls back to the recount and swaps the buffers
+    hist.update(np.full((32, 32), 50, dtype=np.uint8))
+    hist.update(np.full((32, 32), 90, dtype=np.uint8))
+    assert (first == 10).all()
+    assert hist.hist[90] == first.size
+
+
+def test_gray_hist_matches_the_recompute():
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, (64, 64), dtype=np.uint8)
+    hist = IncrementalGrayHist(stride=4, tolerance=0)
+    hist.update(frame)
+    for _ in range(5):
+        frame = frame.copy()
+        frame[rng.integers(0, 64, 20), rng.integers(0, 64, 20)] = rng.integers(0, 256, 20, dtype=np.uint8)
+        hist.update(frame)
+        assert (hist.hist == calcGrayHist(frame, 4)).all()
+    assert hist.incremental_updates > 0
+
+
+def test_preprocess_stage_without_call_fails_on_creation():
+    class Blank(PreprocessStage):
+        name = 'blank'
+
+    with pytest.raises(TypeError):
+        Blank()
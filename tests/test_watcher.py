@@ -0,0 +1,44 @@
+import pytest
+
+from ..module.onboardsensors import OnBoardSensors, SampleCache, IO_SOURCE, IO_LEVEL_TABLE, HIGH, LOW
+from ..module.watcher import build_io_watcher_from_packed, build_io_watcher_from_indexed
+
+WATCHED_CHANNELS = [
+    ([0], [HIGH]),
+    ([3], [LOW]),
+    ([0, 1], [HIGH, HIGH]),
+    ([2, 5, 7], [LOW, HIGH, LOW]),
+    (list(range(8)), [HIGH, LOW] * 4),
+]
+
+
+def test_io_level_table():
+    for packed in range(256):
+        assert IO_LEVEL_TABLE[packed] == tuple(packed >> i & 1 for i in range(8))
+
+
+@pytest.mark.parametrize('use_any', [False, True])
+@pytest.mark.parametrize('sensor_ids, describer', WATCHED_CHANNELS)
+def test_packed_watcher_matches_the_indexed_one(sensor_ids, describer, use_any):
+    for packed in range(256):
+        packed_watcher = build_io_watcher_from_packed(lambda: packed, sensor_ids, describer, use_any)
+        indexed_watcher = build_io_watcher_from_indexed(lambda index: packed >> index & 1, sensor_ids, describer,
+                                                        use_any)
+        assert packed_watcher() == indexed_watcher(), f'levels {packed:08b}'
+
+
+def test_packed_watcher_rejects_unpaired_describers():
+    with pytest.raises(IndexError):
+        build_io_watcher_from_packed(lambda: 0, [0, 1], [HIGH])
+
+
+def test_packed_watcher_reads_the_board(fake_lib):
+    io_cache = SampleCache.get_cache(IO_SOURCE)
+    watcher = build_io_watcher_from_packed(OnBoardSensors.io_all_channels_packed, [1, 6], [HIGH, LOW])
+    fake_lib.io_input_levels = 0b00000010
+    io_cache.invalidate()
+    assert watcher()
+    assert OnBoardSensors.io_all_channels() == (0, 1, 0, 0, 0, 0, 0, 0)
+    fake_lib.io_input_levels = 0b01000010
+    io_cache.invalidate()
+    assert not watcher()